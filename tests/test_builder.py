@@ -2,6 +2,7 @@ from warmth.build import single_node, Builder,Results,Grid
 from warmth.parameters import Parameters
 import numpy as np
 import pandas as pd
+import pytest
 tidy_sediments = single_node._tidy_sediments
 
 def test_tidy_sediments_onlap():
@@ -165,3 +166,67 @@ def test_grid():
                               [5, 4]])
     assert np.allclose(g.indexing_arr,indexer_check) == True
     assert g.indexing_arr.dtype == 'int64'
+
+def test_node_result_series_cache():
+    sed_data = {"top":[0,100,200],"topage":[0,10,20],"k_cond":np.full(3,1),"rhp":np.full(3,1e-7),
+        "phi":np.full(3,0.55),"decay":np.full(3,0.49),"solidus":np.full(3,2700),"liquidus":np.full(3,2400),
+        "strat":["Onlap","Onlap","Erosion"],"horizonIndex":np.arange(3)}
+    n = single_node()
+    n.sediments_inputs = pd.DataFrame.from_dict(sed_data)
+    n._depth_out = np.array([[0,100,200,300,400,500,600],[np.nan,0,100,200,400,500,600]]).T
+    n.temperature_out = np.array([[5,20,30,40,50,60,70],[np.nan,5,20,30,50,60,70]]).T
+    n._idsed = np.array([[0,1,-1,-2,-3,-3],[np.nan,1,-1,-2,-3,-3]]).T
+    assert np.allclose(n.subsidence, [0, 0])
+    assert np.allclose(n.crust_ls, [100, 100])
+    assert np.allclose(n.lith_ls, [100, 200])
+    assert np.allclose(n.sed_thickness_ls, [200, 100])
+    assert n.result is n.result
+    # replacing result arrays invalidates the cache
+    n._depth_out = n._depth_out + 10
+    assert np.allclose(n.subsidence, [10, 10])
+    # and so do new conductivities
+    res = n.result
+    n.kCrust = 3.0
+    assert n.result is not res
+    assert n.result._k_crust == 3.0
+    # the series are copies, callers may modify them
+    n.subsidence[0] = 1e3
+    assert np.allclose(n.subsidence, [10, 10])
+
+def test_results_all_ages():
+    sed_data = {"top":[0,100,200],"topage":[0,10,20],"k_cond":np.full(3,1),"rhp":np.full(3,1e-7),
+        "phi":np.full(3,0.55),"decay":np.full(3,0.49),"solidus":np.full(3,2700),"liquidus":np.full(3,2400),
+        "strat":["Onlap","Onlap","Erosion"],"horizonIndex":np.arange(3)}
+    sed = pd.DataFrame.from_dict(sed_data)
+    d = np.array([[0,100,200,300,400,500,600],[np.nan,0,100,200,400,500,600]]).T
+    t = np.array([[5,20,30,40,50,60,70],[np.nan,5,20,30,50,60,70]]).T
+    idsed = np.array([[0,1,-1,-2,-3,-3],[np.nan,1,-1,-2,-3,-3]]).T
+    r = Results(d,t,idsed,sed,2,3,5)
+    for age in r.ages:
+        np.testing.assert_almost_equal(r.top_crust_all_ages()[age],r.top_crust(age))
+        np.testing.assert_almost_equal(r.top_lithosphere_all_ages()[age],r.top_lithosphere(age))
+        np.testing.assert_almost_equal(r.top_asthenosphere_all_ages()[age],r.top_asthenosphere(age))
+        np.testing.assert_almost_equal(r.crust_thickness_all_ages()[age],r.crust_thickness(age))
+        np.testing.assert_almost_equal(r.lithosphere_thickness_all_ages()[age],r.lithosphere_thickness(age))
+        np.testing.assert_almost_equal(r.seabed_all_ages()[age],r.seabed(age))
+        np.testing.assert_almost_equal(r.basement_heatflow_all_ages()[age],r.basement_heatflow(age))
+        np.testing.assert_array_almost_equal(r.heatflow_all_ages()[:,age],r.heatflow(age)["values"])
+    # results are copies of the cached arrays, callers may modify them
+    hf = r.heatflow_all_ages()
+    hf[:] = 0
+    r.heatflow(0)["values"][:] = 0
+    r.sediment_porosity(0)["values"][:] = 0
+    assert np.nansum(np.abs(r.heatflow_all_ages())) > 0
+    assert np.nansum(np.abs(r.heatflow(0)["values"])) > 0
+    temp = r.temperature_at_depths([0,50,600,700])
+    assert temp.shape == (4,2)
+    np.testing.assert_array_almost_equal(temp,np.array([[5,5],[12.5,12.5],[70,70],[np.nan,np.nan]]))
+
+def test_eustatic_sea_level_at():
+    p = Parameters()
+    p.eustatic_sea_level = {"age": np.array([0, 10.4, 10, 11]), "sea_level_changes": np.array([1.0, 2.0, 3.0, 4.0])}
+    assert p.eustatic_sea_level_at(10) == 3.0
+    assert p.eustatic_sea_level_at(11) == 4.0
+    for age in [10.4, 5, 12]:
+        with pytest.raises(IndexError):
+            p.eustatic_sea_level_at(age)
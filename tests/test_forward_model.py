@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import interpolate
 from warmth.forward_modelling import Forward_model
 
 def test_pad_multirift_results():
@@ -14,6 +15,36 @@ def test_pad_multirift_results():
     assert r.shape == holder.shape
     assert np.all(np.isnan(r[10:,:]))
 
+def test_grain_thickness_compaction():
+    xsed = np.array([0, 100, 250, 400, 600], dtype=float)
+    idsed = np.array([0, 0, 1, 1], dtype=np.int32)
+    phi0 = np.array([0.6, 0.4])
+    decay = np.array([0.5, 0.3])
+    fw = Forward_model.__new__(Forward_model)
+    # grain thickness of the cells at their current depth
+    top_km, base_km = xsed[:-1]/1e3, xsed[1:]/1e3
+    grain = (base_km-top_km)*(1+phi0[idsed]/decay[idsed]*Forward_model._phi1(base_km, top_km, -decay[idsed]))*1e3
+    recompacted = fw._recompact_old_sediments(50.0, xsed, idsed, phi0, decay)
+    compacted = fw._compact_old_sediments(50.0, grain, xsed[1:], idsed, phi0, decay)
+    np.testing.assert_allclose(compacted, recompacted, atol=1e-3)
+    # irreversible compaction: sediments buried deeper before keep their thickness when uplifted
+    compacted_shallow = fw._compact_old_sediments(0.0, grain, xsed[1:]+1000, idsed, phi0, decay)
+    assert np.all(np.diff(np.append(0, compacted_shallow)) < np.diff(xsed))
+    # remeshing conserves the total grain thickness
+    xsed_remeshed = np.linspace(0, 610, 8)
+    grain_remeshed, maxburial_remeshed = Forward_model._remesh_grain_thickness(xsed, grain, xsed[1:], xsed_remeshed)
+    assert grain_remeshed.size == 7
+    np.testing.assert_allclose(np.sum(grain_remeshed), np.sum(grain))
+    np.testing.assert_allclose(maxburial_remeshed, xsed_remeshed[1:])
+
+def test_pchip_interpolate():
+    rng = np.random.default_rng(1)
+    x = np.cumsum(rng.uniform(100, 1000, 50))
+    for y in [np.sort(rng.uniform(0, 1330, 50)), rng.uniform(0, 1330, 50), np.minimum(x, 20000)]:
+        x_new = np.sort(rng.uniform(x[0]-500, x[-1]+500, 200))
+        np.testing.assert_allclose(Forward_model._pchip_interpolate(x, y, x_new), interpolate.pchip_interpolate(x, y, x_new), rtol=1e-10, atol=1e-9)
+    np.testing.assert_allclose(Forward_model._pchip_interpolate(x[:2], y[:2], x_new), interpolate.pchip_interpolate(x[:2], y[:2], x_new))
+
 # def instantiate_test_model():
 #     example_model_path = './tests/data/example_model.pickle'
 #     with open(example_model_path, 'rb') as file:
@@ -79,3 +79,26 @@ def test_integration_multi_rift():
     np.testing.assert_almost_equal(node.result._temperature,ref_t,decimal=2)
     np.testing.assert_almost_equal(node.result._depth,ref_d,decimal=2)
     np.allclose(node.result._sediments_ids,red_s)
+
+def test_beta_trial_continuation():
+    results = []
+    for continuation in [False, True]:
+        model = warmth.Model()
+        sed = sediments(model.builder.single_node_sediments_inputs_template)
+        node = warmth.single_node()
+        node.sediments_inputs = sed
+        node.qbase = 30e-3
+        node.crustRHP = (60e-3-node.qbase)/node.hc/0.5
+        node.rift = np.array([[120,100]])
+        model.parameters.time_start = 160
+        model.parameters.time_end = 0
+        model.parameters.beta_trial_continuation = continuation
+        model.builder.nodes = [[node]]
+        model.builder.set_eustatic_sea_level(haq87)
+        fw = Forward_model(model.parameters, node)
+        fw.simulate_single_node()
+        results.append(fw.current_node)
+    assert results[0].total_beta_tested > 1
+    np.testing.assert_array_equal(results[0].beta, results[1].beta)
+    np.testing.assert_array_equal(results[0].result._temperature, results[1].result._temperature)
+    np.testing.assert_array_equal(results[0].result._depth, results[1].result._depth)
@@ -0,0 +1,74 @@
+from warmth.mesh_output import XdmfTimeSeriesWriter, BackgroundWriter, Checkpoint, save_checkpoint, load_checkpoint, latest_checkpoint
+import xml.etree.ElementTree as ET
+import numpy as np
+import pytest
+import h5py
+
+def test_xdmf_time_series_writer(tmp_path):
+    points = np.array([[0,0,0],[1,0,0],[0,1,0],[0,0,1],[1,1,1]], dtype=np.float64)
+    cells = np.array([[0,1,2,3],[1,2,3,4]])
+    filename = str(tmp_path / "series.xdmf")
+    with XdmfTimeSeriesWriter(filename) as writer:
+        writer.write(2, points, cells, point_data={"Temperature": np.arange(5)}, topology_cell_data={"LayerID": [0, 1]})
+        writer.write(1, points, cells, point_data={"Temperature": np.arange(5)+1}, topology_cell_data={"LayerID": [0, 1]})
+        # readable while the series is written
+        assert len(ET.parse(filename).getroot().findall("./Domain/Grid/Grid")) == 2
+        points2 = points.copy()
+        points2[:,2] = points2[:,2] + 10
+        writer.write(0, points2, cells, point_data={"Temperature": np.arange(5)+2}, topology_cell_data={"LayerID": [0, 1]})
+        # new layer IDs on the same cells give a new topology
+        writer.write(-1, points2, cells, point_data={"Temperature": np.arange(5)+3}, topology_cell_data={"LayerID": [0, 2]})
+    with h5py.File(str(tmp_path / "series.h5"), "r") as f:
+        # topology and layer IDs written once per change, geometry only when the vertices moved
+        assert sorted(f["mesh"].keys()) == ["geometry0", "geometry1", "topology0", "topology0_LayerID", "topology1", "topology1_LayerID"]
+        np.testing.assert_array_equal(f["fields/Temperature/2"][:], np.arange(5)+2)
+        np.testing.assert_array_equal(f["mesh/topology1_LayerID"][:], [0, 2])
+        assert "LayerID" not in f["fields"]
+    grids = ET.parse(filename).getroot().findall("./Domain/Grid/Grid")
+    assert [ g.find("Time").get("Value") for g in grids ] == ["2", "1", "0", "-1"]
+    assert [ g.find("Geometry/DataItem").text for g in grids ] == ["series.h5:/mesh/geometry0"]*2 + ["series.h5:/mesh/geometry1"]*2
+    assert grids[0].find("Topology").get("TopologyType") == "Tetrahedron"
+    assert [ a.get("Name") for a in grids[0].findall("Attribute") ] == ["Temperature", "LayerID"]
+    assert [ g.find("Attribute[@Name='LayerID']/DataItem").text for g in grids ] == ["series.h5:/mesh/topology0_LayerID"]*3 + ["series.h5:/mesh/topology1_LayerID"]
+
+def test_background_writer():
+    done = []
+    with BackgroundWriter(max_pending=1) as background:
+        for i in range(5):
+            background.submit(done.append, i)
+        background.wait()
+        assert done == [0, 1, 2, 3, 4]
+    background = BackgroundWriter()
+    background.submit(np.zeros, -1)
+    with pytest.raises(ValueError):
+        background.close()
+
+def test_background_writer_failing_task():
+    done = []
+    background = BackgroundWriter(max_pending=4)
+    background.submit(np.zeros, -1)
+    background.submit(done.append, 1)
+    with pytest.raises(ValueError):
+        background.wait()
+    # tasks queued after the failure still ran, and the error is reported again
+    assert done == [1]
+    with pytest.raises(ValueError):
+        background.submit(done.append, 2)
+    with pytest.raises(ValueError):
+        background.close()
+    assert done == [1]
+    assert not background.thread.is_alive()
+
+def test_checkpoint_save_load(tmp_path):
+    directory = str(tmp_path / "checkpoints")
+    assert latest_checkpoint(directory) is None
+    for tti in [20, 10]:
+        cp = Checkpoint(tti=tti, mesh_vertices=np.random.rand(6,3), temperature=np.arange(6)*float(tti),
+            solver_options={"solverType": "cg-hypre", "petscOptions": {"ksp_rtol": 1e-8}})
+        save_checkpoint(cp, directory)
+    filename = latest_checkpoint(directory)
+    cp2 = load_checkpoint(filename)
+    assert cp2.tti == 10
+    np.testing.assert_array_equal(cp2.mesh_vertices, cp.mesh_vertices)
+    np.testing.assert_array_equal(cp2.temperature, cp.temperature)
+    assert cp2.solver_options == cp.solver_options
@@ -0,0 +1,75 @@
+from warmth.build import Grid
+from warmth.mesh_utils import grid_index_of_points, temperature_from_1d_nodes, GridInterpolator, quadtree_node_mask, interpolate_column_rows
+from scipy.spatial import Delaunay
+from types import SimpleNamespace
+import numpy as np
+
+def test_grid_index_of_points():
+    g = Grid(10.2, 100.3, 5, 6, 105.5, 102.5)
+    loc = g._location_xtgeo
+    i, j, found = grid_index_of_points(loc[:,0], loc[:,1], g)
+    assert np.all(found)
+    assert np.allclose(np.stack([j,i],axis=1), g.indexing_arr)
+    # off-node and outside positions are not found
+    i, j, found = grid_index_of_points([10.2+50, 10.2-105.5, 432.2], [100.3, 100.3, 612.8+0.05], g)
+    assert np.allclose(found, [False, False, True])
+    assert (i[2], j[2]) == (4, 5)
+
+def _node_with_temperature(offset):
+    temp = {"depth":np.array([0.0,1000.0,np.nan]), "values":np.array([offset, offset+30.0, np.nan])}
+    return SimpleNamespace(result=SimpleNamespace(temperature=lambda age: temp))
+
+def test_temperature_from_1d_nodes():
+    g = Grid(0, 0, 2, 2, 100, 100)
+    nodes = np.full((2,2), None, dtype=object)
+    nodes[0,0] = _node_with_temperature(0.0)
+    nodes[0,1] = _node_with_temperature(10.0)
+    nodes[1,0] = _node_with_temperature(20.0)
+    points = np.array([[0,0,500], [50,0,0], [50,50,1000], [-20,120,0]])
+    np.testing.assert_array_almost_equal(temperature_from_1d_nodes(points, 0, nodes, g), [15, 5, 40, 20])
+    # no node with results near the point
+    nodes[1,0] = SimpleNamespace(result=None)
+    t = temperature_from_1d_nodes(np.array([[0,100,0]]), 0, nodes, g)
+    assert np.isnan(t[0])
+
+def test_grid_interpolator():
+    g = Grid(0, 0, 3, 2, 100, 100)
+    values = np.array([[0.0, 10.0, 20.0], [100.0, 110.0, np.nan]])
+    interp = GridInterpolator(g, values)
+    res = interp([0, 50, 100, 200+0.005, 250, 50, 150], [0, 50, 100, 0, 0, -0.005, 50])
+    np.testing.assert_array_almost_equal(res, [0, 55, 110, 20, np.nan, 5, np.nan])
+
+def test_quadtree_node_mask():
+    refine = np.zeros((41, 50), dtype=bool)
+    refine[20, 30] = True
+    mask = quadtree_node_mask(refine, coarse_every=8)
+    assert mask[0,0] and mask[0,-1] and mask[-1,0] and mask[-1,-1]
+    assert np.all(mask[18:23, 28:33])
+    assert mask[8,8] and not mask[3,3]
+    assert mask.sum() < mask.size/4
+    # triangulated without hanging nodes: covers the grid, and no node lies inside a triangle edge
+    j, i = np.nonzero(mask)
+    xy = np.stack([i, j], axis=1).astype(np.float64)
+    tri = Delaunay(xy).simplices
+    p = xy[tri]
+    area = 0.5*np.abs((p[:,1,0]-p[:,0,0])*(p[:,2,1]-p[:,0,1]) - (p[:,2,0]-p[:,0,0])*(p[:,1,1]-p[:,0,1]))
+    assert np.all(area > 0)
+    np.testing.assert_allclose(area.sum(), 49*40)
+    edges = np.sort(np.concatenate([tri[:,[0,1]], tri[:,[1,2]], tri[:,[0,2]]]), axis=1)
+    _, count = np.unique(edges, axis=0, return_counts=True)
+    boundary_edges = np.sum(count == 1)
+    assert np.all(count <= 2)
+    on_boundary = (xy[:,0] == 0) | (xy[:,0] == 49) | (xy[:,1] == 0) | (xy[:,1] == 40)
+    assert boundary_edges == np.sum(on_boundary)
+
+def test_interpolate_column_rows():
+    z = np.array([[0.0, 10.0, 10.0, 30.0, 50.0], [0.0, 0.0, 20.0, 40.0, 60.0]])
+    rows = np.array([0, 3, 4])
+    values = np.array([[5.0, 35.0, 55.0], [1.0, 3.0, 4.0]])
+    res = interpolate_column_rows(values.flatten(), rows, z).reshape(2, 5)
+    np.testing.assert_array_equal(res[:, rows], values)
+    np.testing.assert_allclose(res[0], [5, 15, 15, 35, 55])
+    np.testing.assert_allclose(res[1], [1, 1, 2, 3, 4])
+    # rows below the last given row take its value
+    res = interpolate_column_rows(values[:, :2], rows[:2], z).reshape(2, 5)
+    np.testing.assert_allclose(res[:, 4], [35, 3])
@@ -0,0 +1,39 @@
+from warmth.resqpy_helpers import unique_faces, write_hexa_grid_with_properties, write_tetra_grid_with_properties
+import resqpy.model as rq
+import resqpy.unstructured as rug
+import numpy as np
+
+def _two_hexahedra():
+    x, y, z = np.meshgrid([0.0, 1.0, 2.0], [0.0, 1.0], [0.0, 1.0], indexing="ij")
+    nodes = np.stack([x.flatten(), y.flatten(), z.flatten()], axis=1)
+    def idx(i, j, k):
+        return (i*2 + j)*2 + k
+    cells = np.array([ [idx(i,0,0), idx(i+1,0,0), idx(i+1,1,0), idx(i,1,0), idx(i,0,1), idx(i+1,0,1), idx(i+1,1,1), idx(i,1,1)] for i in range(2) ])
+    return nodes, cells
+
+def test_unique_faces():
+    nodes, cells = _two_hexahedra()
+    nodes_per_face, faces_per_cell, repeated = unique_faces(cells, [[0,3,2,1], [0,1,5,4], [1,2,6,5], [2,3,7,6], [3,0,4,7], [4,5,6,7]])
+    assert nodes_per_face.shape == (11, 4)
+    # the shared face is face 2 of the first cell and face 4 of the second cell
+    assert faces_per_cell[6+4] == faces_per_cell[2]
+    assert np.count_nonzero(repeated) == 1 and repeated[6+4]
+    assert np.array_equal(np.unique(faces_per_cell), np.arange(11))
+
+def test_write_hexa_grid_shared_faces(tmp_path):
+    nodes, cells = _two_hexahedra()
+    filename = str(tmp_path / "hexa.epc")
+    write_hexa_grid_with_properties(filename, nodes, cells, "hexamesh", lid_per_cell=np.array([0, 1]))
+    model = rq.Model(filename)
+    hexa = rug.HexaGrid(model, uuid = model.uuid(obj_type = 'UnstructuredGridRepresentation', title = "hexamesh"))
+    assert hexa.cell_count == 2
+    assert hexa.face_count == 11
+
+def test_write_tetra_grid_shared_faces(tmp_path):
+    nodes = np.array([[0,0,0],[1,0,0],[0,1,0],[0,0,1],[1,1,1]], dtype=np.float64)
+    cells = np.array([[0,1,2,3],[1,2,3,4]])
+    filename = str(tmp_path / "tetra.epc")
+    write_tetra_grid_with_properties(filename, nodes, cells, "tetramesh", lid_per_cell=np.array([0, 1]))
+    model = rq.Model(filename)
+    tetra = rug.TetraGrid(model, uuid = model.uuid(obj_type = 'UnstructuredGridRepresentation', title = "tetramesh"))
+    assert tetra.face_count == 7
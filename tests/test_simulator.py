@@ -0,0 +1,23 @@
+import numpy as np
+from warmth.simulator import adaptive_full_simulation_nodes
+
+def test_adaptive_full_simulation_nodes():
+    valid = np.ones((33, 41), dtype=bool)
+    valid[:4, :4] = False
+    # smooth field: the initial lattice is enough
+    calls = []
+    def smooth(index):
+        calls.append(index)
+        return np.array([0.01*index[0]+0.02*index[1]])
+    full = adaptive_full_simulation_nodes(valid, smooth, initial_every=8)
+    assert len(calls) == len(full) == len(set(calls))
+    assert (8, 16) in full and (32, 40) in full and (9, 16) not in full
+    assert all(valid[i] for i in full)
+    # step in beta between columns 20 and 21: refined down to neighbouring nodes along the step only
+    def step(index):
+        return np.array([0.0 if index[1] <= 20 else 5.0])
+    full_step = adaptive_full_simulation_nodes(valid, step, initial_every=8)
+    assert full <= full_step
+    assert all((r, 20) in full_step and (r, 21) in full_step for r in range(4, 33))
+    assert all(abs(c-20.5) < 4 or c % 8 == 0 or c == 40 for r, c in full_step)
+    assert len(full_step) < valid.sum()/4
@@ -109,12 +109,55 @@ class single_node:
         self._crust_ls:np.ndarray[np.float64]|None=None
         self._lith_ls:np.ndarray[np.float64]|None=None
         self._subsidence:np.ndarray[np.float64]|None=None
+        self._results_cache:dict = {}
+        self._results_cache_key:tuple|None = None
     
 
     @property
     def shf(self)->float:
         return ((self.crustRHP*self._upperCrust_ratio)*self.hc) + self.qbase
 
+    def _results_key(self)->tuple|None:
+        items = [self._depth_out,self.temperature_out,self._idsed]
+        if any(isinstance(i,type(None)) for i in items):
+            return None
+        # the Results object also depends on the sediments and the basement conductivities
+        conductivities = tuple(np.ravel([self.kCrust,self.kLith,self.kAsth]).tolist())
+        return tuple(id(i) for i in items)+tuple(i.shape for i in items)+(id(self.sediments),)+conductivities
+
+    def _cached_results(self)->dict:
+        """Results object and per-age series derived from it, computed once and reused until the result arrays, the sediments
+        or the conductivities are replaced. The cached series are read-only, the properties return copies
+
+        Returns
+        -------
+        dict
+            Empty if not simulated
+        """
+        key = self._results_key()
+        if key is None:
+            return {}
+        if getattr(self,"_results_cache_key",None) != key:
+            res = Results(self._depth_out,self.temperature_out,self._idsed,self.sediments,self.kCrust,self.kLith,self.kAsth)
+            seabed = res.seabed_all_ages()
+            top_crust = res.top_crust_all_ages()
+            top_lith = res.top_lithosphere_all_ages()
+            top_asth = res.top_asthenosphere_all_ages()
+            series = {"subsidence":seabed,"crust_ls":top_lith-top_crust,"lith_ls":top_asth-top_lith,"sed_thickness_ls":top_crust-seabed}
+            for val in series.values():
+                val.flags.writeable = False
+            series["result"] = res
+            self._results_cache = series
+            self._results_cache_key = key
+        return self._results_cache
+
+    def _clear_results_cache(self)->None:
+        """Invalidate cached results. Needed after modifying result arrays in place
+        """
+        self._results_cache = {}
+        self._results_cache_key = None
+        return
+
     @property
     def result(self)-> Results|None:
         """Results of 1D simulation
@@ -124,52 +167,33 @@ class single_node:
         Results|None
             None if not simulated
         """
-        items = [self._depth_out,self.temperature_out,self._idsed]
-        if any(isinstance(i,type(None)) for i in items):
-            return None
-        else:
-            return Results(self._depth_out,self.temperature_out,self._idsed,self.sediments,self.kCrust,self.kLith,self.kAsth)
+        return self._cached_results().get("result",None)
     @property
     def crust_ls(self)->np.ndarray[np.float64]:
-        if isinstance(self.result,Results):
-            all_age = self.result.ages
-            val = np.zeros(all_age.size)
-            for age in all_age:
-                val[age] = self.result.crust_thickness(age)
-    
-            return val
+        cache = self._cached_results()
+        if "crust_ls" in cache:
+            return cache["crust_ls"].copy()
         else:
             return self._crust_ls
     @property
     def lith_ls(self)->np.ndarray[np.float64]:
-        if isinstance(self.result,Results):
-            all_age = self.result.ages
-            val = np.zeros(all_age.size)
-            for age in all_age:
-                val[age] = self.result.lithosphere_thickness(age)
-            return val
+        cache = self._cached_results()
+        if "lith_ls" in cache:
+            return cache["lith_ls"].copy()
         else:
             return self._lith_ls          
     @property
     def subsidence(self)->np.ndarray[np.float64]:
-        if isinstance(self.result,Results):
-            all_age = self.result.ages
-            val = np.zeros(all_age.size)
-            for age in all_age:
-                val[age] = self.result.seabed(age)
-            return val
+        cache = self._cached_results()
+        if "subsidence" in cache:
+            return cache["subsidence"].copy()
         else:
             return self._subsidence 
     @property
     def sed_thickness_ls(self)->float:
-        if isinstance(self.result,Results):
-            all_age = self.result.ages
-            val = np.zeros(all_age.size)
-            for age in all_age:
-                seabed = self.result.seabed(age)
-                top_crust = self.result.top_crust(age)
-                val[age] = top_crust - seabed
-            return val
+        cache = self._cached_results()
+        if "sed_thickness_ls" in cache:
+            return cache["sed_thickness_ls"].copy()
         else:
             return self.sed[-1,1,:] - self.sed[0,0,:]
         
@@ -266,6 +290,12 @@ class single_node:
             self._sediments = self._tidy_sediments(self.sediments_inputs)
         return self._sediments
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_results_cache"] = {}
+        state["_results_cache_key"] = None
+        return state
+
     def _dump(self, filepath: Path):
         compressed_pickle_save(self, filepath)
         return
@@ -417,10 +447,9 @@ def interpolateNode(interpolationNodes: List[single_node], interpolationWeights=
     node.X = np.sum( np.array( [node.X * w for node,w in zip(interpolationNodes,iWeightNorm)] ) ) 
     node.Y = np.sum( np.array( [node.Y * w for node,w in zip(interpolationNodes,iWeightNorm)] ) )
 
-    times = range(node.result._depth.shape[1])
-    node.subsidence = np.sum( np.array( [ [node.result.seabed(t) for t in times] * w for node,w in zip(interpolationNodes,iWeightNorm)] ) , axis = 0) 
-    node.crust_ls = np.sum( np.array( [ [node.result.crust_thickness(t) for t in times] * w for node,w in zip(interpolationNodes,iWeightNorm)] ) , axis = 0) 
-    node.lith_ls = np.sum( np.array( [ [node.result.lithosphere_thickness(t) for t in times] * w for node,w in zip(interpolationNodes,iWeightNorm)] ) , axis = 0) 
+    node.subsidence = np.sum( np.array( [ node.result.seabed_all_ages() * w for node,w in zip(interpolationNodes,iWeightNorm)] ) , axis = 0) 
+    node.crust_ls = np.sum( np.array( [ node.result.crust_thickness_all_ages() * w for node,w in zip(interpolationNodes,iWeightNorm)] ) , axis = 0) 
+    node.lith_ls = np.sum( np.array( [ node.result.lithosphere_thickness_all_ages() * w for node,w in zip(interpolationNodes,iWeightNorm)] ) , axis = 0) 
 
     node.beta = np.sum( np.array( [node.beta * w for node,w in zip(interpolationNodes,iWeightNorm)] ) , axis = 0) 
     node.kAsth = np.sum( np.array( [node.kAsth * w for node,w in zip(interpolationNodes,iWeightNorm)] ) , axis = 0) 
@@ -9,14 +9,73 @@ from scipy import interpolate
 from scipy.linalg import solve_banded 
 
 
+class TemperatureWorkspace:
+    """Preallocated arrays for assembling and solving the 1D heat equation (Forward_model.calculate_new_temperature),
+    so that the time loop does not allocate new matrices and vectors at every time step.
+    The arrays grow when a longer column (e.g. more sediment cells) is needed; callers use views of the first n entries.
+    """
+    vectors = ("coord", "T", "HP", "dx", "conductivity", "conductivity_diag", "source", "density",
+               "R", "T_old", "T_last", "scratch")
+    banded = ("conductivity_packed", "time_derivative_packed", "L_packed")
+
+    def __init__(self, n_nodes: int = 0) -> None:
+        self.capacity = 0
+        self.reserve(n_nodes)
+
+    def reserve(self, n_nodes: int) -> None:
+        """Make room for a column of n_nodes nodes, growing by at least a factor two to keep reallocations rare
+        """
+        if n_nodes <= self.capacity:
+            return
+        self.capacity = max(n_nodes, 2*self.capacity)
+        for name in self.vectors:
+            setattr(self, "_"+name, np.empty(self.capacity))
+        for name in self.banded:
+            setattr(self, "_"+name, np.empty(3*self.capacity))
+        return
+
+    def vector(self, name: str, n: int) -> np.ndarray[np.float64]:
+        return getattr(self, "_"+name)[:n]
+
+    def packed(self, name: str, n: int) -> np.ndarray[np.float64]:
+        """Contiguous (3,n) view in the packed banded format of scipy.linalg.solve_banded
+        """
+        return getattr(self, "_"+name)[:3*n].reshape(3, n)
+
+
 class Forward_model:
     """1D simulation
     """
     def __init__(self, parameters: Parameters, current_node: single_node) -> None:
         self._parameters = parameters
         self.current_node = current_node
+        self._sediment_property_arrays = {}
+        self._sediment_property_source = None
+        self._workspace = TemperatureWorkspace()
         pass
 
+    def _sediment_property(self, name: str) -> np.ndarray:
+        """Column of self.current_node.sediments as array, taken from the DataFrame once per node instead of once per time step
+
+        Parameters
+        ----------
+        name : str
+            Column name, e.g. "phi", "decay", "rhp"
+
+        Returns
+        -------
+        np.ndarray
+            Property value per sediment layer
+        """
+        sediments = self.current_node.sediments
+        if self._sediment_property_source is not sediments:
+            self._sediment_property_arrays = {}
+            self._sediment_property_source = sediments
+        values = self._sediment_property_arrays.get(name)
+        if values is None:
+            values = self._sediment_property_arrays[name] = sediments[name].values
+        return values
+
     def simulate_single_node(self):
         """Start simulating self.current_node
         """
@@ -40,6 +99,8 @@ class Forward_model:
         self.current_node.sediment_fill_margin = self._parameters.sediment_fill_margin
         # Create mesh in crust and lithosphere
         self._generate_lithosphere_cells()
+        # room for the crust and lithosphere, two remeshed key depths and the surface node; grows with the sediments
+        self._workspace.reserve(self.current_node.coord_initial.size+3)
         # Calculated sedimentation rate and sediment thickness through time
         self._sedimentation()
         # Initial radiogenic heat production without sediments
@@ -147,17 +208,15 @@ class Forward_model:
             True if convergence is lower than self._parameters.convergence
         """
         converged = False
-        T_diff = T_this_step - T_last_step
-        T_diff = T_diff.astype(np.complex128)
-        T_diff = np.sqrt(T_diff)
-        convergence = np.sum((T_diff * (T_this_step - T_last_step))) / \
-            np.sum(T_this_step)
-        if convergence.real < self._parameters.convergence:
+        # real part of sum(sqrt(dT)*dT) for complex sqrt: only increases of temperature contribute
+        T_diff = np.maximum(T_this_step - T_last_step, 0)
+        convergence = np.sum(T_diff * np.sqrt(T_diff)) / np.sum(T_this_step)
+        if convergence < self._parameters.convergence:
             converged = True
         return converged
 
     @staticmethod
-    def _build_crust_lithosphere_properties(coord: np.ndarray[np.float64], base_crust_depth: float, base_lith_depth: float, crust_properties: float, lith_properties: float, asth_properties: float) -> np.ndarray[np.float64]:
+    def _build_crust_lithosphere_properties(coord: np.ndarray[np.float64], base_crust_depth: float, base_lith_depth: float, crust_properties: float, lith_properties: float, asth_properties: float, out: np.ndarray[np.float64]|None = None) -> np.ndarray[np.float64]:
         """Build cells properties in crust-lithopsheric mantle-asthenosphere
 
         Parameters
@@ -174,15 +233,16 @@ class Forward_model:
             Lithospheric mantle properties
         asth_properties : float
             Asthenosphere properties
+        out : np.ndarray[np.float64] | None, optional
+            Array of length coord.size-1 to write the properties to, by default a new array
 
         Returns
         -------
         properties : np.ndarray[np.float64]
             Array of properties. Length is coord.size-1 as properties is at the centre of cells.
         """
-        hc_idx = np.argwhere(coord <= base_crust_depth)[-1][0]
-        hlith_idx = np.argwhere(coord <= base_lith_depth)[-1][0]
-        properties = np.zeros(coord.size-1)
+        hc_idx, hlith_idx = np.searchsorted(coord, (base_crust_depth, base_lith_depth), side="right")-1
+        properties = np.zeros(coord.size-1) if out is None else out
         properties[:hc_idx] = crust_properties
         properties[hc_idx:hlith_idx] = lith_properties
         properties[hlith_idx:] = asth_properties
@@ -236,20 +296,11 @@ class Forward_model:
         coord = np.arange(0, self.current_node._ht,
                           self._parameters.resolution, dtype=np.float64)
         coord = np.append(coord, self.current_node._ht)
-        if not (self.current_node.hc in coord):
-            idx = np.argwhere(coord < self.current_node.hc)[-1][0]
-            coord_temp = np.append(coord[: idx + 1], self.current_node.hc)
-            coord = np.append(coord_temp, coord[idx + 1:])
-        else:
-            pass
-        if not (self.current_node.hLith in coord):
-            idx = np.argwhere(coord < self.current_node.hLith)[-1][0]
-            coord_temp = np.append(coord[: idx + 1], self.current_node.hLith)
-            coord = np.append(coord_temp, coord[idx + 1:])
-        else:
-            pass
-        self.current_node.ncrust = np.argwhere(
-            coord == self.current_node.hc)[0][0]+1
+        for key_depth in (self.current_node.hc, self.current_node.hLith):
+            idx = np.searchsorted(coord, key_depth)
+            if not (idx < coord.size and coord[idx] == key_depth):
+                coord = np.insert(coord, idx, key_depth)
+        self.current_node.ncrust = np.searchsorted(coord, self.current_node.hc)+1
         self.current_node.coord_initial = coord
         return
 
@@ -272,35 +323,21 @@ class Forward_model:
         coord_new = np.copy(coord)
         margin = 10
         for key_depth in key_depths_arr:
-            if (key_depth in coord_new):
-                pass
+            # coord_new is sorted: the first node at or below the key depth
+            lower_idx = np.searchsorted(coord_new, key_depth)
+            if lower_idx < coord_new.size and coord_new[lower_idx] == key_depth:
+                continue
+            upper_idx = lower_idx-1
+            if upper_idx < 0 or lower_idx >= coord_new.size:
+                raise Exception
+            upper_diff = key_depth - coord_new[upper_idx]
+            lower_diff = coord_new[lower_idx] - key_depth
+            if upper_diff < margin or lower_diff < margin:
+                coord_new[upper_idx if upper_diff <= lower_diff else lower_idx] = key_depth
             else:
-                upper_idx = np.argwhere(coord_new < key_depth)
-                if upper_idx.size == 0:
-                    raise Exception
-                else:
-                    upper_idx = upper_idx[-1][0]
-
-                lower_idx = np.argwhere(coord_new > key_depth)
-                if lower_idx.size == 0:
-                    raise Exception
-                else:
-                    lower_idx = lower_idx[0][0]
-
-                upper_diff = key_depth - coord_new[upper_idx]
-                lower_diff = coord_new[lower_idx] - key_depth
-                differences = np.array([upper_diff, lower_diff])
-                if np.any(differences < margin):
-                    smallest_idx = np.argmin(differences)
-                    differences_idx = np.array([upper_idx, lower_idx])
-                    coord_new[differences_idx[smallest_idx]] = key_depth
-                else:
-                    coord_first_slice = np.append(
-                        coord_new[:upper_idx+1], key_depth)
-                    coord_new = np.append(
-                        coord_first_slice, coord_new[lower_idx:])
+                coord_new = np.insert(coord_new, lower_idx, key_depth)
         if coord_new[0] != 0:
-            coord_new = np.append(0, coord_new)
+            coord_new = np.insert(coord_new, 0, 0)
         return coord_new
 
     def _advection(self, coord_rift: np.ndarray[np.float64], T_previous: np.ndarray[np.float64], coord_previous: np.ndarray[np.float64]) -> np.ndarray[np.float64]:
@@ -320,25 +357,74 @@ class Forward_model:
         np.ndarray[np.float64]
             Temperature in crust, lithospheric mantle and asthenosphere after accounting for advection
         """
-        # todo ulf: this pchip is slow, how about linear interpolation?
-        interpolated_temperature = interpolate.pchip_interpolate(coord_previous, T_previous, coord_rift)
+        if self._parameters.advection_scheme == "linear":
+            interpolated_temperature = np.interp(coord_rift, coord_previous, T_previous)
+        else:
+            interpolated_temperature = self._pchip_interpolate(coord_previous, T_previous, coord_rift)
         n = coord_previous.size-1
         # if asthenosphere goes up
-        # todo: ulf: replace with argmax
-        coord_went_up = np.argwhere(coord_rift > coord_previous[n])
-        if coord_went_up.size > 0:
-            coord_went_up = coord_went_up[0][0]
+        went_up = coord_rift > coord_previous[n]
+        if went_up.any():
+            coord_went_up = went_up.argmax()
             interpolated_temperature[coord_went_up:-1] = T_previous[n] + self._parameters.adiab * \
                 (coord_rift[coord_went_up:-1] - coord_previous[n])
 
         # if surface below 0
-        # todo ulf: optimize
-        coords_went_above_zero = np.argwhere(coord_rift < coord_previous[0])
-        if coords_went_above_zero.size > 0:
-            coords_went_above_zero = coords_went_above_zero[-1][0]+1
+        went_above_zero = coord_rift < coord_previous[0]
+        if went_above_zero.any():
+            coords_went_above_zero = went_above_zero.size-went_above_zero[::-1].argmax()
             interpolated_temperature[:coords_went_above_zero] = 0
         return interpolated_temperature
 
+    @staticmethod
+    def _pchip_interpolate(x: np.ndarray[np.float64], y: np.ndarray[np.float64], x_new: np.ndarray[np.float64]) -> np.ndarray[np.float64]:
+        """Monotone piecewise cubic Hermite interpolation, same result as scipy.interpolate.pchip_interpolate
+        but without building an interpolator object. Points outside x are extrapolated with the end polynomials.
+
+        Parameters
+        ----------
+        x : np.ndarray[np.float64]
+            Strictly increasing coordinates of the data
+        y : np.ndarray[np.float64]
+            Data values
+        x_new : np.ndarray[np.float64]
+            Coordinates to interpolate to
+
+        Returns
+        -------
+        np.ndarray[np.float64]
+            Interpolated values at x_new
+        """
+        h = np.diff(x)
+        m = np.diff(y) / h
+        d = np.zeros_like(y, dtype=np.float64)
+        if x.size == 2:
+            d[:] = m[0]
+        else:
+            # Fritsch-Butland weighted harmonic mean of the secants, zero at local extrema
+            w1 = 2 * h[1:] + h[:-1]
+            w2 = h[1:] + 2 * h[:-1]
+            sm = np.sign(m)
+            flat = (sm[1:] != sm[:-1]) | (m[1:] == 0) | (m[:-1] == 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                whmean = (w1 / m[:-1] + w2 / m[1:]) / (w1 + w2)
+                d[1:-1] = np.where(flat, 0.0, 1.0 / whmean)
+            # three-point end slopes, limited to keep the ends monotone
+            for end, h0, h1, m0, m1 in ((0, h[0], h[1], m[0], m[1]), (-1, h[-1], h[-2], m[-1], m[-2])):
+                d_end = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+                if np.sign(d_end) != np.sign(m0):
+                    d_end = 0.0
+                elif (np.sign(m0) != np.sign(m1)) and (abs(d_end) > abs(3 * m0)):
+                    d_end = 3 * m0
+                d[end] = d_end
+        i = np.clip(np.searchsorted(x, x_new, side="right") - 1, 0, x.size - 2)
+        dx = h[i]
+        t = (x_new - x[i]) / dx
+        t2 = t * t
+        t3 = t2 * t
+        return (2 * t3 - 3 * t2 + 1) * y[i] + (t3 - 2 * t2 + t) * dx * d[i] \
+            + (-2 * t3 + 3 * t2) * y[i + 1] + (t3 - t2) * dx * d[i + 1]
+
     def _initial_temperature(self,
                              ) -> None:
         """Calculate steady state temperature at the start of the model
@@ -419,8 +505,8 @@ class Forward_model:
             Radiogenic heat production per cell of crust, lithospheric mantle and asthenosphere
         """
         heat_product = np.zeros((coord.size - 1))
-        top_idx = np.argwhere(coord <= top_crust)[-1][0]
-        base_idx = np.argwhere(coord <= base_crust)[-1][0]
+        # last nodes at or above the top and base of the crust
+        top_idx, base_idx = np.searchsorted(coord, (top_crust, base_crust), side="right")-1
         coord_filtered = coord[top_idx:base_idx+1]
         coord_mid_point = 0.5*(coord_filtered[1:]+coord_filtered[:-1])
         coord_elem_thickness = coord_filtered[1:]-coord_filtered[:-1]
@@ -447,20 +533,15 @@ class Forward_model:
             Depth to the base of thermal lithosphere
         """
         T_LAB = (1 - self._parameters.tetha) * self.current_node.Tm
-        if (T_LAB in T_arr):
-            idx = np.argwhere(T_arr == T_LAB)[0][0]
-            depth_LAB = coord[idx]
+        below = T_arr <= T_LAB
+        above = T_arr >= T_LAB
+        at = below & above
+        if at.any():
+            depth_LAB = coord[at.argmax()]
         else:  # no T=Tm, then calculates new LAB between nodes
-            y = np.argwhere(T_arr <= T_LAB)
-            if y.size == 0:
-                y = -1
-            else:
-                y = y[-1][0]
-            z = np.argwhere(T_arr >= T_LAB)
-            if z.size == 0:
-                z = 0
-            else:
-                z = z[0][0]
+            # last node below and first node above T_LAB, the profile need not be monotonic
+            y = T_arr.size-1-below[::-1].argmax() if below.any() else -1
+            z = above.argmax() if above.any() else 0
             T1 = T_arr[y]
             T2 = T_arr[z]
             X1 = coord[y]
@@ -518,10 +599,7 @@ class Forward_model:
             seabed = (-1 * (W1 - W0 - b)) / \
                 (self._parameters.rhoAir - self.current_node.asthsolid)
         # Eustatic sealevel
-        sealevel_ind = np.argwhere(
-            self._parameters.eustatic_sea_level["age"] == time_Ma)[0][0]
-        eustatic_sealevel = self._parameters.eustatic_sea_level[
-            "sea_level_changes"][sealevel_ind]
+        eustatic_sealevel = self._parameters.eustatic_sea_level_at(time_Ma)
         seabed = seabed - eustatic_sealevel * self.current_node.asthsolid / \
             (self.current_node.asthsolid - self._parameters.rhowater)
         return seabed
@@ -614,6 +692,7 @@ class Forward_model:
         xsed = np.zeros(1)
         idsed = np.empty(0, np.int32)
         HPsed = np.empty(0)
+        grainsed = maxburialsed = None
         nrift = self.current_node.rift.shape[0]
         self.current_node.beta = np.empty(0)
         total_HP_model_start = self.current_node.shf-self.current_node.qbase
@@ -636,7 +715,7 @@ class Forward_model:
                     start_time = time_start
                 if irift + 1 == nrift:  # last rift
                     end_time = time_end
-                beta, total_crustal_HP_rift_start, T_last, coord_last, xsed, Tsed, HPsed, idsed, hLith_last,  temperature, depth_out,layer_ids_one_rift ,num_elements= self.simulate_one_rift_event(
+                beta, total_crustal_HP_rift_start, T_last, coord_last, xsed, Tsed, HPsed, idsed, hLith_last,  temperature, depth_out,layer_ids_one_rift ,num_elements, grainsed, maxburialsed = self.simulate_one_rift_event(
                     start_time,
                     end_time,
                     self.current_node.rift[irift, 0],
@@ -649,7 +728,9 @@ class Forward_model:
                     HPsed,
                     idsed,
                     hLith_last,
-                    total_crustal_HP_rift_start
+                    total_crustal_HP_rift_start,
+                    grainsed,
+                    maxburialsed,
                 )
                 # oldest last
                 if irift == 0:
@@ -674,7 +755,7 @@ class Forward_model:
                 num_elements = self.current_node._depth_out.shape[0]
         else:  # one rift
             if nrift == 1:  # make sure beta is not placeholder
-                beta, _a_, _hp_, _b_, _c_, Tsed, _e_, idsed, _g_,  self.current_node.temperature_out, self.current_node._depth_out,self.current_node._idsed,num_elements = self.simulate_one_rift_event(
+                beta, _a_, _hp_, _b_, _c_, Tsed, _e_, idsed, _g_,  self.current_node.temperature_out, self.current_node._depth_out,self.current_node._idsed,num_elements, _h_, _i_ = self.simulate_one_rift_event(
                     self._parameters.time_start,
                     self._parameters.time_end,
                     self.current_node.rift[0, 0],
@@ -706,6 +787,7 @@ class Forward_model:
         self.current_node._idsed[idx_base_crust:idx_base_lith, -1] = -2
         self.current_node._idsed[idx_base_lith:, -1] = -3
         self.current_node._depth_out[:, -1] = initial_depth
+        self.current_node._clear_results_cache()
         return
 
     @staticmethod
@@ -748,8 +830,8 @@ class Forward_model:
         sed_ids : np.ndarray[np.float64]
             Ids of sediment
         """
-        sed_phi0 = self.current_node.sediments["phi"].values
-        sed_decay = self.current_node.sediments["decay"].values
+        sed_phi0 = self._sediment_property("phi")
+        sed_decay = self._sediment_property("decay")
         top_km_arr = sed_coord[:-1]/1e3
         base_km_arr = sed_coord[1:]/1e3
         n_sed_elem = top_km_arr.size
@@ -759,24 +841,29 @@ class Forward_model:
         return mean_porosity, sed_id
 
 
-    def _compact_many_layers(self, seddep:np.ndarray[np.float64], phi0:np.ndarray[np.float64], decay:np.ndarray[np.float64], niter=12, maximum_burial_depth=None):
+    def _compact_many_layers(self, seddep:np.ndarray[np.float64], phi0:np.ndarray[np.float64], decay:np.ndarray[np.float64], niter=12, maximum_burial_depth=None, top_depth=0.0, tolerance=None):
         """Run the compation iteration for all layers at once. This converges
         almost as fast as solving each layer thickness top-down, but runs much faster
         because of vector operations. Since we vectorize we have to run the
         same number of iterations for all layers.
         Note: Layer 0 is the top layer here! Maximum burial depth is the depth of the bottom of the layers.
+        The top of layer 0 is at top_depth. If a tolerance is given, the iteration stops early once no layer 
+        thickness changes by more than the tolerance; niter is then the maximum number of iterations.
         """ 
         layer_thickness = seddep
         for i in range(niter):
             # np.cumsum(layer_thickness) is the depth of the base of each layer.
-            layer_base_depths = np.cumsum(layer_thickness)
+            layer_base_depths = top_depth + np.cumsum(layer_thickness)
             if maximum_burial_depth is not None:
                 # Here we use that if one layer is above its maximum burial depth
                 # then all lower layers are as well.
                 layer_base_depths = np.maximum(layer_base_depths, maximum_burial_depth)
             x = np.maximum(1e-14, decay*layer_thickness)
             phiavg = phi0*np.exp(-decay*layer_base_depths)*np.expm1(x)/x
+            previous_thickness = layer_thickness
             layer_thickness = seddep/(1-phiavg)
+            if (tolerance is not None) and np.all(np.abs(layer_thickness-previous_thickness) <= tolerance):
+                break
         return layer_thickness
     
     def _sedimentation(self, reference_implementation=False):
@@ -991,8 +1078,10 @@ class Forward_model:
         Tsed_old:np.ndarray[np.float64],
         HPsed_old:np.ndarray[np.float64],
         idsed_old:np.ndarray[np.int32],
+        grainsed_old:np.ndarray[np.float64]|None=None,
+        maxburialsed_old:np.ndarray[np.float64]|None=None,
 
-    ) ->Tuple[bool,np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.int32]]:
+    ) ->Tuple[bool,np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.int32],np.ndarray[np.float64]|None,np.ndarray[np.float64]|None]:
         """Take care of sedimentation at this time step
 
         Parameters
@@ -1009,6 +1098,10 @@ class Forward_model:
             Radiogenic heat production between xsed (W/m3)
         idsed_old : np.ndarray[np.int32]
             Sediment ids between xsed
+        grainsed_old : np.ndarray[np.float64] | None, optional
+            Grain thickness of sediments between xsed (m). None to derive it from xsed at every time step
+        maxburialsed_old : np.ndarray[np.float64] | None, optional
+            Maximum burial depth of the base of sediments between xsed (m). Required with grainsed_old
 
         Returns
         -------
@@ -1022,18 +1115,23 @@ class Forward_model:
             Radiogenic heat production between xsed (W/m3)
         idsed : np.ndarray[np.int32]
             Sediment ids between xsed
+        grainsed : np.ndarray[np.float64] | None
+            Grain thickness of sediments between xsed (m). None if grainsed_old is None
+        maxburialsed : np.ndarray[np.float64] | None
+            Maximum burial depth of the base of sediments between xsed (m). None if grainsed_old is None
         """
 
         sedflag = True
         if np.sum(sedrate) > 0:  # new sediment exist
-            xsed, Tsed, HPsed, idsed = self._combine_new_old_sediments(
+            xsed, Tsed, HPsed, idsed, grainsed, maxburialsed = self._combine_new_old_sediments(
                 sedrate,
                 sed,
                 xsed_old,
                 Tsed_old,
                 HPsed_old,
                 idsed_old,
-
+                grainsed_old,
+                maxburialsed_old,
             )
         else:
             if xsed_old[-1] == 0:  # no sed for all time
@@ -1042,12 +1140,15 @@ class Forward_model:
                 HPsed = np.zeros(1)
                 idsed = np.empty(0, dtype=np.int32)
                 Tsed = np.zeros(1)
+                grainsed = maxburialsed = None if grainsed_old is None else np.empty(0)
             else:  # no sed only this time. passthrough
                 xsed = xsed_old
                 Tsed = Tsed_old
                 HPsed = HPsed_old
                 idsed = idsed_old
-        return sedflag, xsed, Tsed, HPsed, idsed
+                grainsed = grainsed_old
+                maxburialsed = maxburialsed_old
+        return sedflag, xsed, Tsed, HPsed, idsed, grainsed, maxburialsed
 
     def _combine_new_old_sediments(
         self,
@@ -1057,7 +1158,9 @@ class Forward_model:
         Tsed_old:np.ndarray[np.float64],
         HPsed_old:np.ndarray[np.float64],
         idsed_old:np.ndarray[np.int32],
-    ) ->Tuple[np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.int32]]:
+        grainsed_old:np.ndarray[np.float64]|None=None,
+        maxburialsed_old:np.ndarray[np.float64]|None=None,
+    ) ->Tuple[np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.int32],np.ndarray[np.float64]|None,np.ndarray[np.float64]|None]:
         """Add new sediment for current time step and combine with previous sediments
 
         Parameters
@@ -1074,6 +1177,10 @@ class Forward_model:
             Radiogenic heat production between xsed (W/m3)
         idsed_old : np.ndarray[np.int32]
             Sediment ids between xsed
+        grainsed_old : np.ndarray[np.float64] | None, optional
+            Grain thickness of sediments between xsed (m). None to derive it from xsed
+        maxburialsed_old : np.ndarray[np.float64] | None, optional
+            Maximum burial depth of the base of sediments between xsed (m)
 
         Returns
         -------
@@ -1085,19 +1192,34 @@ class Forward_model:
             Radiogenic heat production between xsed (W/m3)
         idsed : np.ndarray[np.int32]
             Sediment ids between xsed
+        grainsed : np.ndarray[np.float64] | None
+            Grain thickness of sediments between xsed (m). None if grainsed_old is None
+        maxburialsed : np.ndarray[np.float64] | None
+            Maximum burial depth of the base of sediments between xsed (m). None if grainsed_old is None
         """
         # Get new sediments at this time step
         xsed_new, idsed_new = self._get_new_sediments(
-            sedrate, self.current_node.sediments["phi"].values, self.current_node.sediments["decay"].values)
-        HPsed_new = self.current_node.sediments["rhp"].values[idsed_new]
-
-        # decompact and recompat old_sed for new depth
+            sedrate, self._sediment_property("phi"), self._sediment_property("decay"))
+        HPsed_new = self._sediment_property("rhp")[idsed_new]
+        track_grain = grainsed_old is not None
+        grainsed = maxburialsed = None
+        if track_grain:
+            grainsed_new = sedrate[idsed_new]   # grain thickness deposited in one time step
+            maxburialsed_new = xsed_new[1:]
+
+        # compact old_sed for new depth
         if xsed_old[-1] > 0:  # old sediments exist
             new_sed_base = xsed_new[-1]
-            xsed_old_recompacted = self._recompact_old_sediments(
-                new_sed_base, xsed_old,  idsed_old, self.current_node.sediments[
-                    "phi"].values, self.current_node.sediments["decay"].values
-            )
+            if track_grain:
+                xsed_old_recompacted = self._compact_old_sediments(
+                    new_sed_base, grainsed_old, maxburialsed_old, idsed_old, self._sediment_property("phi"), self._sediment_property("decay")
+                )
+                grainsed = np.append(grainsed_new, grainsed_old)
+                maxburialsed = np.append(maxburialsed_new, np.maximum(maxburialsed_old, xsed_old_recompacted))
+            else:
+                xsed_old_recompacted = self._recompact_old_sediments(
+                    new_sed_base, xsed_old,  idsed_old, self._sediment_property("phi"), self._sediment_property("decay")
+                )
             xsed = np.append(xsed_new, xsed_old_recompacted)
             idsed = np.append(idsed_new, idsed_old)
             HPsed = np.append(HPsed_new, HPsed_old)
@@ -1105,17 +1227,22 @@ class Forward_model:
             xsed = xsed_new
             HPsed = HPsed_new
             idsed = idsed_new
+            if track_grain:
+                grainsed = grainsed_new
+                maxburialsed = maxburialsed_new
         Tsed = np.zeros(idsed_new.size)
         Tsed = np.append(Tsed, Tsed_old)
 
         # refine sediments mesh
         if xsed.size > 3:
             xsed_remeshed, idsed, HPsed = self._remesh_sediments(
-                xsed, idsed, HPsed, self.current_node.sediments["rhp"].values, sed)
+                xsed, idsed, HPsed, self._sediment_property("rhp"), sed)
             Tsed = np.interp(xsed_remeshed, xsed, Tsed)
+            if track_grain:
+                grainsed, maxburialsed = self._remesh_grain_thickness(xsed, grainsed, maxburialsed, xsed_remeshed)
             xsed = xsed_remeshed
 
-        return xsed, Tsed, HPsed, idsed
+        return xsed, Tsed, HPsed, idsed, grainsed, maxburialsed
     
     def _recompact_old_sediments(
         self, xsed_new_base: np.ndarray[np.float64], xsed_old: np.ndarray[np.float64],  idsed_old: np.ndarray[np.int32], sed_phi0: np.ndarray[np.float64], sed_decay: np.ndarray[np.float64]
@@ -1141,20 +1268,85 @@ class Forward_model:
             _description_
         """
 
-        xsed_old_recompacted = np.zeros(xsed_old.size - 1)
-        previous_base = xsed_new_base
-        for i in range(xsed_old.size - 1):
-            sed_idx = idsed_old[i]
-            phi0 = sed_phi0[sed_idx]
-            maximum_burial = 0
-            shift = np.maximum(0,maximum_burial-xsed_old[i+1])
-            grain_thickness_m = self.decompaction( # Fix for maximum burial
-                xsed_old[i]+shift, xsed_old[i + 1]+shift, phi0, sed_decay[sed_idx])
-            xsed_old_recompacted[i] = self.compaction(
-                previous_base, grain_thickness_m, phi0, sed_decay[sed_idx], base_maximum_burial_depth_m=maximum_burial)
-            previous_base = xsed_old_recompacted[i]
+        n_cells = xsed_old.size - 1
+        sed_idx = idsed_old[:n_cells]
+        phi0 = sed_phi0[sed_idx]
+        decay = sed_decay[sed_idx]
+        # grain thickness of each cell at its old depth (km)
+        top_km = xsed_old[:-1] / 1e3
+        base_km = xsed_old[1:] / 1e3
+        mean_porosity = -phi0 / decay * self._phi1(base_km, top_km, -decay)
+        grain_thickness_km = (base_km - top_km) * (1 - mean_porosity)
+        # compact all cells at once below the base of the new sediments
+        top_depth_km = xsed_new_base / 1e3
+        layer_thickness_km = self._compact_many_layers(grain_thickness_km, phi0, decay, niter=100, top_depth=top_depth_km, tolerance=1e-9)
+        xsed_old_recompacted = (top_depth_km + np.cumsum(layer_thickness_km)) * 1e3
         return xsed_old_recompacted
 
+    def _compact_old_sediments(
+        self, xsed_new_base: float, grainsed_old: np.ndarray[np.float64], maxburialsed_old: np.ndarray[np.float64], idsed_old: np.ndarray[np.int32], sed_phi0: np.ndarray[np.float64], sed_decay: np.ndarray[np.float64]
+    ) -> np.ndarray[np.float64]:
+        """Calculate depth of previous sedimentary column under the weight of new sediments from the grain thickness of its cells.
+        Compaction is irreversible: cells are at least as compacted as at their maximum burial depth
+
+        Parameters
+        ----------
+        xsed_new_base : float
+            Base of new sedimentary column (m)
+        grainsed_old : np.ndarray[np.float64]
+            Grain thickness of sediments between previous xsed (m)
+        maxburialsed_old : np.ndarray[np.float64]
+            Maximum burial depth of the base of sediments between previous xsed (m)
+        idsed_old : np.ndarray[np.int32]
+            Sediment ids between previous xsed
+        sed_phi0 : np.ndarray[np.float64]
+            Surface porosity of sediments (fraction)
+        sed_decay : np.ndarray[np.float64]
+            Exponential decay of sediment porosity with depth (fraction)
+
+        Returns
+        -------
+        np.ndarray[np.float64]
+            Base of each cell of the previous sedimentary column (m)
+        """
+        phi0 = sed_phi0[idsed_old]
+        decay = sed_decay[idsed_old]
+        top_depth_km = xsed_new_base / 1e3
+        layer_thickness_km = self._compact_many_layers(grainsed_old / 1e3, phi0, decay, niter=100,
+            maximum_burial_depth=maxburialsed_old / 1e3, top_depth=top_depth_km, tolerance=1e-9)
+        return (top_depth_km + np.cumsum(layer_thickness_km)) * 1e3
+
+    @staticmethod
+    def _remesh_grain_thickness(xsed: np.ndarray[np.float64], grainsed: np.ndarray[np.float64], maxburialsed: np.ndarray[np.float64], xsed_remeshed: np.ndarray[np.float64]) -> tuple[np.ndarray[np.float64], np.ndarray[np.float64]]:
+        """Redistribute grain thickness and maximum burial depth to the cells of the remeshed sedimentary column.
+        The cumulative grain thickness is interpolated linearly in depth, and scaled so that the total grain thickness is conserved
+
+        Parameters
+        ----------
+        xsed : np.ndarray[np.float64]
+            Top and base of sedimentary column before remeshing (m)
+        grainsed : np.ndarray[np.float64]
+            Grain thickness of sediments between xsed (m)
+        maxburialsed : np.ndarray[np.float64]
+            Maximum burial depth of the base of sediments between xsed (m)
+        xsed_remeshed : np.ndarray[np.float64]
+            Top and base of remeshed sedimentary column (m)
+
+        Returns
+        -------
+        grainsed_remeshed : np.ndarray[np.float64]
+            Grain thickness of sediments between xsed_remeshed (m)
+        maxburialsed_remeshed : np.ndarray[np.float64]
+            Maximum burial depth of the base of sediments between xsed_remeshed (m)
+        """
+        x = xsed_remeshed * (xsed[-1] / xsed_remeshed[-1])
+        cumulative_grain = np.interp(x, xsed, np.append(0.0, np.cumsum(grainsed)))
+        grainsed_remeshed = np.diff(cumulative_grain)
+        # burial in excess of the current depth
+        excess_burial = np.interp(x[1:], xsed[1:], maxburialsed - xsed[1:])
+        maxburialsed_remeshed = xsed_remeshed[1:] + np.maximum(excess_burial, 0)
+        return grainsed_remeshed, maxburialsed_remeshed
+
     def _get_new_sediments(self, sedrate: np.ndarray[np.float64], sed_phi0: np.ndarray[np.float64], sed_decay: np.ndarray[np.float64]) -> tuple[np.ndarray[np.float64], np.ndarray[np.int32]]:
         """Generate new sediments that was deposited at this time step
 
@@ -1174,19 +1366,14 @@ class Forward_model:
         idsed_new : np.ndarray[np.float64]
             Sediment ids of new sedimentary column
         """
-        xsed_new = np.zeros(1)  # keep track of sediment depth
-        idsed_new = np.empty(0, dtype=np.int32)
-        for i in range(sedrate.size):
-            if (
-                sedrate[i] > 0
-            ):  # sedrate filtered to time in input. sedrate is now 1d array
-                new_sediment_depth = self.compaction(
-                    xsed_new[-1], sedrate[i], sed_phi0[i], sed_decay[i])
-                xsed_new = np.append(xsed_new, new_sediment_depth)
-                idsed_new = np.append(idsed_new, i)
+        idsed_new = np.flatnonzero(sedrate > 0).astype(np.int32)  # sedrate filtered to time in input. sedrate is now 1d array
+        xsed_new = np.zeros(idsed_new.size + 1)  # keep track of sediment depth
+        if idsed_new.size > 0:
+            layer_thickness_km = self._compact_many_layers(
+                sedrate[idsed_new] / 1e3, sed_phi0[idsed_new], sed_decay[idsed_new], niter=100, tolerance=1e-9)
+            xsed_new[1:] = np.cumsum(layer_thickness_km) * 1e3
         return xsed_new, idsed_new
 
-    #TODO: ulf speedup
     def _remesh_sediments(self, xsed: np.ndarray[np.float64], idsed: np.ndarray[np.int32], HPsed: np.ndarray[np.float64], sed_rhp: np.ndarray[np.float64], sed: np.ndarray[np.float64]) -> tuple[np.ndarray[np.float64], np.ndarray[np.int32], np.ndarray[np.float64]]:
         """Remesh sedimentary column to maintain resolution
 
@@ -1212,20 +1399,32 @@ class Forward_model:
         HPsed_remeshed : np.ndarray[np.float64]
             Radiogenic heat production between xsed (W/m3)
         """
-        xsed_remeshed = xsed[:2]
-        idsed_remeshed = np.array([idsed[0]], np.int32)
-        HPsed_remeshed = np.array([HPsed[0]])
-        for i in range(sed.shape[0]):
-            if abs((xsed_remeshed[-1] - sed[i, 1])) > 1 and sed[i, 1] > 0:
+        # Find the layers to be refined and their number of new nodes. Layers thinner than 1 m are merged into the next one
+        n_layers = sed.shape[0]
+        layer_top = np.zeros(n_layers)
+        layer_count = np.zeros(n_layers, dtype=np.int64)
+        previous_base = xsed[1]
+        for i in range(n_layers):
+            if abs((previous_base - sed[i, 1])) > 1 and sed[i, 1] > 0:
                 n_new_nodes = math.floor(
-                    (sed[i, 1] - xsed_remeshed[-1]) / self._parameters.vertical_resolution_sediments)
-                x_interp = np.linspace(
-                    xsed_remeshed[-1], sed[i, 1], n_new_nodes + 2)
-                xsed_remeshed = np.append(xsed_remeshed, x_interp[1:]) # todo: ulf: append is slow, build list and concatenate at the end
-                id_temp = i * np.ones(n_new_nodes + 1, np.int32)
-                idsed_remeshed = np.append(idsed_remeshed, id_temp)
-                HPsed_remeshed = np.append(
-                    HPsed_remeshed, (sed_rhp[i] * np.ones(n_new_nodes + 1)))
+                    (sed[i, 1] - previous_base) / self._parameters.vertical_resolution_sediments)
+                layer_count[i] = max(n_new_nodes + 1, 0)
+                layer_top[i] = previous_base
+                if layer_count[i] > 0:
+                    previous_base = sed[i, 1]
+        # Build the whole mesh in one allocation: n_new_nodes+1 equidistant nodes below the top of each refined layer
+        n_total = layer_count.sum()
+        layer_of_node = np.repeat(np.arange(n_layers), layer_count)
+        index_in_layer = np.arange(n_total) - np.repeat(np.cumsum(layer_count) - layer_count, layer_count) + 1
+        xsed_remeshed = np.empty(n_total + 2)
+        xsed_remeshed[:2] = xsed[:2]
+        xsed_remeshed[2:] = layer_top[layer_of_node] + (sed[layer_of_node, 1] - layer_top[layer_of_node]) * index_in_layer / layer_count[layer_of_node]
+        idsed_remeshed = np.empty(n_total + 1, np.int32)
+        idsed_remeshed[0] = idsed[0]
+        idsed_remeshed[1:] = layer_of_node
+        HPsed_remeshed = np.empty(n_total + 1)
+        HPsed_remeshed[0] = HPsed[0]
+        HPsed_remeshed[1:] = sed_rhp[layer_of_node]
         return xsed_remeshed, idsed_remeshed, HPsed_remeshed
 
     def simulate_one_rift_event(
@@ -1242,13 +1441,20 @@ class Forward_model:
         HPsed_first:np.ndarray[np.float64],
         idsed_first:np.ndarray[np.int32],
         hLith:float,
-        total_crustal_HP_time_start:float
+        total_crustal_HP_time_start:float,
+        grainsed_first:np.ndarray[np.float64]|None=None,
+        maxburialsed_first:np.ndarray[np.float64]|None=None,
     ):
         all_tested_beta = np.empty(0)
         all_water_depth_difference = np.empty(0)
         beta = self._parameters.starting_beta
         save_results = beta_found = False
         n_depth_out = 2000 # Not used. Will be overridden in last time step. Keep here for linter
+        # Time steps before rifting do not depend on beta: with beta_trial_continuation, the first trial keeps the
+        # results of these steps and the state at rift onset, and later trials resume from there
+        continue_trials = self._parameters.beta_trial_continuation and (time_end <= rift_start_time < time_start)
+        pre_rift_steps = []
+        pre_rift_state = None
         # Start searching beta factor
         while True:
             if save_results == True:
@@ -1261,21 +1467,38 @@ class Forward_model:
                 temperature_out.fill(np.nan)
                 idsed_out = np.zeros((num-1, time_start+1),dtype=np.int32)
                 idsed_out.fill(-9999)
-            # initial condition for new beta trial
-            xsed = xsed_first
-            Tsed = Tsed_first
-            HPsed = HPsed_first
-            idsed = idsed_first
-            T_new = T_init
-            coord_before_this_time_step = coord_current = coord_start_this_rift
-            hcUpdated = hc_start_this_rift = coord_current[(
-                self.current_node.ncrust - 1)]
-            total_crustal_HP_current = total_crustal_HP_time_start
+            first_time_step = time_start - 1
+            if pre_rift_state is not None:
+                # resume from rift onset
+                if save_results:
+                    for i, step_results in pre_rift_steps:
+                        self._save_time_step_results(i, num, *step_results, depth_out_all, temperature_out, idsed_out)
+                (xsed, Tsed, HPsed, idsed, grainsed, maxburialsed, T_new, coord_current, hcUpdated, lithUpdated,
+                    total_crustal_HP_current, modelled_seabed, hLith) = pre_rift_state
+                coord_before_this_time_step = coord_start_this_rift
+                hc_start_this_rift = coord_start_this_rift[(self.current_node.ncrust - 1)]
+                first_time_step = rift_start_time - 1
+            else:
+                # initial condition for new beta trial
+                xsed = xsed_first
+                Tsed = Tsed_first
+                HPsed = HPsed_first
+                idsed = idsed_first
+                if self._parameters.track_grain_thickness:
+                    grainsed = grainsed_first if grainsed_first is not None else np.empty(0)
+                    maxburialsed = maxburialsed_first if maxburialsed_first is not None else np.empty(0)
+                else:
+                    grainsed = maxburialsed = None
+                T_new = T_init
+                coord_before_this_time_step = coord_current = coord_start_this_rift
+                hcUpdated = hc_start_this_rift = coord_current[(
+                    self.current_node.ncrust - 1)]
+                total_crustal_HP_current = total_crustal_HP_time_start
             coord_rift_scaler = self._coord_rift_scaler(
                 rift_end_time, rift_start_time, beta, coord_start_this_rift)
 
             # Start from oldest time
-            for i in range(time_start - 1, time_end - 1, self._parameters.time_step_Ma):
+            for i in range(first_time_step, time_end - 1, self._parameters.time_step_Ma):
 
                 # vel = np.zeros(coord_first.size)
                 if i < rift_start_time and i >= rift_end_time:
@@ -1305,13 +1528,15 @@ class Forward_model:
                 # TODO: underplate, asthenospheric anamaly, melt for all modes
 
                 # Take care of sedimentation
-                sedflag, xsed, Tsed, HPsed, idsed = self.add_sediments(
+                sedflag, xsed, Tsed, HPsed, idsed, grainsed, maxburialsed = self.add_sediments(
                     self.current_node.sedrate[i, :],
                     self.current_node.sed[:, :, i],
                     xsed,
                     Tsed,
                     HPsed,
                     idsed,
+                    grainsed,
+                    maxburialsed,
                 )
                 (
                     T_newtemp,
@@ -1364,50 +1589,16 @@ class Forward_model:
                 if i == time_end:
                     n_depth_out = xsed.size+coord_current.size+4
 
+                step_results = (sedflag, Tsed, T_newtemp, xsed, coord_current, idsed, hcUpdated, lithUpdated, modelled_seabed)
+                if continue_trials and (pre_rift_state is None) and (i >= rift_start_time):
+                    pre_rift_steps.append((i, step_results))
+                    if i == rift_start_time:
+                        pre_rift_state = (xsed, Tsed, HPsed, idsed, grainsed, maxburialsed, T_new, coord_current, hcUpdated,
+                            lithUpdated, total_crustal_HP_current, modelled_seabed, hLith)
+
                 # Save result to holder
                 if save_results:
-                    if sedflag == True:
-                        Tout = np.append(Tsed, T_newtemp[1:])
-                        coord_T = np.append(xsed, coord_current[1:] + xsed[-1])
-                    else:  # no sed
-                        Tout = T_newtemp
-                        coord_T = coord_current
-    
-                    seabed = modelled_seabed
-                    coord_seabed = coord_T+seabed
-                    depth_out = np.linspace(0.0, self.current_node._ht, num)
-                    depth_out[1:coord_seabed.size+1]=coord_seabed
-                    depth_out[coord_seabed.size+1:]= np.linspace(coord_seabed[-1]+100,self.current_node._ht,depth_out[coord_seabed.size+1:].size)
-                    idx_seabed = np.abs(depth_out - seabed).argmin()        
-                    if xsed.size > 1:
-                        base_crust = hcUpdated+xsed[-1]+seabed
-                        base_lith = lithUpdated+xsed[-1]+seabed
-                        idx_lith = np.abs(depth_out - base_lith).argmin()
-                        idx_base_crust = np.abs(depth_out - base_crust).argmin()
-                        xsed_with_seabed = xsed+seabed
-                        base_sed = xsed_with_seabed[-1]
-                        idx_base_sed = np.abs(depth_out - base_sed).argmin()
-                        depth_out_mid_point = (depth_out[1:] + depth_out[:-1]) / 2
-
-                        idsed_out[idx_seabed:idx_base_sed, i] = np.interp(
-                            depth_out_mid_point[idx_seabed:idx_base_sed], xsed_with_seabed[:-1], idsed)
-                        idsed_out[idx_base_sed:idx_base_crust,
-                                 i] = -1
-                    else:
-                        base_crust = hcUpdated+seabed
-                        base_lith = lithUpdated+seabed
-                        idx_lith = np.abs(depth_out - base_lith).argmin()
-                        idx_base_crust = np.abs(depth_out - base_crust).argmin()
-                        idsed_out[idx_seabed:idx_base_crust,
-                                 i] = -1
-                    depth_out[idx_lith] = base_lith
-                    idsed_out[idx_base_crust:idx_lith, i] = -2
-                    idsed_out[idx_lith:, i] = -3
-                    depth_out_all[:, i] = depth_out
-                    temperature_out[idx_seabed:, i] = np.interp(
-                        depth_out[idx_seabed:], coord_seabed, Tout)
-                    temperature_out[idx_lith:i] = (
-                        1 - self._parameters.tetha) * self.current_node.Tm
+                    self._save_time_step_results(i, num, *step_results, depth_out_all, temperature_out, idsed_out)
 
             if save_results and beta_found:  # Results saved. Exit loop
                 self.current_node.water_depth_difference = modelled_seabed-observed_seabed
@@ -1427,10 +1618,61 @@ class Forward_model:
                     beta = self._parameters.max_beta
                     beta_found = save_results = True
         
-        return beta, total_crustal_HP_current, T_new, coord_before_this_time_step, xsed, Tsed, HPsed, idsed, lithUpdated, temperature_out, depth_out_all,idsed_out,n_depth_out
+        return beta, total_crustal_HP_current, T_new, coord_before_this_time_step, xsed, Tsed, HPsed, idsed, lithUpdated, temperature_out, depth_out_all,idsed_out,n_depth_out, grainsed, maxburialsed
 
 
 
+    def _save_time_step_results(self, i: int, num: int, sedflag: bool, Tsed: np.ndarray[np.float64], T_newtemp: np.ndarray[np.float64],
+                                xsed: np.ndarray[np.float64], coord_current: np.ndarray[np.float64], idsed: np.ndarray[np.int32],
+                                hcUpdated: float, lithUpdated: float, modelled_seabed: float, depth_out_all: np.ndarray[np.float64],
+                                temperature_out: np.ndarray[np.float64], idsed_out: np.ndarray[np.int32]) -> None:
+        """Write the results of time step i to column i of the result holders of simulate_one_rift_event
+        """
+        if sedflag == True:
+            Tout = np.append(Tsed, T_newtemp[1:])
+            coord_T = np.append(xsed, coord_current[1:] + xsed[-1])
+        else:  # no sed
+            Tout = T_newtemp
+            coord_T = coord_current
+
+        seabed = modelled_seabed
+        coord_seabed = coord_T+seabed
+        depth_out = np.linspace(0.0, self.current_node._ht, num)
+        depth_out[1:coord_seabed.size+1]=coord_seabed
+        depth_out[coord_seabed.size+1:]= np.linspace(coord_seabed[-1]+100,self.current_node._ht,depth_out[coord_seabed.size+1:].size)
+        idx_seabed = np.abs(depth_out - seabed).argmin()        
+        if xsed.size > 1:
+            base_crust = hcUpdated+xsed[-1]+seabed
+            base_lith = lithUpdated+xsed[-1]+seabed
+            idx_lith = np.abs(depth_out - base_lith).argmin()
+            idx_base_crust = np.abs(depth_out - base_crust).argmin()
+            xsed_with_seabed = xsed+seabed
+            base_sed = xsed_with_seabed[-1]
+            idx_base_sed = np.abs(depth_out - base_sed).argmin()
+            depth_out_mid_point = (depth_out[1:] + depth_out[:-1]) / 2
+
+            idsed_out[idx_seabed:idx_base_sed, i] = np.interp(
+                depth_out_mid_point[idx_seabed:idx_base_sed], xsed_with_seabed[:-1], idsed)
+            idsed_out[idx_base_sed:idx_base_crust,
+                     i] = -1
+        else:
+            base_crust = hcUpdated+seabed
+            base_lith = lithUpdated+seabed
+            idx_lith = np.abs(depth_out - base_lith).argmin()
+            idx_base_crust = np.abs(depth_out - base_crust).argmin()
+            idsed_out[idx_seabed:idx_base_crust,
+                     i] = -1
+        depth_out[idx_lith] = base_lith
+        idsed_out[idx_base_crust:idx_lith, i] = -2
+        idsed_out[idx_lith:, i] = -3
+        depth_out_all[:, i] = depth_out
+        temperature_out[idx_seabed:, i] = np.interp(
+            depth_out[idx_seabed:], coord_seabed, Tout)
+        temperature_out[idx_lith:i] = (
+            1 - self._parameters.tetha) * self.current_node.Tm
+
+        return
+
     def _approximate_true_beta(self, Wd_diff_all: np.ndarray[np.float64], beta_all: np.ndarray[np.float64]) -> float:
         """Interpolate the best beta factor that fit the observed subsidence
 
@@ -1566,10 +1808,20 @@ class Forward_model:
         Returns:
             tuple[np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.float64],np.ndarray[np.float64]]: _description_
         """
+        ws = self._workspace
+        nsed = xsed.size-1 if sedflag == True else 0
+        n = coord_crust_lith.size + nsed
+        ws.reserve(n)
         if sedflag == True:
-            coord_all = np.append(xsed[:-1], (coord_crust_lith + xsed[-1]))
-            T_all = np.append(Tsed[:-1], t_old)
-            HP_all = np.append(HPsed, HP)
+            coord_all = ws.vector("coord", n)
+            coord_all[:nsed] = xsed[:-1]
+            np.add(coord_crust_lith, xsed[-1], out=coord_all[nsed:])
+            T_all = ws.vector("T", n)
+            T_all[:nsed] = Tsed[:-1]
+            T_all[nsed:] = t_old
+            HP_all = ws.vector("HP", n-1)
+            HP_all[:nsed] = HPsed
+            HP_all[nsed:] = HP
         else:
             coord_all = coord_crust_lith
             T_all = t_old
@@ -1577,27 +1829,24 @@ class Forward_model:
         mean_porosity_arr, sed_idx_arr = self._sediments_mean_porosity(
             xsed,  idsed)
         density_sed = self._sediment_density(
-            mean_porosity_arr, self.current_node.sediments["solidus"].values[sed_idx_arr])
+            mean_porosity_arr, self._sediment_property("solidus")[sed_idx_arr])
         conductivity_sed = self._sediment_conductivity_sekiguchi(
-            mean_porosity_arr, self.current_node.sediments["k_cond"].values[sed_idx_arr],Tsed)
-        conductivity_crust_lith = self._build_crust_lithosphere_properties(
-            coord_crust_lith, hc, hLith, self.current_node.kCrust, self.current_node.kLith, self.current_node.kAsth)
-        conductivity = np.append(conductivity_sed, conductivity_crust_lith)
-        dx_arr = coord_all[1:]-coord_all[:-1]
-        conductivity_diag = conductivity/dx_arr
-        COND_diag = np.convolve(conductivity_diag, [1, 1])
-        COND_subdiag = -conductivity_diag
+            mean_porosity_arr, self._sediment_property("k_cond")[sed_idx_arr],Tsed)
+        conductivity = ws.vector("conductivity", n-1)
+        conductivity[:nsed] = conductivity_sed
+        self._build_crust_lithosphere_properties(
+            coord_crust_lith, hc, hLith, self.current_node.kCrust, self.current_node.kLith, self.current_node.kAsth, out=conductivity[nsed:])
+        dx_arr = np.subtract(coord_all[1:], coord_all[:-1], out=ws.vector("dx", n-1))
+        conductivity_diag = np.divide(conductivity, dx_arr, out=ws.vector("conductivity_diag", n-1))
         # packed format suitable for np.linalg.solve_banded()
-        COND_packed = np.zeros((3,len(COND_diag)))
-        COND_packed[0,1:] = COND_subdiag
-        COND_packed[1,:] = COND_diag
-        COND_packed[2,:-1] = COND_subdiag
-        # todo: avoid forming this matrix
-        # COND = np.diag(COND_diag)+np.diag(COND_subdiag,1)+np.diag(COND_subdiag,-1)
-        SOUR = np.convolve(HP_all*dx_arr, [0.5, 0.5])
-        density_crust_lith = self._build_crust_lithosphere_properties(
-            coord_crust_lith, hc, hLith, self.current_node.crustsolid, self.current_node.lithsolid, self.current_node.asthsolid)
-        density_all = np.append(density_sed, density_crust_lith)
+        COND_packed = ws.packed("conductivity_packed", n)
+        self._pack_tridiagonal(conductivity_diag, -1.0, COND_packed)
+        SOUR = ws.vector("source", n)
+        self._sum_to_nodes(np.multiply(HP_all, dx_arr, out=ws.vector("scratch", n-1)), 0.5, SOUR)
+        density_all = ws.vector("density", n-1)
+        density_all[:nsed] = density_sed
+        self._build_crust_lithosphere_properties(
+            coord_crust_lith, hc, hLith, self.current_node.crustsolid, self.current_node.lithsolid, self.current_node.asthsolid, out=density_all[nsed:])
 
         T, densityeff = self.implicit_euler_solve(
             T_all,
@@ -1612,7 +1861,8 @@ class Forward_model:
         # split sed from lithos
         if sedflag == True:
             sednode = xsed.size
-            Tsed = T[:sednode]
+            # T is a view of the workspace, which is overwritten in the next time step
+            Tsed = T[:sednode].copy()
             densityeffsed = densityeff[: sednode - 1]
             T = T[sednode - 1:]
             coord_all = coord_all[sednode - 1:] - xsed[-1]
@@ -1623,6 +1873,55 @@ class Forward_model:
         T = np.interp(coord_crust_lith, coord_all, T)
         return T, densityeff, Tsed, densityeffsed
 
+    @staticmethod
+    def _sum_to_nodes(cell_values: np.ndarray[np.float64], weight: float, out: np.ndarray[np.float64]) -> np.ndarray[np.float64]:
+        """Sum of the weighted values of the cells on both sides of each node, same as np.convolve(cell_values, [weight, weight])
+
+        Parameters
+        ----------
+        cell_values : np.ndarray[np.float64]
+            Values per cell, length n-1
+        weight : float
+            Weight of each cell
+        out : np.ndarray[np.float64]
+            Values per node, length n
+
+        Returns
+        -------
+        out : np.ndarray[np.float64]
+            Values per node
+        """
+        np.multiply(cell_values, weight, out=out[:-1])
+        out[-1] = out[-2]
+        out[1:-1] += out[:-2]
+        return out
+
+    @classmethod
+    def _pack_tridiagonal(cls, cell_values: np.ndarray[np.float64], offdiag_weight: float, out: np.ndarray[np.float64]) -> np.ndarray[np.float64]:
+        """Symmetric tridiagonal matrix of cell contributions in packed banded format:
+        the diagonal is the sum of the values of the cells on both sides of a node, the off-diagonals are the cell values times offdiag_weight
+
+        Parameters
+        ----------
+        cell_values : np.ndarray[np.float64]
+            Values per cell, length n-1
+        offdiag_weight : float
+            Factor of the off-diagonal entries
+        out : np.ndarray[np.float64]
+            Packed matrix, shape (3,n)
+
+        Returns
+        -------
+        out : np.ndarray[np.float64]
+            Packed matrix
+        """
+        out[0,0] = 0
+        np.multiply(cell_values, offdiag_weight, out=out[0,1:])
+        out[2,:-1] = out[0,1:]
+        out[2,-1] = 0
+        cls._sum_to_nodes(cell_values, 1.0, out[1,:])
+        return out
+
     def implicit_euler_solve(
         self,
         T_start: np.ndarray[np.float64],
@@ -1645,8 +1944,11 @@ class Forward_model:
             HP_last_node (float): RHP at the base of model
 
         Returns:
-            tuple[np.ndarray[np.float64],np.ndarray[np.float64]]: _description_
+            tuple[np.ndarray[np.float64],np.ndarray[np.float64]]: Temperature (a view of the workspace, valid until the next solve) and effective density
         """
+        ws = self._workspace
+        n = coord_all.size
+        ws.reserve(n)
         # setup first discretize scheme. Run all time in one step.
         discret_steps = 1
         T_last_step = T_start
@@ -1654,23 +1956,32 @@ class Forward_model:
             abs(self._parameters.time_step_Ma)) * self._parameters.myr2s
         time_in_s_per_discret_step = total_time_in_s_to_simulate
         dx_arr = coord_all[1:]-coord_all[:-1]
+        time_derivative_packed = ws.packed("time_derivative_packed", n)
+        Lpacked = ws.packed("L_packed", n)
+        scratch = ws.vector("scratch", n-1)
+        T_this_step = ws.vector("T_old", n)
         while True:
             T_old = T_start
             for step in range(discret_steps):
-                (
-                    density_effective,
-                    time_derivative_packed
-                ) = self._assemble_time_derivative(
+                density_effective, _ = self._assemble_time_derivative(
                     dx_arr,
                     T_old,
                     density_all,
+                    out=time_derivative_packed,
                 )
                 # implicit assembly
-                Lpacked = time_derivative_packed / time_in_s_per_discret_step + conductivity_packed
+                np.divide(time_derivative_packed, time_in_s_per_discret_step, out=Lpacked)
+                Lpacked += conductivity_packed
                 # compute R from the packed time derivative matrix
-                Rpacked = (time_derivative_packed[1,:] / time_in_s_per_discret_step) * T_old + source
-                Rpacked[:-1] += (time_derivative_packed[0,1:] / time_in_s_per_discret_step) * T_old[1:]
-                Rpacked[1:] += (time_derivative_packed[2,:-1] / time_in_s_per_discret_step) * T_old[:-1]
+                Rpacked = np.divide(time_derivative_packed[1,:], time_in_s_per_discret_step, out=ws.vector("R", n))
+                Rpacked *= T_old
+                Rpacked += source
+                np.divide(time_derivative_packed[0,1:], time_in_s_per_discret_step, out=scratch)
+                scratch *= T_old[1:]
+                Rpacked[:-1] += scratch
+                np.divide(time_derivative_packed[2,:-1], time_in_s_per_discret_step, out=scratch)
+                scratch *= T_old[:-1]
+                Rpacked[1:] += scratch
                 # fixed surface temp BC
                 Rpacked[0] = self.current_node.T0
                 Lpacked[0,1] = 0
@@ -1686,15 +1997,17 @@ class Forward_model:
                     Rpacked[-1] = self.current_node.Tinit[-1]
                     Lpacked[2,-2] = 0
                     Lpacked[1,-1] = 1
-                T_this_step = solve_banded((1,1),Lpacked,Rpacked)
-                T_old = T_this_step.copy()
+                # Lpacked and Rpacked are workspace arrays rebuilt in every step, the solver may overwrite them
+                T_this_step[:] = solve_banded((1,1),Lpacked,Rpacked,overwrite_ab=True,overwrite_b=True)
+                T_old = T_this_step
             if self._check_convergence(T_last_step, T_this_step):
                 break
             else:
                 # new time discretize scheme
                 discret_steps = 2 * discret_steps
                 time_in_s_per_discret_step = total_time_in_s_to_simulate / discret_steps
-                T_last_step = T_this_step.copy()
+                T_last_step = ws.vector("T_last", n)
+                T_last_step[:] = T_this_step
         return T_this_step, density_effective
 
     def _assemble_time_derivative(
@@ -1702,6 +2015,7 @@ class Forward_model:
         dx_arr: np.ndarray[np.float64],
         T_initial: np.ndarray[np.float64],
         density: np.ndarray[np.float64],
+        out: np.ndarray[np.float64]|None = None,
     ) -> tuple[np.ndarray[np.float64], np.ndarray[np.float64]]:
         """Assemble effective density and time derivative for backward Euler scheme
 
@@ -1709,6 +2023,7 @@ class Forward_model:
             dx_arr (np.ndarray[np.float64]): Thickness of each mesh elements
             T_initial (np.ndarray[np.float64]): Temperature at the start of model
             density (np.ndarray[np.float64]): Surface density of all elements
+            out (np.ndarray[np.float64] | None): Packed array of shape (3,n) to write the time derivative to, by default a new array
 
         Returns:
             tuple[np.ndarray[np.float64],np.ndarray[np.float64]]: _description_
@@ -1716,10 +2031,10 @@ class Forward_model:
         density_effective_arr = self._effective_density(density, T_initial)
         density_effective_sum_arr = density_effective_arr * \
             dx_arr*self._parameters.cp
-        time_derivative_diag = np.convolve(density_effective_sum_arr,[1/3,1/3])
-        time_derivative_subdiag = density_effective_sum_arr/6
-        td_packed = np.zeros((3,len(time_derivative_diag)))
-        td_packed[0,1:] = time_derivative_subdiag
-        td_packed[1,:] = time_derivative_diag
-        td_packed[2,:-1] = time_derivative_subdiag
+        td_packed = np.zeros((3,dx_arr.size+1)) if out is None else out
+        td_packed[0,0] = 0
+        np.divide(density_effective_sum_arr, 6, out=td_packed[0,1:])
+        td_packed[2,:-1] = td_packed[0,1:]
+        td_packed[2,-1] = 0
+        self._sum_to_nodes(density_effective_sum_arr, 1/3, td_packed[1,:])
         return density_effective_arr, td_packed
@@ -1,15 +1,19 @@
 import numpy as np
+import warnings
 from mpi4py import MPI
 import meshio
 import dolfinx  
 from petsc4py import PETSc
 import ufl
 from scipy.interpolate import LinearNDInterpolator
+from scipy.spatial import Delaunay
+from collections import OrderedDict
 
 from warmth.build import single_node
 from .model import Model
 from warmth.logging import logger
-from .mesh_utils import  top_crust,top_sed,thick_crust,  top_lith, top_asth, top_sed_id, bottom_sed_id,NodeGrid
+from .mesh_utils import  top_crust,top_sed,thick_crust,  top_lith, top_asth, top_sed_id, bottom_sed_id, thick_sed, NodeGrid, grid_index_of_points, temperature_from_1d_nodes, GridInterpolator, interpolate_column_rows
+from .mesh_output import XdmfTimeSeriesWriter, BackgroundWriter, Checkpoint, save_checkpoint, load_checkpoint, latest_checkpoint
 from .resqpy_helpers import write_tetra_grid_with_properties, write_hexa_grid_with_properties,read_mesh_resqml_hexa
 def tic():
     #Homemade version of matlab tic and toc functions
@@ -25,6 +29,21 @@ def toc(msg=""):
         return delta
     else:
         print ("Toc: start time not set")
+
+class HeatSolverContext:
+    """Compiled forms, system matrix and linear solver of the time-discretized heat equation.
+       The context is built once per mesh topology and reused across time steps:  the forms refer to the
+       coefficient functions of the model, which are updated in place, the matrix is re-assembled into its
+       existing sparsity pattern, and the KSP keeps the symbolic factorisation of the first assembly.
+    """
+    def __init__(self, bilinear_form, linear_form, dt, A, b, solver):
+        self.bilinear_form = bilinear_form
+        self.linear_form = linear_form
+        self.dt = dt
+        self.A = A
+        self.b = b
+        self.solver = solver
+
 class UniformNodeGridFixedSizeMeshModel:
     """Manages a 3D heat equation computation using dolfinx
        Input is a uniform x-, y-grid of Nodes solved by 1D-SubsHeat 
@@ -32,14 +51,17 @@ class UniformNodeGridFixedSizeMeshModel:
        Zero-sized cells will be increased to be of a small minimum size
 
        The constructor takes a NodeGrid class and the list of 1D nodes
+
+       Under MPI (COMM_WORLD) the mesh is partitioned across ranks.  Every rank holds the (small) global arrays
+       of vertices in original order (mesh_vertices), while dolfinx objects are rank-local;  the maps 
+       mesh_reindex (local geometry index -> original vertex index) and node_index (local cell -> 1D node) 
+       connect the two.  Results are gathered to rank 0 only for output.
     """    
-    point_domain_edge_map = {}
-    point_top_vertex_map = {}
-    point_bottom_vertex_map = {}
     def __init__(self, model:Model, modelName="test", sedimentsOnly = False):
         self.node1D = [n for n in model.builder.iter_node()]
         self.num_nodes = len(self.node1D)
         self.mesh = None
+        self.comm = MPI.COMM_WORLD
 
         self.modelName = modelName
         self.Temp0 = 5
@@ -54,8 +76,26 @@ class UniformNodeGridFixedSizeMeshModel:
         self.numElemInAsth = 0 if self.runSedimentsOnly else 2  # split asth hexahedron into pieces
 
 
+        self.grid = model.builder.grid
         self.num_nodes_x = model.builder.grid.num_nodes_x
         self.num_nodes_y = model.builder.grid.num_nodes_y
+        # depth of the top and bottom mesh vertex per grid node (row j, column i); 1e10 where there is no node
+        self.top_vertex_depth = np.full((self.num_nodes_y, self.num_nodes_x), 1e10)
+        self.bottom_vertex_depth = np.full((self.num_nodes_y, self.num_nodes_x), 1e10)
+        self.node_grid_i, self.node_grid_j, self.node_on_grid = grid_index_of_points([n.X for n in self.node1D], [n.Y for n in self.node1D], self.grid)
+        self.node_at_grid = np.full((self.num_nodes_y, self.num_nodes_x), None, dtype=object)
+        for n, i, j, found in zip(self.node1D, self.node_grid_i, self.node_grid_j, self.node_on_grid):
+            if found:
+                self.node_at_grid[j, i] = n
+        # (num_nodes_y, num_nodes_x) bool array selecting the nodes that contribute a vertical column of vertices to the mesh,
+        # e.g. from quadtree_node_mask;  None uses all nodes.  Set before buildMesh.
+        self.nodeMask = None
+        # with collapseThinLayers, sediment layers thinner than collapseThickness (m) at every mesh node get no row of vertices
+        #   (see activeSedimentLayers);  set before buildMesh
+        self.collapseThinLayers = False
+        self.collapseThickness = 1.0
+        self.activeLayers = None     # sediment layer IDs with a row of vertices in the current mesh;  None: all
+        self.averageLABdepth_per_tti = {}
         self.convexHullEdges = []
         for i in range(self.num_nodes_x-1):
             edge = [i, i+1]
@@ -79,8 +119,23 @@ class UniformNodeGridFixedSizeMeshModel:
         self.mean_porosity = None
         self.c_rho = None
         self.numberOfSediments = model.builder.input_horizons.shape[0]-1 #skip basement
-
-        self.interpolators = {}
+        self.sedimentPropertyTables = {}
+
+        self.interpolators = OrderedDict()   # per time index: interpolators by key, least recently used first
+        self.maxInterpolatorTimeSteps = 2
+        self.nodeTriangulation = None        # Delaunay triangulation of the node positions, only needed if the nodes do not fill the grid
+        self.solverContext = None
+        self.baseFluxDomain = None
+        self.uh = None
+        self.bbTree = None     # bounding box tree of the current mesh geometry, built on demand
+
+        # linear solver configuration: "lu" (direct), "cg-hypre" (CG with BoomerAMG) or "cg-gamg" (CG with PETSc GAMG)
+        self.solverType = "lu"
+        self.solverRelativeTolerance = 1e-10
+        self.solverAbsoluteTolerance = 1e-12
+        self.solverMaxIterations = 1000
+        self.petscOptions = {}      # additional PETSc options, e.g. {"pc_hypre_boomeramg_strong_threshold": 0.7}
+        self.solverIterations = []  # Krylov iterations per time step
    
     def write_tetra_mesh_resqml( self, out_path):
         """Prepares arrays and calls the RESQML output helper function:  the lith and aesth are removed, and the remaining
@@ -90,160 +145,102 @@ class UniformNodeGridFixedSizeMeshModel:
 
            returns the filename (of the .epc file) that was written 
         """            
+        assert self.comm.size == 1, "write_tetra_mesh_resqml only supports serial runs, use write_hexa_mesh_resqml"
         def boundary(x):
             return np.full(x.shape[1], True)
         entities = dolfinx.mesh.locate_entities(self.mesh, 3, boundary )
         tet = dolfinx.cpp.mesh.entities_to_geometry(self.mesh, 3, entities, False)
-        p0 = self.mesh.geometry.x[tet,:]
-        tet_to_keep = []
-        p_to_keep = set()
-        lid_to_keep = []
-        cell_id_to_keep = []
-        for i,t in enumerate(tet):
-            ps = p0[i]
-            minY = np.amin( np.array( [p[1] for p in ps] ) )
-            midpoint = np.sum(ps,axis=0)*0.25
-            lid0 = self.findLayerID(self.tti, midpoint)
-            # 
-            # discard aesth and lith (layer IDs -2, -3)
-            #
-            if (lid0>=-1) and (lid0<100):
-                tet_to_keep.append(t)
-                lid_to_keep.append(lid0)
-                cell_id_to_keep.append(self.node_index[i])
-                if abs(self.node_index[i].Y-minY)>1:
-                    print("unusual Y coordinate:", minY, self.node1D[self.node_index[i]].Y, i, self.node_index[i], self.node1D[self.node_index[i]])
-                for ti in t:
-                    p_to_keep.add(ti)
-        poro0_per_cell = np.array( [ self.getSedimentPropForLayerID('phi', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ] )
-        decay_per_cell = np.array( [ self.getSedimentPropForLayerID('decay', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ])
-        density_per_cell = np.array( [ self.getSedimentPropForLayerID('solidus', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ])
-        cond_per_cell = np.array( [ self.getSedimentPropForLayerID('k_cond', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ])
-        rhp_per_cell = np.array( [ self.getSedimentPropForLayerID('rhp', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ])
-
-        lid_per_cell = np.array(lid_to_keep)
-
-        points_cached = []
-        point_original_to_cached = np.ones(self.mesh.geometry.x.shape[0], dtype = np.int32)  * (-1)
-        for i in range(self.mesh.geometry.x.shape[0]):
-            if (i in p_to_keep):
-                point_original_to_cached[i] = len(points_cached)
-                points_cached.append(self.mesh.geometry.x[i,:])
-        tet_renumbered = [ [point_original_to_cached[i] for i in tet] for tet in tet_to_keep ]
-        T_per_vertex = [ self.uh.x.array[i] for i in range(self.mesh.geometry.x.shape[0]) if i in p_to_keep  ]
-        age_per_vertex = [ self.mesh_vertices_age[i] for i in range(self.mesh.geometry.x.shape[0]) if i in p_to_keep  ]
+        # 
+        # discard aesth and lith (layer IDs -2, -3)
+        #
+        lid_per_tet = self.cell_data_layerID[entities]
+        keep = (lid_per_tet>=-1) & (lid_per_tet<100)
+        lid_per_cell = lid_per_tet[keep].astype(np.int32)
+        cell_id_to_keep = self.node_index[entities][keep]
+
+        poro0_per_cell = self.getSedimentPropForLayerIDs('phi', lid_per_cell, cell_id_to_keep)
+        decay_per_cell = self.getSedimentPropForLayerIDs('decay', lid_per_cell, cell_id_to_keep)
+        density_per_cell = self.getSedimentPropForLayerIDs('solidus', lid_per_cell, cell_id_to_keep)
+        cond_per_cell = self.getSedimentPropForLayerIDs('k_cond', lid_per_cell, cell_id_to_keep)
+        rhp_per_cell = self.getSedimentPropForLayerIDs('rhp', lid_per_cell, cell_id_to_keep)
+
+        p_to_keep, tet_renumbered = np.unique(tet[keep], return_inverse=True)
+        tet_renumbered = tet_renumbered.reshape(-1,4)
+        points_cached = self.mesh.geometry.x[p_to_keep,:]
+        T_per_vertex = self.uh.x.array[p_to_keep]
+        age_per_vertex = np.asarray(self.mesh_vertices_age)[p_to_keep]
         
         from os import path
         filename = path.join(out_path, self.modelName+'_'+str(self.tti)+'.epc')
-        write_tetra_grid_with_properties(filename, np.array(points_cached), tet_renumbered, "tetramesh",
-            np.array(T_per_vertex), np.array(age_per_vertex), poro0_per_cell, decay_per_cell, density_per_cell,
+        write_tetra_grid_with_properties(filename, points_cached, tet_renumbered, "tetramesh",
+            T_per_vertex, age_per_vertex, poro0_per_cell, decay_per_cell, density_per_cell,
             cond_per_cell, rhp_per_cell, lid_per_cell)
         return filename
 
 
-    def write_hexa_mesh_resqml( self, out_path):
+    def write_hexa_mesh_resqml( self, out_path, background=None):
         """Prepares arrays and calls the RESQML output helper function for hexa meshes:  the lith and aesth are removed, and the remaining
            vertices and cells are renumbered;  the sediment properties are prepared for output.
 
            out_path: string: path to write the resqml model to (.epc and .h5 files)
+           background: optional BackgroundWriter;  if given, the file is written on its thread (use background.wait() before reading it)
 
-           returns the filename (of the .epc file) that was written 
+           returns the filename (of the .epc file) that was written;  in parallel runs the model is written by rank 0 only, 
+           and None is returned on the other ranks
         """            
-        x_original_order = self.mesh.geometry.x[:].copy()
-        reverse_reindex_order = np.arange( self.mesh_vertices.shape[0] )
-        for ind,val in enumerate(self.mesh_reindex):
-            x_original_order[val,:] = self.mesh.geometry.x[ind,:]
-            reverse_reindex_order[val] = ind
+        T_original_order = self.gatherFunctionValues(self.uh)
+        if self.comm.rank != 0:
+            return None
+        x_original_order = self.mesh_vertices.copy()
         hexaHedra, hex_data_layerID, hex_data_nodeID = self.buildHexahedra()
 
-        hexa_to_keep = []
-        p_to_keep = set()
-        lid_to_keep = []
-        cond_per_cell = []
-        cell_id_to_keep = []
-        for i,h in enumerate(hexaHedra):
-            lid0 = hex_data_layerID[i]
-            # 
-            # discard aesth and lith (layer IDs -2, -3)
-            #
-            if (lid0>=-1) and (lid0<100):
-                hexa_to_keep.append(h)
-                lid_to_keep.append(lid0)
-                # cell_id_to_keep.append(self.node_index[i])
-                cell_id_to_keep.append(hex_data_nodeID[i])
-                minY = np.amin(np.array ( [x_original_order[hi,1] for hi in h] ))
-                if abs( self.node1D[hex_data_nodeID[i]].Y - minY)>1:
-                    print("weird Y:", minY, self.node1D[hex_data_nodeID[i]].Y, abs( self.node1D[hex_data_nodeID[i]].Y - minY), i, hex_data_nodeID[i])
-                    breakpoint()
-                # if (minY>40000):
-                #     pp = self.getSedimentPropForLayerID('phi', lid0, hex_data_nodeID[i])
-                #     if (pp<0.7) and lid0>=0:
-                #         print("weird phi: ", pp, minY, self.node1D[hex_data_nodeID[i]].Y, abs( self.node1D[hex_data_nodeID[i]].Y - minY), i, hex_data_nodeID[i])
-                #         breakpoint()
-                k_cond_mean = []
-                for hi in h:
-                    p_to_keep.add(hi)
-                    k_cond_mean.append(self.thermalCond.x.array[hi])
-                cond_per_cell.append( np.mean(np.array(k_cond_mean)))
-
-        poro0_per_cell = np.array( [ self.getSedimentPropForLayerID('phi', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ] )
-        decay_per_cell = np.array( [ self.getSedimentPropForLayerID('decay', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ])
-        density_per_cell = np.array( [ self.getSedimentPropForLayerID('solidus', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ])
-        cond_per_cell = np.array( [ self.getSedimentPropForLayerID('k_cond', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ])
-        rhp_per_cell = np.array( [ self.getSedimentPropForLayerID('rhp', lid,cid) for lid,cid in zip(lid_to_keep,cell_id_to_keep) ])
-        lid_per_cell = np.array(lid_to_keep)
-
-        points_cached = []
-        point_original_to_cached = np.ones(self.mesh.geometry.x.shape[0], dtype = np.int32)  * (-1)
-        for i in range(self.mesh.geometry.x.shape[0]):
-            if (i in p_to_keep):
-                point_original_to_cached[i] = len(points_cached)
-                points_cached.append(x_original_order[i,:])
-        hexa_renumbered = [ [point_original_to_cached[i] for i in hexa] for hexa in hexa_to_keep ]
-        
-        for i,h in enumerate(hexa_renumbered):
-            minY = np.amin(np.array ( [np.array(points_cached)[hi,1] for hi in h] ))
-            poro0 = poro0_per_cell[i]
-            lid0  = lid_to_keep[i]
-            # if (minY>40000) and poro0 < 0.8 and lid0>=0:
-            #     print("problem A", minY, poro0, i, h)
-            #     breakpoint()
-            # if (minY<40000) and poro0 > 0.8:
-            #     print("problem B", minY, poro0, i, h)
-            #     breakpoint()
-
-
-        T_per_vertex = [ self.uh.x.array[reverse_reindex_order[i]] for i in range(self.mesh.geometry.x.shape[0]) if i in p_to_keep  ]
-        age_per_vertex = [ self.mesh_vertices_age[reverse_reindex_order[i]] for i in range(self.mesh.geometry.x.shape[0]) if i in p_to_keep  ]
+        # 
+        # discard aesth and lith (layer IDs -2, -3)
+        #
+        keep = (hex_data_layerID>=-1) & (hex_data_layerID<100)
+        lid_per_cell = hex_data_layerID[keep]
+        cell_id_to_keep = hex_data_nodeID[keep]
+
+        poro0_per_cell = self.getSedimentPropForLayerIDs('phi', lid_per_cell, cell_id_to_keep)
+        decay_per_cell = self.getSedimentPropForLayerIDs('decay', lid_per_cell, cell_id_to_keep)
+        density_per_cell = self.getSedimentPropForLayerIDs('solidus', lid_per_cell, cell_id_to_keep)
+        cond_per_cell = self.getSedimentPropForLayerIDs('k_cond', lid_per_cell, cell_id_to_keep)
+        rhp_per_cell = self.getSedimentPropForLayerIDs('rhp', lid_per_cell, cell_id_to_keep)
+
+        p_to_keep, hexa_renumbered = np.unique(hexaHedra[keep], return_inverse=True)
+        hexa_renumbered = hexa_renumbered.reshape(-1,8)
+        points_cached = x_original_order[p_to_keep,:]
+        T_per_vertex = T_original_order[p_to_keep]
+        age_per_vertex = np.asarray(self.mesh_vertices_age_unsorted)[p_to_keep]
 
         from os import path
         filename_hex = path.join(out_path, self.modelName+'_hexa_'+str(self.tti)+'.epc')
-        write_hexa_grid_with_properties(filename_hex, np.array(points_cached), hexa_renumbered, "hexamesh",
-            np.array(T_per_vertex), np.array(age_per_vertex), poro0_per_cell, decay_per_cell, density_per_cell,
+        args = (filename_hex, points_cached, hexa_renumbered, "hexamesh",
+            T_per_vertex, age_per_vertex, poro0_per_cell, decay_per_cell, density_per_cell,
             cond_per_cell, rhp_per_cell, lid_per_cell)
+        if background is None:
+            write_hexa_grid_with_properties(*args)
+        else:
+            background.submit(write_hexa_grid_with_properties, *args)
         return filename_hex
 
     def getSubsidenceAtMultiplePos(self, pos_x, pos_y):
-        """Returns subsidence values at given list of x,y positions.
-            TODO: re-design
+        """Returns subsidence values (depth of the top mesh vertex) at given list of x,y positions.
+           Positions which are not at a node of the grid get the value 1e10
         """            
-        subs1 = []
-        for px,py in zip(pos_x,pos_y):
-            fkey = self.floatKey2D([px+2e-2, py+2e-2])
-            dz = UniformNodeGridFixedSizeMeshModel.point_top_vertex_map.get(fkey, 1e10)
-            subs1.append(dz)
-        return np.array(subs1)
+        i, j, found = grid_index_of_points(pos_x, pos_y, self.grid)
+        subs1 = np.full(found.shape, 1e10)
+        subs1[found] = self.top_vertex_depth[j[found], i[found]]
+        return subs1
 
     def getBaseAtMultiplePos(self, pos_x, pos_y):
         """Returns lowest mesh z values at given list of x,y positions.
-            TODO: re-design
+           Positions which are not at a node of the grid get the value 1e10
         """            
-        subs1 = []
-        for px,py in zip(pos_x,pos_y):
-            fkey = self.floatKey2D([px+2e-2, py+2e-2])
-            dz = UniformNodeGridFixedSizeMeshModel.point_bottom_vertex_map.get(fkey, 1e10)
-            subs1.append(dz)
-        return np.array(subs1)
+        i, j, found = grid_index_of_points(pos_x, pos_y, self.grid)
+        subs1 = np.full(found.shape, 1e10)
+        subs1[found] = self.bottom_vertex_depth[j[found], i[found]]
+        return subs1
 
     def getTopOfLithAtNode(self, tti, node:single_node):
         """Returns crust-lith boundary depth at the given time at the given node
@@ -257,6 +254,31 @@ class UniformNodeGridFixedSizeMeshModel:
         z0 = top_asth( node, tti ) if not self.runSedimentsOnly else 0
         return z0
 
+    def sedimentPropertyTable(self, property):
+        """Returns the given property for all layer IDs at all nodes, as an array of shape (num_nodes, numberOfSediments+3), 
+           where column layer_id+3 holds the value for layer_id (-3 to numberOfSediments-1).  Tables are computed once per property.
+        """
+        if property not in self.sedimentPropertyTables:
+            table = np.full((len(self.node1D), self.numberOfSediments+3), np.nan)
+            for lid in range(-3, 0):
+                table[:, lid+3] = self.getSedimentPropForLayerID(property, lid, 0)
+            for i,node in enumerate(self.node1D):
+                vals = np.asarray(node.sediments[property].values, dtype=np.float64)[:self.numberOfSediments]
+                table[i, 3:3+vals.shape[0]] = vals
+            self.sedimentPropertyTables[property] = table
+        return self.sedimentPropertyTables[property]
+
+    def getSedimentPropForLayerIDs(self, property, layer_id, node_index):
+        """Array version of getSedimentPropForLayerID: gathers the property for arrays of layer IDs and node indices from the lookup table
+        """
+        layer_id = np.asarray(layer_id, dtype=np.int64)
+        node_index = np.asarray(node_index, dtype=np.int64)
+        table = self.sedimentPropertyTable(property)
+        valid = (layer_id>=-3) & (layer_id<self.numberOfSediments)
+        res = np.full(layer_id.shape, np.nan)
+        res[valid] = table[node_index[valid], layer_id[valid]+3]
+        return res
+
     #
     def getSedimentPropForLayerID(self, property, layer_id, node_index):
         """
@@ -379,6 +401,10 @@ class UniformNodeGridFixedSizeMeshModel:
            
            When the option useFakeEncodedZ is set, the z-values are repurposed to encode the index of the vertex in the original, deterministic indexing.
            This is necessary because dolfinx will re-index the vertices upon mesh generation. 
+
+           The rows of vertices at the base of collapsed sediment layers (see activeSedimentLayers) are dropped after the
+           full columns are built;  the full columns are kept in self.mesh_vertices_full, and self.fullOrderIndex maps the
+           mesh vertices into them.
         """           
         tti = time_index
         self.tti = time_index
@@ -391,7 +417,7 @@ class UniformNodeGridFixedSizeMeshModel:
             mean_top_of_asth = np.mean( np.array( [ self.getTopOfAsthAtNode(tti, node) for node in self.node1D ] ) )
             logger.info(f'Time {tti}: mean top of lith: {mean_top_of_lith:.1f}; of aesth: {mean_top_of_asth:.1f} ')
 
-        for node in self.node1D:
+        for node in [ self.node1D[k] for k in self.meshNodeIndices() ]:
             top_of_sediments = top_sed(node, tti)
             self.mesh_vertices_0.append( [ node.X, node.Y, top_of_sediments - 0.0*(self.numberOfSediments+1) ] )
             self.sed_diff_z.append(-self.minimumCellThick*(self.numberOfSediments+1))
@@ -427,9 +453,19 @@ class UniformNodeGridFixedSizeMeshModel:
                     self.sed_diff_z.append(0.0)
                     self.mesh_vertices_age_unsorted.append(1000)
 
-        assert len(self.mesh_vertices_0) % self.num_nodes ==0
+        assert len(self.mesh_vertices_0) % len(self.meshNodeIndices()) ==0
         self.mesh_vertices_0 = np.array(self.mesh_vertices_0)
         self.sed_diff_z = np.array(self.sed_diff_z)
+        self.mesh_vertices_age_unsorted = np.array(self.mesh_vertices_age_unsorted)
+        num_columns = len(self.meshNodeIndices())
+        self.mesh_vertices_full = self.mesh_vertices_0.copy()
+        self.mesh_vertices_full[:,2] = self.mesh_vertices_0[:,2] + self.sed_diff_z
+        v_full = self.mesh_vertices_full.shape[0] // num_columns
+        self.meshRows = np.concatenate([ [0], self.sedimentLayersInMesh()+1, np.arange(self.numberOfSediments+1, v_full) ]).astype(np.int64)
+        self.fullOrderIndex = (np.arange(num_columns)[:,None]*v_full + self.meshRows[None,:]).flatten()
+        self.mesh_vertices_0 = self.mesh_vertices_0[self.fullOrderIndex]
+        self.sed_diff_z = self.sed_diff_z[self.fullOrderIndex]
+        self.mesh_vertices_age_unsorted = self.mesh_vertices_age_unsorted[self.fullOrderIndex]
         self.mesh_vertices = self.mesh_vertices_0.copy()
         self.mesh_vertices[:,2] = self.mesh_vertices_0[:,2] + self.sed_diff_z
         if (useFakeEncodedZ):
@@ -444,16 +480,15 @@ class UniformNodeGridFixedSizeMeshModel:
         self.mesh.geometry.x[:] = self.mesh_vertices[self.mesh_reindex].copy()
         self.mesh_vertices_age = np.array(self.mesh_vertices_age_unsorted)[self.mesh_reindex].copy()
         self.mesh0_geometry_x = self.mesh.geometry.x.copy()      
-        self.mesh_vertices[:,2] = self.mesh_vertices_0[:,2] - self.sed_diff_z
+        self.bbTree = None
         self.updateTopVertexMap()
-        if self.runSedimentsOnly: 
-            self.updateBottomVertexMap()
-        self.mesh_vertices[:,2] = self.mesh_vertices_0[:,2] + self.sed_diff_z
+        self.updateBottomVertexMap()
 
     def buildMesh(self,tti):
         """Construct a new mesh at the given time index tti, and determine the vertex re-indexing induced by dolfinx
         """        
         self.tti = tti
+        self.activeLayers = self.activeSedimentLayers(tti)
         print("buildVertices")
         self.buildVertices(time_index=tti, useFakeEncodedZ=True)
         print("constructMesh")
@@ -471,65 +506,127 @@ class UniformNodeGridFixedSizeMeshModel:
         self.buildVertices(time_index=tti, useFakeEncodedZ=False)
         self.updateVertices()        
 
+    def meshNodeIndices(self):
+        """Returns the indices (into node1D) of the nodes that contribute a vertical column of vertices to the mesh, in node1D order:
+           all nodes, or the nodes selected by self.nodeMask
+        """
+        if self.nodeMask is None:
+            return np.arange(self.num_nodes)
+        keep = self.node_on_grid & np.asarray(self.nodeMask, dtype=bool)[self.node_grid_j, self.node_grid_i]
+        return np.nonzero(keep)[0]
+
+    def verticesPerNode(self):
+        num_columns = len(self.meshNodeIndices())
+        assert len(self.mesh_vertices) % num_columns ==0
+        return len(self.mesh_vertices) // num_columns
+
+    def sedimentLayersInMesh(self):
+        """Returns the IDs of the sediment layers that have a row of vertices in the current mesh:  all, unless layers are collapsed
+        """
+        if self.activeLayers is None:
+            return np.arange(self.numberOfSediments)
+        return np.asarray(self.activeLayers, dtype=np.int64)
+
+    def activeSedimentLayers(self, tti):
+        """Returns the IDs of the sediment layers to be meshed at time index tti:  all layers, or, with collapseThinLayers, 
+           those thicker than collapseThickness at one or more mesh nodes.
+           A collapsed layer has no row of vertices, so that its thickness is merged into the cells of the next meshed layer
+           below (or of the crust);  only collapsing layers that are thin everywhere keeps the same rows in every column.
+        """
+        if not self.collapseThinLayers:
+            return np.arange(self.numberOfSediments)
+        nodes = [ self.node1D[k] for k in self.meshNodeIndices() ]
+        thick = np.array([ [ thick_sed(node, ss, tti) for ss in range(self.numberOfSediments) ] for node in nodes ])
+        thick = thick.reshape(len(nodes), self.numberOfSediments)
+        return np.nonzero(np.amax(thick, axis=0) > self.collapseThickness)[0]
+
+    def needsRebuild(self, tti):
+        """Returns True if the set of collapsed layers at time index tti differs from that of the current mesh, 
+           so that the mesh has to be rebuilt rather than updated
+        """
+        return self.collapseThinLayers and not np.array_equal(self.activeSedimentLayers(tti), self.sedimentLayersInMesh())
+
+    def hexLayerIDs(self, v_per_n):
+        """Returns the layer ID of each of the v_per_n-1 hexahedra in a column: sediment index, or -1, -2, -3 for crust, lith and aesth
+        """
+        sed_ids = self.sedimentLayersInMesh()
+        lid = np.arange(v_per_n-1)
+        ss = lid - len(sed_ids)
+        lid[:len(sed_ids)] = sed_ids
+        lid[(ss>=0) & (ss<self.numElemInCrust)] = -1
+        lid[(ss>=self.numElemInCrust) & (ss < self.numElemInCrust+self.numElemInLith)] = -2
+        lid[(ss>=self.numElemInCrust+self.numElemInLith) & (ss<self.numElemInCrust+self.numElemInLith+self.numElemInAsth)] = -3
+        return lid
+
     def buildHexahedra(self):
+        """Returns the hexahedra (vertex indices, shape (n,8)), their layer IDs and the index of their first corner node.
+           One hexahedron is built per layer per quad of four neighbouring nodes, quads in row-major order.
+        """
+        assert self.nodeMask is None, "hexahedra need the full node grid, use buildPrisms with a node mask"
         xpnum = self.num_nodes_x
         ypnum = self.num_nodes_y
 
-        nodeQuads = []
-        for j in range(ypnum-1):
-            for i in range(xpnum-1):
-                i0 = j * (xpnum)+i
-                q = [ i0, i0+1, i0 + xpnum+1, i0 + xpnum ]
-                nodeQuads.append(q)
-
-        v_per_n = int(len(self.mesh_vertices) / self.num_nodes)
-        assert len(self.mesh_vertices) % self.num_nodes ==0
-
-        hexaHedra = []
-        hex_data_layerID = []
-        hex_data_nodeID = []
-        for q in nodeQuads:
-            for s in range(v_per_n-1):
-                h = []
-                #
-                for i in range(4):
-                    i0 = q[i]*v_per_n + s+1
-                    h.append(i0)
-                for i in range(4):
-                    h.append(q[i]*v_per_n + s)
-                hexaHedra.append(h)
-                lid = s
-                if (s >= self.numberOfSediments):
-                    ss = s - self.numberOfSediments
-                    # lid = -((s+1)-self.numberOfSediments)
-                    if (ss>=0) and (ss<self.numElemInCrust):
-                        lid = -1                        
-                    if (ss>=self.numElemInCrust) and (ss < self.numElemInCrust+self.numElemInLith):
-                        lid = -2                        
-                    if (ss>=self.numElemInCrust+self.numElemInLith) and (ss<self.numElemInCrust+self.numElemInLith+self.numElemInAsth):
-                        lid = -3                        
-                hex_data_layerID.append(lid)
-                hex_data_nodeID.append(q[0])
+        jj, ii = np.meshgrid(np.arange(ypnum-1), np.arange(xpnum-1), indexing="ij")
+        i0 = (jj * xpnum + ii).flatten()
+        nodeQuads = np.stack([ i0, i0+1, i0 + xpnum+1, i0 + xpnum ], axis=1)
+
+        v_per_n = self.verticesPerNode()
+
+        s = np.arange(v_per_n-1)
+        top = nodeQuads[:,None,:]*v_per_n + s[None,:,None]
+        hexaHedra = np.concatenate([top+1, top], axis=2).reshape(-1,8)
+        hex_data_layerID = np.tile(self.hexLayerIDs(v_per_n), nodeQuads.shape[0])
+        hex_data_nodeID = np.repeat(nodeQuads[:,0], v_per_n-1)
         return hexaHedra, hex_data_layerID, hex_data_nodeID
 
+    def buildPrisms(self):
+        """Returns the triangular prisms (vertex indices, shape (n,6)), their layer IDs and the node1D index of their first corner node,
+           for a mesh on the nodes selected by self.nodeMask.
+           The selected nodes are connected by a Delaunay triangulation, which has no hanging nodes where the node spacing changes.
+           One prism is built per layer per triangle;  the triangle corners are sorted by mesh column index, the first three prism
+           vertices are the upper ones.
+        """
+        columns = self.meshNodeIndices()
+        xy = np.array([ [self.node1D[k].X, self.node1D[k].Y] for k in columns ])
+        triangles = np.sort(Delaunay(xy).simplices, axis=1)
+        p = xy[triangles]
+        area = 0.5*np.abs((p[:,1,0]-p[:,0,0])*(p[:,2,1]-p[:,0,1]) - (p[:,2,0]-p[:,0,0])*(p[:,1,1]-p[:,0,1]))
+        assert np.all(area > 1e-6*np.amax(area)), "degenerate triangle in the node triangulation"
+
+        v_per_n = self.verticesPerNode()
+        s = np.arange(v_per_n-1)
+        top = triangles[:,None,:]*v_per_n + s[None,:,None]
+        prisms = np.concatenate([top, top+1], axis=2).reshape(-1,6)
+        prism_data_layerID = np.tile(self.hexLayerIDs(v_per_n), triangles.shape[0])
+        prism_data_nodeID = np.repeat(columns[triangles[:,0]], v_per_n-1)
+        return prisms, prism_data_layerID, prism_data_nodeID
+
     def constructMesh(self):
         """Generates a pseudo-structured tetrahedral mesh based on the vertex positions in self.mesh_vertices.
-           Vertices are grouped by node, and nodes are arranged in a uniform grid.
-           One hexahedron is constructed per layer per four corner nodes, and each hexahedron is split into six tetrahedra.
+           Vertices are grouped by node.  If all nodes of the uniform grid are used, one hexahedron is constructed per layer
+           per four corner nodes, and each hexahedron is split into six tetrahedra.  If self.nodeMask selects a locally refined
+           subset of the nodes, one prism is constructed per layer per triangle of the node triangulation, and each prism is
+           split into three tetrahedra;  the split of each quadrilateral face depends only on the sorted indices of its two
+           columns, so that the tetrahedra of neighbouring prisms match.
            Since dolfinx does not allow zero-sized cells, the mesh vertices must have been separated slightly at degenrate positions.
 
            The meshio library is used to write the mesh to file, from which dolfinx reads it.
         """   
         self.thermalCond = None
-        v_per_n = int(len(self.mesh_vertices) / self.num_nodes)
-        hexaHedra, hex_data_layerID, hex_data_nodeID = self.buildHexahedra()
-
-
-        # https://www.baumanneduard.ch/Splitting%20a%20cube%20in%20tetrahedras2.htm
-        tetsplit1 = [ [1,2,4,8], [1,2,5,8], [4,8,2,3], [2,3,7,8], [2,5,6,8], [2,6,7,8] ]
-        tetsplit0 = [ [ p-1 for p in v ] for v in tetsplit1 ]
+        self.solverContext = None
+        self.bbTree = None
+        v_per_n = self.verticesPerNode()
+        if self.nodeMask is None:
+            hexaHedra, hex_data_layerID, hex_data_nodeID = self.buildHexahedra()
+            # https://www.baumanneduard.ch/Splitting%20a%20cube%20in%20tetrahedras2.htm
+            tetsplit1 = [ [1,2,4,8], [1,2,5,8], [4,8,2,3], [2,3,7,8], [2,5,6,8], [2,6,7,8] ]
+            tetsplit0 = [ [ p-1 for p in v ] for v in tetsplit1 ]
+        else:
+            hexaHedra, hex_data_layerID, hex_data_nodeID = self.buildPrisms()
+            # prism (a,b,c upper; a',b',c' lower) with a<b<c: the face diagonals are a-b', a-c' and b-c'
+            tetsplit0 = [ [0,1,2,5], [0,1,4,5], [0,3,4,5] ]
         lid_per_node = [100]
-        for i in range(self.numberOfSediments):
+        for i in self.sedimentLayersInMesh():
             lid_per_node.append(i)
         if not self.runSedimentsOnly: 
             for i in range(1,self.numElemInCrust+1):
@@ -540,18 +637,12 @@ class UniformNodeGridFixedSizeMeshModel:
                 lid_per_node.append(-3)
         assert len(lid_per_node) == v_per_n
 
-        cells = []
-        cell_data_layerID = []
-        node_index = []
-        c_count = 0
-        for h,lid,nid in zip(hexaHedra, hex_data_layerID, hex_data_nodeID):
-            for t in tetsplit0:
-                candidate_tet_ind = [ h[k] for k in t ]
-                # candidate_tet_pos = np.array(self.mesh_vertices[candidate_tet_ind,:] )
-                cells.append(candidate_tet_ind)
-                cell_data_layerID.append(lid)
-                node_index.append(nid)
-            c_count = c_count + 1
+        cells = hexaHedra[:, tetsplit0].reshape(-1,4)
+        cell_data_layerID = np.repeat(hex_data_layerID, len(tetsplit0))
+        node_index = np.repeat(hex_data_nodeID, len(tetsplit0))
+        # tetrahedra and their layer IDs in original vertex numbering, for output
+        self.tetCells = cells
+        self.tetLayerID = cell_data_layerID
 
         points = self.mesh_vertices.copy()
 
@@ -565,16 +656,22 @@ class UniformNodeGridFixedSizeMeshModel:
         # mesh.write( "mesh/"+self.modelName+"_mesh.vtk")
 
         fn = self.modelName+"_mesh.xdmf"
-        print("saving")  
-        mesh.write( fn )
-        print("saved mesh")             
+        if self.comm.rank == 0:
+            print("saving")  
+            mesh.write( fn )
+            print("saved mesh")             
+        self.comm.Barrier()
         enc = dolfinx.io.XDMFFile.Encoding.HDF5
-        with dolfinx.io.XDMFFile(MPI.COMM_SELF, fn, "r", encoding=enc) as file:
-
-            self.mesh = file.read_mesh(name="Grid" )
+        with dolfinx.io.XDMFFile(self.comm, fn, "r", encoding=enc) as file:
+            # no ghost cells: cell-wise (DG0) arrays then only hold cells owned by this rank
+            self.mesh = file.read_mesh(ghost_mode=dolfinx.mesh.GhostMode.none, name="Grid" )
             aa=file.read_meshtags(self.mesh, name="Grid")
-            self.cell_data_layerID = np.floor(aa.values.copy()*1e-7)-3
-            self.node_index = np.mod(aa.values.copy(),1e7).astype(np.int32)
+        # meshtags are ordered by (rank-local) cell index
+        num_cells_local = self.mesh.topology.index_map(3).size_local + self.mesh.topology.index_map(3).num_ghosts
+        tags = np.zeros(num_cells_local, dtype=np.float64)
+        tags[aa.indices] = aa.values
+        self.cell_data_layerID = np.floor(tags*1e-7)-3
+        self.node_index = np.mod(tags,1e7).astype(np.int32)
         #
         # obtain original vertex order as encoded in z-pos digits
 
@@ -585,33 +682,28 @@ class UniformNodeGridFixedSizeMeshModel:
 
 
 
+    def getAverageLABdepth(self, tti):
+        """Returns the mean depth of the top of the asthenosphere over all nodes at the given time index (cached per time index)
+        """
+        if tti not in self.averageLABdepth_per_tti:
+            self.averageLABdepth_per_tti[tti] = np.mean(np.array([ top_asth(n, tti) for n in self.node1D]))
+        return self.averageLABdepth_per_tti[tti]
+
     def TemperatureGradient(self, x):
-        self.averageLABdepth = np.mean(np.array([ top_asth(n, self.tti) for n in self.node1D]))
-        Zmin, Zmax = np.amin(x[2,:]), np.amax(x[2,:])
-        nz = (x[2,:] - Zmin) / (self.averageLABdepth - Zmin)
-        nz[nz>1.0] = 1.0
+        """Linear temperature profile from Temp0 at the top vertex of each column to TempBase at the average LAB depth, 
+           evaluated at the points x (shape (3, n))
+        """
+        self.averageLABdepth = self.getAverageLABdepth(self.tti)
+        dz = self.getSubsidenceAtMultiplePos(x[0,:], x[1,:])
+        Zmin0 = np.where(dz<1e9, dz, np.amin(x[2,:]))
+        nz = (x[2,:] - Zmin0) / (self.averageLABdepth - Zmin0)
+        nz = np.minimum(nz, 1.0)
         res = nz * (self.TempBase-self.Temp0) + self.Temp0
-        for i in range(x.shape[1]):
-            p = x[:,i]
-            fkey = self.floatKey2D(p+[2e-2, 2e-2,0.0])
-            dz = UniformNodeGridFixedSizeMeshModel.point_top_vertex_map.get(fkey, 1e10)
-            Zmin0 = dz if (dz<1e9) else np.amin(x[2,:])
-            nz0 = (p[2] - Zmin0) / (self.averageLABdepth - Zmin0)
-            nz0 = min(nz0, 1.0)
-            res[i] = nz0 * (self.TempBase-self.Temp0) + self.Temp0
-            if (p[2]>250000):
-                res[i] = 1369
-            # Zmax = np.amax(x[2,:])
+        res[x[2,:]>250000] = 1369
         # res[x[2,:]<self.Zmin] = self.Temp0 + (( x[2,:][x[2,:]<self.Zmin] - self.Zmin)/1000)*12
         return res
 
 
-    def floatKey2D(self, xp):
-        """Returns a tuple of integers from the input xy-point.  This is useful as a dict key for fast lookups. 
-        """   
-        return( int(xp[0]*10), int(xp[1]*10) )
-
-
     def sedimentsConductivitySekiguchi(self): #mean_porosity, conductivity, temperature_C):
         """Scale surface conductivity of sediments to effective conductivity of sediments at depth. Scaler of 0.6 based on Allen & Allen p345. porosity dependent conductivity
         Args:
@@ -682,20 +774,26 @@ class UniformNodeGridFixedSizeMeshModel:
     def buildKappaAndLayerIDs(self):
         """Returns two dolfinx functions, constant-per-cell, on the current mesh:
             one contains thermal conductivity (kappa) values, one contains layer IDs
+            
+            The functions are created once per mesh and updated in place afterwards, 
+            so that compiled forms referring to them stay valid across time steps.
         """   
 
         self.mesh_vertex_layerIDs = np.full_like(self.mesh.geometry.x[:,2], 100, dtype=np.int32 )
-        # piecewise constant Kappa in the tetrahedra
-        Q = dolfinx.fem.FunctionSpace(self.mesh, ("DG", 0))  # discontinuous Galerkin, degree zero
-        thermalCond = dolfinx.fem.Function(Q)
-        c_rho = dolfinx.fem.Function(Q)
-        lid = dolfinx.fem.Function(Q)
-        rhp = dolfinx.fem.Function(Q)
-        self.porosity0 = dolfinx.fem.Function(Q)
-        self.mean_porosity = dolfinx.fem.Function(Q)
-        self.porosityDecay = dolfinx.fem.Function(Q)
-        self.porosityAtDepth = dolfinx.fem.Function(Q)
-        self.rhp0 = dolfinx.fem.Function(Q)
+        if (self.thermalCond is None):
+            # piecewise constant Kappa in the tetrahedra
+            Q = dolfinx.fem.FunctionSpace(self.mesh, ("DG", 0))  # discontinuous Galerkin, degree zero
+            thermalCond = dolfinx.fem.Function(Q)
+            c_rho = dolfinx.fem.Function(Q)
+            lid = dolfinx.fem.Function(Q)
+            rhp = dolfinx.fem.Function(Q)
+            self.porosity0 = dolfinx.fem.Function(Q)
+            self.mean_porosity = dolfinx.fem.Function(Q)
+            self.porosityDecay = dolfinx.fem.Function(Q)
+            self.porosityAtDepth = dolfinx.fem.Function(Q)
+            self.rhp0 = dolfinx.fem.Function(Q)
+        else:
+            thermalCond, c_rho, lid, rhp = self.thermalCond, self.c_rho, self.layerIDsFcn, self.rhpFcn
 
         #
         # subdomains:
@@ -754,40 +852,34 @@ class UniformNodeGridFixedSizeMeshModel:
                 else:
                     if ((lidval) > self.mesh_vertex_layerIDs[ti]) or (self.mesh_vertex_layerIDs[ti]>=100):
                         self.mesh_vertex_layerIDs[ti] = lidval
-        self.updateTopVertexMap()
-        if self.runSedimentsOnly:
-            self.updateBottomVertexMap()
         return thermalCond, c_rho, lid, rhp
 
+    def vertexDepthPerColumn(self):
+        """ Returns the z values of the current vertex positions (as in self.mesh_vertices), arranged as (num_nodes, vertices per node)
+        """
+        v_per_n = self.verticesPerNode()
+        z = self.mesh_vertices_0[:,2] + self.sed_diff_z
+        return z.reshape(-1, v_per_n)
+
     def updateTopVertexMap(self):
-        """ Updates the point_top_vertex_map, used for fast lookup of subsidence values.
-            (to be re-designed?)
+        """ Updates self.top_vertex_depth, the (ny, nx) array used for fast lookup of subsidence values.
+            Uses the global vertex arrays (identical on all ranks), since the top vertex of a column may be owned by another rank
         """ 
-        UniformNodeGridFixedSizeMeshModel.point_top_vertex_map = {}
-        v_per_n = int(len(self.mesh_vertices) / self.num_nodes)
-        if not self.runSedimentsOnly:
-            indices = np.where( np.mod(self.mesh_reindex,v_per_n)==0)[0]
-        else:
-            indices = range(self.mesh.geometry.x.shape[0])
-        for i in indices:
-            p = self.mesh.geometry.x[i,:]
-            fkey = self.floatKey2D(p+[2e-2, 2e-2,0.0])
-            dz = UniformNodeGridFixedSizeMeshModel.point_top_vertex_map.get(fkey, 1e10)
-            if p[2]<dz:
-                UniformNodeGridFixedSizeMeshModel.point_top_vertex_map[fkey] = p[2]
+        zc = self.vertexDepthPerColumn()
+        top = zc[:,0] if not self.runSedimentsOnly else np.amin(zc, axis=1)
+        columns = self.meshNodeIndices()
+        on_grid = self.node_on_grid[columns]
+        self.top_vertex_depth = np.full((self.num_nodes_y, self.num_nodes_x), 1e10)
+        self.top_vertex_depth[self.node_grid_j[columns][on_grid], self.node_grid_i[columns][on_grid]] = top[on_grid]
 
     def updateBottomVertexMap(self):
-        """ Updates the point_bottom_vertex_map, used for fast lookup of subsidence values.
-            (to be re-designed?)
+        """ Updates self.bottom_vertex_depth, the (ny, nx) array used for fast lookup of the depth of the base of the mesh.
         """ 
-        UniformNodeGridFixedSizeMeshModel.point_bottom_vertex_map = {}
-        v_per_n = int(len(self.mesh_vertices) / self.num_nodes)
-        for i in range(self.mesh.geometry.x.shape[0]):
-            p = self.mesh.geometry.x[i,:]
-            fkey = self.floatKey2D(p+[2e-2, 2e-2,0.0])
-            dz = UniformNodeGridFixedSizeMeshModel.point_bottom_vertex_map.get(fkey, -1e10)
-            if p[2]>dz:
-                UniformNodeGridFixedSizeMeshModel.point_bottom_vertex_map[fkey] = p[2]
+        zc = self.vertexDepthPerColumn()
+        columns = self.meshNodeIndices()
+        on_grid = self.node_on_grid[columns]
+        self.bottom_vertex_depth = np.full((self.num_nodes_y, self.num_nodes_x), 1e10)
+        self.bottom_vertex_depth[self.node_grid_j[columns][on_grid], self.node_grid_i[columns][on_grid]] = np.amax(zc, axis=1)[on_grid]
 
     def updateDirichletBaseTemperature(self):
         assert False, "to be re-implemented"
@@ -798,7 +890,7 @@ class UniformNodeGridFixedSizeMeshModel:
             The values at the edges are those in function self.TemperatureStep
         """ 
         # Dirichlet BC at top and bottom
-        self.Zmax = np.amax(self.mesh.geometry.x[:,2])
+        self.Zmax = self.comm.allreduce(np.amax(self.mesh.geometry.x[:,2]), op=MPI.MAX)
         self.averageLABdepth = np.mean(np.array([ top_sed(n, self.tti) for n in self.node1D]))
         def boundary_D_top_bottom(x):
             subs0 = self.getSubsidenceAtMultiplePos(x[0,:], x[1,:])
@@ -826,18 +918,110 @@ class UniformNodeGridFixedSizeMeshModel:
 
     def resetMesh(self):
         self.mesh.geometry.x[:,2] = self.mesh0_geometry_x.copy()[:,2]
+        self.bbTree = None
+
+    def originalVertexIndexOfDofs(self):
+        """ Returns, for every rank-local dof of the function space V, the index of its vertex in the original vertex order (as in self.mesh_vertices).
+            Only CG1 has one dof per vertex.
+        """
+        assert self.CGorder == 1, "the mapping of dofs to mesh vertices requires CGorder 1"
+        def flat(adj):
+            # dolfinx 0.6 returns the dofmaps as AdjacencyList, later versions as numpy arrays
+            return adj.array if hasattr(adj, "array") else np.asarray(adj).flatten()
+        dof_to_geometry = np.zeros(self.uh.x.array.shape[0], dtype=np.int32)
+        # for CG1 on a linear mesh, the cell-local ordering of dofs and of geometry nodes coincide
+        dof_to_geometry[flat(self.V.dofmap.list)] = flat(self.mesh.geometry.dofmap)
+        return self.mesh_reindex[dof_to_geometry]
+
+    def gatherFunctionValues(self, fcn):
+        """ Gathers the values of a function on V (e.g. the temperature self.uh) from all ranks, in original vertex order.
+            Returns the array on rank 0, and None on all other ranks
+        """
+        num_owned = self.V.dofmap.index_map.size_local
+        ind = self.comm.gather(self.dof_original_index[:num_owned], root=0)
+        val = self.comm.gather(fcn.x.array[:num_owned].copy(), root=0)
+        if self.comm.rank != 0:
+            return None
+        res = np.full(self.mesh_vertices.shape[0], np.nan)
+        res[np.concatenate(ind)] = np.concatenate(val)
+        return res
+
+    def fullOrderValues(self, values):
+        """ Returns values per mesh vertex (in original vertex order) on the full columns of self.mesh_vertices_full, 
+            interpolated linearly in depth at the rows of collapsed layers
+        """
+        num_columns = len(self.meshNodeIndices())
+        z_full = self.mesh_vertices_full[:,2].reshape(num_columns, -1)
+        return interpolate_column_rows(values, self.meshRows, z_full)
+
+    def stateFromModel(self, other):
+        """ Returns the temperature of another model on the same nodes, e.g. the model of the previous time step 
+            before the set of collapsed layers changed, as a Checkpoint for the current mesh.
+            The temperature is taken at the vertex depths of the other model.  Must be called on all ranks.
+        """
+        temperature = self.comm.bcast(other.gatherFunctionValues(other.u_n), root=0)
+        temperature = other.fullOrderValues(temperature)[self.fullOrderIndex]
+        return Checkpoint(tti=other.tti, mesh_vertices=self.mesh_vertices.copy(), temperature=temperature, solver_options=other.solverOptions())
+
+    def writeOutputStep(self, writer, tti, fields=("Temperature", "LayerID"), background=None):
+        """ Appends the current state to a time series writer (see mesh_output.XdmfTimeSeriesWriter), in original vertex order.
+            Supported fields are "Temperature" and "Age" (per vertex) and "LayerID" (per cell).
+            If a BackgroundWriter is given, copies of the arrays are handed to it and the write happens on its thread.
+            Must be called on all ranks;  only rank 0 writes, and writer may be None on the other ranks.
+        """
+        point_data = {}
+        if "Temperature" in fields:
+            point_data["Temperature"] = self.gatherFunctionValues(self.u_n)
+        if self.comm.rank != 0:
+            return
+        if "Age" in fields:
+            point_data["Age"] = np.array(self.mesh_vertices_age_unsorted)
+        # layer IDs only change with the cells, they are written once per topology
+        topology_cell_data = { "LayerID": self.tetLayerID } if "LayerID" in fields else {}
+        if background is None:
+            writer.write(tti, self.mesh_vertices, self.tetCells, point_data=point_data, topology_cell_data=topology_cell_data)
+        else:
+            background.submit(writer.write, tti, self.mesh_vertices.copy(), self.tetCells, point_data=point_data, 
+                topology_cell_data=topology_cell_data)
+
+    def solverOptions(self):
+        """ Returns the solver configuration as a dict (stored in checkpoints)
+        """
+        return { "solverType": self.solverType, "solverRelativeTolerance": self.solverRelativeTolerance,
+            "solverAbsoluteTolerance": self.solverAbsoluteTolerance, "solverMaxIterations": self.solverMaxIterations,
+            "petscOptions": self.petscOptions, "CGorder": self.CGorder, "useBaseFlux": self.useBaseFlux, 
+            "baseFluxMagnitude": self.baseFluxMagnitude }
+
+    def setSolverOptions(self, options):
+        """ Applies a solver configuration as returned by solverOptions
+        """
+        for k,v in options.items():
+            assert k in self.solverOptions(), "unknown solver option " + k
+            setattr(self, k, v)
+
+    def createCheckpoint(self):
+        """ Returns the current state as a Checkpoint on rank 0 (None on the other ranks).  Must be called on all ranks.
+            With collapseThinLayers, the checkpoint holds the full columns, so that it matches the mesh of any time index.
+        """
+        temperature = self.gatherFunctionValues(self.u_n)
+        if self.comm.rank != 0:
+            return None
+        if self.collapseThinLayers:
+            return Checkpoint(tti=self.tti, mesh_vertices=self.mesh_vertices_full.copy(), temperature=self.fullOrderValues(temperature), 
+                solver_options=self.solverOptions())
+        return Checkpoint(tti=self.tti, mesh_vertices=self.mesh_vertices.copy(), temperature=temperature, solver_options=self.solverOptions())
 
     def writeLayerIDFunction(self, outfilename, tti=0):
         """ Writes the mesh and the layer ID function (constant value per cell) to the given output file in XDMF format
         """         
-        xdmf = dolfinx.io.XDMFFile(MPI.COMM_WORLD, outfilename, "w")
+        xdmf = dolfinx.io.XDMFFile(self.mesh.comm, outfilename, "w")
         xdmf.write_mesh(self.mesh)
         xdmf.write_function(self.layerIDsFcn, tti)
 
     def writePoroFunction(self, outfilename, tti=0):
         """ Writes the mesh and poro0 function (constant value per cell) to the given output file in XDMF format
         """         
-        xdmf = dolfinx.io.XDMFFile(MPI.COMM_WORLD, outfilename, "w")
+        xdmf = dolfinx.io.XDMFFile(self.mesh.comm, outfilename, "w")
         xdmf.write_mesh(self.mesh)
         xdmf.write_function(self.porosity0, tti)
         # xdmf.write_function(self.thermalCond, tti)
@@ -845,7 +1029,7 @@ class UniformNodeGridFixedSizeMeshModel:
     def writeTemperatureFunction(self, outfilename, tti=0):
         """ Writes the mesh and the current temperature solution to the given output file in XDMF format
         """         
-        xdmf = dolfinx.io.XDMFFile(MPI.COMM_WORLD, outfilename, "w")
+        xdmf = dolfinx.io.XDMFFile(self.mesh.comm, outfilename, "w")
         xdmf.write_mesh(self.mesh)
         xdmf.write_function(self.u_n, tti)
 
@@ -855,7 +1039,7 @@ class UniformNodeGridFixedSizeMeshModel:
             # TODO: this does not work
             #
         """         
-        xdmf = dolfinx.io.XDMFFile(MPI.COMM_WORLD, outfilename, "w")
+        xdmf = dolfinx.io.XDMFFile(self.mesh.comm, outfilename, "w")
         xdmf.write_mesh(self.mesh)
         xdmf.write_function(self.layerIDsFcn, tti)
         xdmf.write_function(self.u_n, tti)
@@ -865,6 +1049,9 @@ class UniformNodeGridFixedSizeMeshModel:
             Sets up the heat equation in dolfinx, and solves the system in time for the given number of steps.
             
             Use skip_setup = True to continue a computation (e.g. after deforming the mesh), instead of starting one from scratch 
+
+            initial_state_model: optional initial state, either another model instance on the same mesh, or a Checkpoint 
+            (temperature per vertex in original vertex order, of the mesh or of its full columns, see createCheckpoint) 
         """     
         if (not skip_setup):
             self.resetMesh()
@@ -888,12 +1075,19 @@ class UniformNodeGridFixedSizeMeshModel:
             # u_n: solution at previous time step
             self.u_n = dolfinx.fem.Function(self.V)
             self.u_n.name = "u_n"
+            self.dof_original_index = self.originalVertexIndexOfDofs()
 
             # initialise both with initial condition: either a step function, or the solution from another Model instance
             if (initial_state_model is None):
                 # self.u_n.interpolate(self.TemperatureStep)
                 self.u_n.interpolate(self.TemperatureGradient)
                 # self.u_n.interpolate(self.TemperatureFromNode)
+            elif isinstance(initial_state_model, Checkpoint):
+                temperature = initial_state_model.temperature
+                if (temperature.shape[0] != self.mesh_vertices.shape[0]) and (temperature.shape[0] == self.mesh_vertices_full.shape[0]):
+                    temperature = temperature[self.fullOrderIndex]
+                assert temperature.shape[0] == self.mesh_vertices.shape[0], "checkpoint does not match the mesh"
+                self.u_n.x.array[:] = temperature[self.dof_original_index]
             else:
                 self.u_n.x.array[:] = initial_state_model.uh.x.array[:].copy()
             self.uh.x.array[:] = self.u_n.x.array[:].copy()
@@ -911,62 +1105,116 @@ class UniformNodeGridFixedSizeMeshModel:
         dt = time_step if (time_step>0) else  3600*24*365 * 5000000
         num_steps = no_steps
 
+        print("mean RHP", np.mean(self.rhpFcn.x.array[:]))
+
+        if ( self.useBaseFlux ):
+            self.updateBaseFluxDomain()
+
+        if (skip_setup is False) or (self.solverContext is None):
+            self.solverContext = self.buildSolverContext()
+        ctx = self.solverContext
+        ctx.dt.value = dt
+
+        # re-assemble into the existing matrix: the sparsity pattern is unchanged, so the
+        #   symbolic factorisation of the solver is reused and only the numeric factorisation is redone
+        ctx.A.zeroEntries()
+        dolfinx.fem.petsc.assemble_matrix(ctx.A, ctx.bilinear_form, bcs=[self.bc])
+        ctx.A.assemble()
+        b = ctx.b
+
+        for i in range(num_steps):
+            t += dt
+
+            # Update the right hand side reusing the initial vector
+            with b.localForm() as loc_b:
+                loc_b.set(0)
+            dolfinx.fem.petsc.assemble_vector(b, ctx.linear_form)
+
+            # TODO: update Dirichlet BC at every time step:
+            #       the temperature at the base of Asth is set such that it reaches Tm at the current depth of the LAB (using the slope adiab=0.0003)
+            # bc = self.buildDirichletBC()
+
+            # Apply Dirichlet boundary condition to the vector
+            dolfinx.fem.petsc.apply_lifting(b, [ctx.bilinear_form], [[self.bc]])
+            b.ghostUpdate(addv=PETSc.InsertMode.ADD_VALUES, mode=PETSc.ScatterMode.REVERSE)
+
+            dolfinx.fem.petsc.set_bc(b, [self.bc])
+
+            # Solve linear problem
+            ctx.solver.solve(b, self.uh.vector)
+            self.uh.x.scatter_forward()
+            if (self.solverType != "lu"):
+                its = ctx.solver.getIterationNumber()
+                self.solverIterations.append(its)
+                logger.info(f'Time {self.tti}, step {i}: {its} {self.solverType} iterations')
+                if ctx.solver.getConvergedReason() < 0:
+                    logger.warning(f'Krylov solver did not converge at time {self.tti}, step {i}: reason {ctx.solver.getConvergedReason()}')
+
+            # Update solution at previous time step (u_n)
+            # diffnorm = np.sum(np.abs(self.u_n.x.array - self.uh.x.array)) / self.u_n.x.array.shape[0]
+            self.u_n.x.array[:] = self.uh.x.array
+
+    def updateBaseFluxDomain(self):
+        """ Updates (in place) the indicator function of the base of the model, where the Neumann (base heat flux) condition applies
+        """
+        if (self.baseFluxDomain is None) or (self.baseFluxDomain.function_space is not self.V):
+            self.baseFluxDomain = dolfinx.fem.Function(self.V)
+        domain_c = self.baseFluxDomain
+        domain_c.x.array[:] = 0
+        if (self.CGorder>1):
+            def marker(x):
+                print(x.shape, x)
+                return x[2,:]>3990
+            facets = dolfinx.mesh.locate_entities_boundary(self.mesh, dim=(self.mesh.topology.dim - 2),
+                                    marker=marker )
+            print(type(facets), facets.shape)
+            dofs = dolfinx.fem.locate_dofs_topological(V=self.V, entity_dim=1, entities=facets)
+            print( type(dofs), len(dofs))
+            print(facets.shape, dofs.shape)
+            if (len(facets)>0):
+                print( np.amax(facets))
+            if (len(dofs)>0):
+                print( np.amax(dofs))
+            print(type(domain_c.x.array), len(domain_c.x.array))
+            domain_c.x.array[ dofs ] = 1
+        else:
+            basepos = self.getBaseAtMultiplePos(self.mesh.geometry.x[:,0], self.mesh.geometry.x[:,1])
+            domain_c.x.array[  self.mesh.geometry.x[:,2] > basepos*0.99 ] = 1
+            xmin, xmax = np.amin(self.mesh_vertices[:,0]), np.amax(self.mesh_vertices[:,0])
+            ymin, ymax = np.amin(self.mesh_vertices[:,1]), np.amax(self.mesh_vertices[:,1])
+            #
+            # remove corners from base heat flow domain
+            domain_c.x.array[  np.logical_and( self.mesh.geometry.x[:,0] < xmin+1, self.mesh.geometry.x[:,1] < ymin+1) ] = 0
+            domain_c.x.array[  np.logical_and( self.mesh.geometry.x[:,0] < xmin+1, self.mesh.geometry.x[:,1] > ymax-1) ] = 0
+            domain_c.x.array[  np.logical_and( self.mesh.geometry.x[:,0] > xmax-1, self.mesh.geometry.x[:,1] < ymin+1) ] = 0
+            domain_c.x.array[  np.logical_and( self.mesh.geometry.x[:,0] > xmax-1, self.mesh.geometry.x[:,1] > ymax-1) ] = 0
+        print("Neumann conditions: ", self.tti, np.count_nonzero(domain_c.x.array))
+
+    def buildSolverContext(self):
+        """ Compiles the bilinear and linear forms of the heat equation and creates the system matrix, right-hand side vector and solver.
+            The forms refer to the coefficient functions (thermalCond, c_rho, rhpFcn, u_n) and to a dolfinx Constant time step, 
+            so the returned context remains valid as long as the mesh topology and the function space are unchanged.
+        """
         #
         #  solver setup, see:
         #  https://jorgensd.github.io/dolfinx-tutorial/chapter2/diffusion_code.html
         #
-
         u = ufl.TrialFunction(self.V)
         v = ufl.TestFunction(self.V)
+        dt = dolfinx.fem.Constant(self.mesh, PETSc.ScalarType(1.0))
 
         a = self.c_rho*u*v*ufl.dx + dt*ufl.dot(self.thermalCond*ufl.grad(u), ufl.grad(v)) * ufl.dx
 
         # source = self.globalSediments.rhp[self.numberOfSediments-1]  * 1e-6   # conversion from uW/m^3
         # f = dolfinx.fem.Constant(self.mesh, PETSc.ScalarType(source))  # source term 
         f = self.rhpFcn # * 1e-6   # conversion from uW/m^3
-        print("mean RHP", np.mean(self.rhpFcn.x.array[:]))
 
         if ( self.useBaseFlux ):
             # baseFlux = 0.03 if (self.tti>50) else 0.03 
             baseFlux = self.baseFluxMagnitude
             # define Neumann condition: constant flux at base
             # expression g defines values of Neumann BC (heat flux at base)
-            x = ufl.SpatialCoordinate(self.mesh)
-            domain_c = dolfinx.fem.Function(self.V)
-            if (self.CGorder>1):
-                def marker(x):
-                    print(x.shape, x)
-                    return x[2,:]>3990
-                facets = dolfinx.mesh.locate_entities_boundary(self.mesh, dim=(self.mesh.topology.dim - 2),
-                                        marker=marker )
-                print(type(facets), facets.shape)
-                dofs = dolfinx.fem.locate_dofs_topological(V=self.V, entity_dim=1, entities=facets)
-                print( type(dofs), len(dofs))
-                print(facets.shape, dofs.shape)
-                if (len(facets)>0):
-                    print( np.amax(facets))
-                if (len(dofs)>0):
-                    print( np.amax(dofs))
-                print(type(domain_c.x.array), len(domain_c.x.array))
-                domain_c.x.array[ dofs ] = 1
-            else:
-                basepos = self.getBaseAtMultiplePos(self.mesh.geometry.x[:,0], self.mesh.geometry.x[:,1])
-                domain_c.x.array[  self.mesh.geometry.x[:,2] > basepos*0.99 ] = 1
-                xmin, xmax = np.amin(self.mesh.geometry.x[:,0]), np.amax(self.mesh.geometry.x[:,0])
-                ymin, ymax = np.amin(self.mesh.geometry.x[:,1]), np.amax(self.mesh.geometry.x[:,1])
-                #
-                # remove corners from base heat flow domain
-                domain_c.x.array[  np.logical_and( self.mesh.geometry.x[:,0] < xmin+1, self.mesh.geometry.x[:,1] < ymin+1) ] = 0
-                domain_c.x.array[  np.logical_and( self.mesh.geometry.x[:,0] < xmin+1, self.mesh.geometry.x[:,1] > ymax-1) ] = 0
-                domain_c.x.array[  np.logical_and( self.mesh.geometry.x[:,0] > xmax-1, self.mesh.geometry.x[:,1] < ymin+1) ] = 0
-                domain_c.x.array[  np.logical_and( self.mesh.geometry.x[:,0] > xmax-1, self.mesh.geometry.x[:,1] > ymax-1) ] = 0
-
-            domain_zero = dolfinx.fem.Function(self.V)
-            toppos = self.getSubsidenceAtMultiplePos(self.mesh.geometry.x[:,0], self.mesh.geometry.x[:,1])
-            domain_zero.x.array[  self.mesh.geometry.x[:,2] < toppos+0.01 ] = 1
-            print("Neumann conditions: ", self.tti, np.count_nonzero(domain_c.x.array), np.count_nonzero(domain_zero.x.array))
-
-            g = (-1.0*baseFlux) * ufl.conditional( domain_c > 0, 1.0, 0.0 )
+            g = (-1.0*baseFlux) * ufl.conditional( self.baseFluxDomain > 0, 1.0, 0.0 )
             L = (self.c_rho*self.u_n + 1e-6*dt*f)*v*ufl.dx - dt * g * v * ufl.ds    # last term reflects Neumann BC 
         else:
             L = (self.c_rho*self.u_n + 1e-6*dt*f)*v*ufl.dx   # no Neumann BC 
@@ -974,42 +1222,45 @@ class UniformNodeGridFixedSizeMeshModel:
         bilinear_form = dolfinx.fem.form(a)
         linear_form = dolfinx.fem.form(L)
 
-        A = dolfinx.fem.petsc.assemble_matrix(bilinear_form, bcs=[self.bc])
-        A.assemble()
+        A = dolfinx.fem.petsc.create_matrix(bilinear_form)
         b = dolfinx.fem.petsc.create_vector(linear_form)
 
-        from petsc4py import PETSc
         solver = PETSc.KSP().create(self.mesh.comm)
-
         solver.setOperators(A)
-        solver.setType(PETSc.KSP.Type.PREONLY)
-        solver.getPC().setType(PETSc.PC.Type.LU)
-        
-        for i in range(num_steps):
-            t += dt
-
-            # Update the right hand side reusing the initial vector
-            with b.localForm() as loc_b:
-                loc_b.set(0)
-            dolfinx.fem.petsc.assemble_vector(b, linear_form)
-
-            # TODO: update Dirichlet BC at every time step:
-            #       the temperature at the base of Asth is set such that it reaches Tm at the current depth of the LAB (using the slope adiab=0.0003)
-            # bc = self.buildDirichletBC()
-
-            # Apply Dirichlet boundary condition to the vector
-            dolfinx.fem.petsc.apply_lifting(b, [bilinear_form], [[self.bc]])
-            b.ghostUpdate(addv=PETSc.InsertMode.ADD_VALUES, mode=PETSc.ScatterMode.REVERSE)
-
-            dolfinx.fem.petsc.set_bc(b, [self.bc])
-
-            # Solve linear problem
-            solver.solve(b, self.uh.vector)
-            self.uh.x.scatter_forward()
-
-            # Update solution at previous time step (u_n)
-            # diffnorm = np.sum(np.abs(self.u_n.x.array - self.uh.x.array)) / self.u_n.x.array.shape[0]
-            self.u_n.x.array[:] = self.uh.x.array
+        self.configureSolver(solver)
+        return HeatSolverContext(bilinear_form, linear_form, dt, A, b, solver)
+
+    def configureSolver(self, solver):
+        """ Configures the PETSc KSP according to self.solverType:
+            "lu" uses a direct solve; "cg-hypre" and "cg-gamg" use conjugate gradients (the heat operator is SPD) 
+            preconditioned with algebraic multigrid, warm-started from the solution of the previous time step.
+            Entries of self.petscOptions are applied last, under a prefix private to this model, and removed from the
+            global PETSc options database afterwards.
+        """
+        assert self.solverType in ["lu", "cg-hypre", "cg-gamg"], "Unknown solver type " + str(self.solverType)
+        pc = solver.getPC()
+        if (self.solverType == "lu"):
+            solver.setType(PETSc.KSP.Type.PREONLY)
+            pc.setType(PETSc.PC.Type.LU)
+        else:
+            solver.setType(PETSc.KSP.Type.CG)
+            solver.setTolerances(rtol=self.solverRelativeTolerance, atol=self.solverAbsoluteTolerance, max_it=self.solverMaxIterations)
+            # uh holds the solution of the previous time step when solve is called
+            solver.setInitialGuessNonzero(True)
+            if (self.solverType == "cg-hypre"):
+                pc.setType(PETSc.PC.Type.HYPRE)
+                pc.setHYPREType("boomeramg")
+            else:
+                pc.setType(PETSc.PC.Type.GAMG)
+        if len(self.petscOptions) > 0:
+            prefix = f"warmth_{id(self)}_"
+            solver.setOptionsPrefix(prefix)
+            opts = PETSc.Options()
+            for key, val in self.petscOptions.items():
+                opts[prefix+key] = val
+            solver.setFromOptions()
+            for key in self.petscOptions:
+                opts.delValue(prefix+key)
 
 
 
@@ -1022,51 +1273,58 @@ class UniformNodeGridFixedSizeMeshModel:
     #
 
     def safeInterpolation(self, interp, pos_x, pos_y, epsilon=1e-2):
-        #
-        # NDLinearInterpolator cannot extrapolate beyond the data points;
-        #   use an epsilon to avoid NaN in sitations where the query point is marginally outside
-        #
-        res = interp([pos_x, pos_y])[0]
-        if (np.isnan(res)):
-            manyres = np.array( [ interp([pos_x-epsilon, pos_y-epsilon])[0], \
-                interp([pos_x+epsilon, pos_y-epsilon])[0],\
-                interp([pos_x-epsilon, pos_y+epsilon])[0],\
-                interp([pos_x+epsilon, pos_y+epsilon])[0]])
-            res = np.nanmean(manyres)
-        if (np.isnan(res)):
-            # print(pos_x, pos_y, interp([pos_x, pos_y]), interp([0,0])[0] )
-            logger.warning(f'NaN encounered in safeInterpolation pos_x {pos_x}:  pos_y: {pos_y};  {interp([pos_x, pos_y])} {interp([0,0])[0]} ')
-        # assert not np.isnan(res), "interpolation is nan in safeInterpolation"
-        return res
+        """Evaluates the interpolator at the given position(s); scalar positions give a scalar result
+        """
+        scalar = np.ndim(pos_x)==0
+        pos_x = np.atleast_1d(np.asarray(pos_x, dtype=np.float64))
+        pos_y = np.atleast_1d(np.asarray(pos_y, dtype=np.float64))
+        if isinstance(interp, GridInterpolator):
+            res = interp(pos_x, pos_y)
+        else:
+            #
+            # NDLinearInterpolator cannot extrapolate beyond the data points;
+            #   use an epsilon to avoid NaN in sitations where the query point is marginally outside
+            #
+            res = interp(np.column_stack([pos_x, pos_y]))
+            nan = np.isnan(res)
+            if np.any(nan):
+                manyres = np.array([ interp(np.column_stack([pos_x[nan]+dx, pos_y[nan]+dy])) \
+                    for dx,dy in [(-epsilon,-epsilon), (epsilon,-epsilon), (-epsilon,epsilon), (epsilon,epsilon)] ])
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", category=RuntimeWarning)
+                    res[nan] = np.nanmean(manyres, axis=0)
+        if (np.any(np.isnan(res))):
+            logger.warning(f'NaN encounered in safeInterpolation at {np.count_nonzero(np.isnan(res))} of {res.shape[0]} positions')
+        return res[0] if scalar else res
 
     def getThickOfCrustAtPos(self, tti, pos_x, pos_y):
         interp = self.getInterpolator(tti, "thick_crust")
         thick_crust_1 = self.safeInterpolation(interp, pos_x, pos_y)        
-        assert not np.isnan(thick_crust_1), "interpolation is nan in thick crust!"
+        assert not np.any(np.isnan(thick_crust_1)), "interpolation is nan in thick crust!"
         return thick_crust_1
 
     def getTopOfCrustAtPos(self, tti, pos_x, pos_y):
         interp = self.getInterpolator(tti, "top_crust")
         top_crust_1 = self.safeInterpolation(interp, pos_x, pos_y)        
-        assert not np.isnan(top_crust_1), "interpolation is nan in top crust!"
+        assert not np.any(np.isnan(top_crust_1)), "interpolation is nan in top crust!"
         return top_crust_1
 
     def getTopOfLithAtPos(self, tti, pos_x, pos_y):
         interp = self.getInterpolator(tti, "topoflith")
         top_lith_1 = self.safeInterpolation(interp, pos_x, pos_y)        
-        assert not np.isnan(top_lith_1), "interpolation is nan in top lith!"
+        assert not np.any(np.isnan(top_lith_1)), "interpolation is nan in top lith!"
         return top_lith_1
 
     def getTopOfAsthAtPos(self, tti, pos_x, pos_y):
         interp = self.getInterpolator(tti, "topofasth")
         top_asth_1 = self.safeInterpolation(interp, pos_x, pos_y)        
-        assert not np.isnan(top_asth_1), "interpolation is nan in top asth!"
+        assert not np.any(np.isnan(top_asth_1)), "interpolation is nan in top asth!"
         return top_asth_1
 
     def getSubsidenceAtPos(self, tti, pos_x, pos_y):
         interp = self.getInterpolator(tti, "subsidence")
         subs1 = self.safeInterpolation(interp, pos_x, pos_y)        
-        assert not np.isnan(subs1), "interpolation is nan in subsidence!"
+        assert not np.any(np.isnan(subs1)), "interpolation is nan in subsidence!"
         return subs1
 
     def getSedPosAtPos(self, tti, pos_x, pos_y, sediment_id, use_top_instead_of_bottom=False):
@@ -1086,30 +1344,32 @@ class UniformNodeGridFixedSizeMeshModel:
     def findLayerID(self, tti, point):
         """Helper function to determine the layer ID for the given point.  Not used by the main simulation workflow
         """
-        px, py, pz = point[0],point[1],point[2]
+        return int(self.findLayerIDs(tti, np.array([point]))[0])
+
+    def findLayerIDs(self, tti, points):
+        """Determines the layer ID for each of the given points (shape (n,3)) by interpolating the layer boundaries at their x,y positions:
+           sediment index, -1, -2, -3 for crust, lith and aesth, or 100 for points above the sediments or not in any layer
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1,3)
+        px, py, pz = points[:,0], points[:,1], points[:,2]
+        lid = np.full(points.shape[0], 100, dtype=np.int32)
         subs = self.getSubsidenceAtPos(tti, px, py)
-        if (pz<subs-0.1):
-            return 100
+        undecided = ~(pz<subs-0.1)
         top_crust = self.getTopOfCrustAtPos(tti, px, py)
         top_lith  = self.getTopOfLithAtPos(tti, px, py)
         top_asth  = self.getTopOfAsthAtPos(tti, px, py)
-        if (pz > top_crust) and (pz<=top_lith):
-            return -1
-        if (pz > top_lith) and (pz<=top_asth):
-            return -2
-        if (pz > top_asth):
-            return -3
+        for in_layer, layer_id in [ ((pz > top_crust) & (pz<=top_lith), -1), ((pz > top_lith) & (pz<=top_asth), -2), (pz > top_asth, -3) ]:
+            lid[undecided & in_layer] = layer_id
+            undecided = undecided & ~in_layer
+        top_sed = self.getSedPosAtPos(tti, px, py, 0, use_top_instead_of_bottom=True)
         for ss in range(self.numberOfSediments):
-            if (ss==0):
-                top_sed = self.getSedPosAtPos(tti, px, py, 0, use_top_instead_of_bottom=True)
-            else:
-                top_sed = self.getSedPosAtPos(tti, px, py, ss-1)
             top_next_sed = self.getSedPosAtPos(tti, px, py, ss)
-            if ( ss == self.numberOfSediments-1):
-                top_next_sed = top_next_sed + 0.1
-            if (pz >= top_sed) and (pz < top_next_sed):
-                return ss
-        return 100
+            bottom = top_next_sed + 0.1 if ( ss == self.numberOfSediments-1) else top_next_sed
+            in_layer = (pz >= top_sed) & (pz < bottom)
+            lid[undecided & in_layer] = ss
+            undecided = undecided & ~in_layer
+            top_sed = top_next_sed
+        return lid
 
 
     def interpolatorKey(self, tti, dataname, sed_id = -1, use_top_instead_of_bottom=False):
@@ -1121,12 +1381,20 @@ class UniformNodeGridFixedSizeMeshModel:
         return key
 
     def getInterpolator(self, tti, dataname, sed_id = -1, use_top_instead_of_bottom=False):
+        """Returns an interpolator of the given node data at time tti.
+           If the nodes fill the regular grid, the interpolator is bilinear on the grid; 
+           otherwise it is linear on a triangulation of the node positions, which is computed only once.
+           Interpolators are cached for the most recently used maxInterpolatorTimeSteps time indices.
+        """
         key = self.interpolatorKey(tti, dataname, sed_id=sed_id, use_top_instead_of_bottom=use_top_instead_of_bottom)
-        if (key in self.interpolators):
-            return self.interpolators[key]
-        
-        xpos = [ node.X for node in self.node1D ]
-        ypos = [ node.Y for node in self.node1D ]
+        if (tti in self.interpolators):
+            self.interpolators.move_to_end(tti)
+            if (key in self.interpolators[tti]):
+                return self.interpolators[tti][key]
+        else:
+            self.interpolators[tti] = {}
+            while len(self.interpolators) > self.maxInterpolatorTimeSteps:
+                self.interpolators.popitem(last=False)
 
         val = None
         if (dataname=="thick_crust"):
@@ -1138,13 +1406,20 @@ class UniformNodeGridFixedSizeMeshModel:
         if (dataname=="sedimentpos"):
             val = [ self.getPosAtNode(tti, i, sed_id, use_top_instead_of_bottom=use_top_instead_of_bottom) for i in range(len(self.node1D)) ]
         if (dataname=="topoflith"):
-            val = [ self.getTopOfLithAtNode(tti, i) for i in range(len(self.node1D)) ]
+            val = [ self.getTopOfLithAtNode(tti, node) for node in self.node1D ]
         if (dataname=="topofasth"):
-            val = [ self.getTopOfAsthAtNode(tti, i) for i in range(len(self.node1D)) ]
+            val = [ self.getTopOfAsthAtNode(tti, node) for node in self.node1D ]
         assert val is not None, "unknown interpolator datanme " + dataname
 
-        interp = LinearNDInterpolator(list(zip(xpos, ypos)), val)
-        self.interpolators[key] = interp
+        if np.all(self.node_at_grid != None):
+            values = np.full((self.num_nodes_y, self.num_nodes_x), np.nan)
+            values[self.node_grid_j[self.node_on_grid], self.node_grid_i[self.node_on_grid]] = np.array(val)[self.node_on_grid]
+            interp = GridInterpolator(self.grid, values)
+        else:
+            if self.nodeTriangulation is None:
+                self.nodeTriangulation = Delaunay(np.array([ [node.X, node.Y] for node in self.node1D ]))
+            interp = LinearNDInterpolator(self.nodeTriangulation, val)
+        self.interpolators[tti][key] = interp
         return interp
 
 
@@ -1191,39 +1466,79 @@ class UniformNodeGridFixedSizeMeshModel:
         is_in_triangle = not (has_neg and has_pos)
         return is_in_triangle
 
+    def getBoundingBoxTree(self):
+        """Returns the bounding box tree of the (rank-local) mesh cells, cached until the mesh geometry changes
+        """
+        if self.bbTree is None:
+            if hasattr(dolfinx.geometry, "bb_tree"):
+                self.bbTree = dolfinx.geometry.bb_tree(self.mesh, self.mesh.topology.dim)
+            else:
+                self.bbTree = dolfinx.geometry.BoundingBoxTree(self.mesh, self.mesh.topology.dim)
+        return self.bbTree
+
+    def evaluateTemperatureAtPoints(self, points, use_1d_fallback=True):
+        """Evaluates the current temperature solution at the given points (shape (n,3)).
+           Cell collisions are computed for all points at once and the solution is evaluated in one call.
+           Points outside the mesh (or all points, if there is no 3D solution yet) are interpolated between the 1D node results,
+           unless use_1d_fallback is False, in which case they are NaN.
+           In parallel runs, all ranks must call this function with the same points, and all ranks receive all values.
+        """
+        points = np.ascontiguousarray(np.asarray(points, dtype=np.float64).reshape(-1,3))
+        res = np.full(points.shape[0], np.nan)
+        if (self.mesh is not None) and (self.uh is not None) and (points.shape[0]>0):
+            tree = self.getBoundingBoxTree()
+            if hasattr(dolfinx.geometry, "compute_collisions_points"):
+                candidates = dolfinx.geometry.compute_collisions_points(tree, points)
+            else:
+                candidates = dolfinx.geometry.compute_collisions(tree, points)
+            colliding = dolfinx.geometry.compute_colliding_cells(self.mesh, candidates, points)
+            offsets = colliding.offsets
+            found = np.diff(offsets) > 0
+            val = np.zeros(points.shape[0])
+            if np.any(found):
+                cells = colliding.array[offsets[:-1][found]]
+                val[found] = self.uh.eval(points[found], cells)[:,0]
+            # points on partition boundaries may be found by several ranks: average
+            count = self.comm.allreduce(found.astype(np.float64), op=MPI.SUM)
+            val = self.comm.allreduce(val, op=MPI.SUM)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                res = np.where(count>0, val/count, np.nan)
+        outside = np.isnan(res)
+        if use_1d_fallback and np.any(outside):
+            res[outside] = temperature_from_1d_nodes(points[outside], self.tti, self.node_at_grid, self.grid)
+        return res
+
+    def extractWellTrajectory(self, trajectory, spacing=None):
+        """Samples the temperature along a well trajectory.
+
+           trajectory: array of shape (m,3): x, y, z (depth, positive down) of the well path
+           spacing: optional sample distance (m) along the trajectory;  if not given, the trajectory points are used as samples
+
+           returns the sample points (shape (n,3)) and the temperature at each sample
+        """
+        trajectory = np.asarray(trajectory, dtype=np.float64).reshape(-1,3)
+        if (spacing is not None) and (trajectory.shape[0]>1):
+            md = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(trajectory, axis=0), axis=1))])
+            md_samples = np.arange(0.0, md[-1]+1e-9, spacing)
+            trajectory = np.stack([ np.interp(md_samples, md, trajectory[:,k]) for k in range(3) ], axis=1)
+        return trajectory, self.evaluateTemperatureAtPoints(trajectory)
+
     # 
     def interpolateResult(self, x):
-        """interpolates the result at given positions x;
-           depends on dolfinx vertex-cell association functions which sometimes fail for no obvious reason..
+        """interpolates the result at given positions x (shape (n,3) or (3,n));
+           positions are first moved marginally into the mesh (below the top vertex, inside the domain edge),
+           then evaluated with evaluateTemperatureAtPoints
         """
-
-        #
-        # the interpolation code is prone to problems, especially when vertices are ouside the mesh
-        # 
         tol = 1.0    # Avoid hitting the outside of the domain
         tol_z = 1.0  # Avoid hitting the outside of the domain
-        plot_points = []
-        meshZmax = np.amax(self.mesh.geometry.x[:,2])
+        meshZmax = self.comm.allreduce(np.amax(self.mesh.geometry.x[:,2]), op=MPI.MAX)
         
         midpoint = np.mean(self.mesh_vertices,axis=0)
-        mzm = []
 
         transpose = x.shape[0]==3 and x.shape[1]!=3
-        if transpose:
-            for xp in x.T:
-                fkey = self.floatKey2D([xp[0]+2e-2, xp[1]+2e-2])
-                meshZmin = UniformNodeGridFixedSizeMeshModel.point_top_vertex_map.get(fkey, 1e10)
-                mzm.append(meshZmin)
-            meshZminV = np.array(mzm)
-            meshZminV2 = np.max([ x.T[:,2], meshZminV], axis=0)
-        else:
-            for xp in x:
-                fkey = self.floatKey2D([xp[0]+2e-2, xp[1]+2e-2])
-                meshZmin = UniformNodeGridFixedSizeMeshModel.point_top_vertex_map.get(fkey, 1e10)
-                # meshZmin = self.getSubsidenceNew(self.tti, xp[0], xp[1])
-                mzm.append(meshZmin)
-            meshZminV = np.array(mzm)
-            meshZminV2 = np.max([ x[:,2], meshZminV], axis=0)
+        xp = x.T if transpose else x
+        meshZminV = self.getSubsidenceAtMultiplePos(xp[:,0], xp[:,1])
+        meshZminV2 = np.max([ xp[:,2], meshZminV], axis=0)
         
         meshZminV3 = np.min([ meshZminV2, np.ones(meshZminV.shape) * meshZmax], axis=0)
         meshZminV4 = meshZminV3.copy()
@@ -1233,78 +1548,20 @@ class UniformNodeGridFixedSizeMeshModel:
         pl_po = x.T.copy() if transpose else x.copy()
         pl_po[:,2] = meshZminV4
 
-        plot_points = []
-        for i in range(pl_po.shape[0]):
-            pt = pl_po[i,:]
-            fkey = self.floatKey2D(pt)
-            on_edge = UniformNodeGridFixedSizeMeshModel.point_domain_edge_map.get(fkey, True)
-            dx, dy = 0.0, 0.0
-            if on_edge:
-                if pt[0]<midpoint[0]:
-                    dx = tol
-                if (pt[0]>midpoint[0]):
-                    dx = -tol
-                if pt[1]<midpoint[1]:
-                    dy = tol
-                if pt[1]>midpoint[1]:
-                    dy = -tol
-            plot_points.append( [ pt[0]+dx, pt[1]+dy, pt[2]] )
-        plot_points = np.array(plot_points)
-
-        bb_tree = dolfinx.geometry.BoundingBoxTree(self.mesh, self.mesh.topology.dim)
-        
-        points_cells = []
-        points_on_proc = []
-        
-        # Find cells whose bounding-box collide with the the points
-        cell_candidates = dolfinx.geometry.compute_collisions(bb_tree, plot_points)
-        
-        
-        res = []
-        for i, point in enumerate(plot_points):
-            # if len(colliding_cells.links(i))>0:
-            #     points_on_proc.append(point)
-            #     points_cells.append(colliding_cells.links(i)[0])
-            if len(cell_candidates.links(i))>0:
-                #points_on_proc.append(point)
-                #points_cells.append(cell_candidates.links(i)[0])
-                for bb in cell_candidates.links(i):
-                    val = self.uh.eval(point, [bb])
-                    if (not np.isnan(val)):
-                        break
-                res.append( val )
-            else:
-                print("need to extrapolate cell for point", i, point)
-                if (point[2]>200000):
-                    try:
-                        points_cells.append(cell_candidates.links(i)[0])
-                        points_on_proc.append(point)
-                    except IndexError:
-                        print("IndexError", point, cell_candidates.links(i) )
-                        breakpoint()
-                        raise
-                else:
-                    print("PING V", point)
-                    if len(cell_candidates.links(i))==0:
-                        print("PING V V", point)
-                        def boundary(x):
-                            return np.full(x.shape[1], True)
-                        entities = dolfinx.mesh.locate_entities(self.mesh, 3, boundary )
-                        breakpoint()
-                    points_on_proc.append(point)
-                    points_cells.append(cell_candidates.links(i)[0])
-        res = np.array(res)
-        aa = np.any(np.isnan(res))
-        bb = np.any(np.isnan(self.uh.x.array))
-        if aa or bb:
-            print(aa,bb)
-            breakpoint()
-
-        if transpose:
-            assert res.flatten().shape[0] == x.shape[1]
-        else:
-            assert res.flatten().shape[0] == x.shape[0]
-        return res.flatten()
+        # move points on the domain edge slightly inwards
+        xmin, xmax = np.amin(self.mesh_vertices[:,0]), np.amax(self.mesh_vertices[:,0])
+        ymin, ymax = np.amin(self.mesh_vertices[:,1]), np.amax(self.mesh_vertices[:,1])
+        on_edge = (pl_po[:,0] < xmin+tol) | (pl_po[:,0] > xmax-tol) | (pl_po[:,1] < ymin+tol) | (pl_po[:,1] > ymax-tol)
+        dx = np.where(pl_po[:,0]<midpoint[0], tol, np.where(pl_po[:,0]>midpoint[0], -tol, 0.0))
+        dy = np.where(pl_po[:,1]<midpoint[1], tol, np.where(pl_po[:,1]>midpoint[1], -tol, 0.0))
+        plot_points = pl_po.copy()
+        plot_points[on_edge,0] = plot_points[on_edge,0] + dx[on_edge]
+        plot_points[on_edge,1] = plot_points[on_edge,1] + dy[on_edge]
+
+        res = self.evaluateTemperatureAtPoints(plot_points)
+        if np.any(np.isnan(res)):
+            logger.warning(f'interpolateResult: no value for {np.count_nonzero(np.isnan(res))} of {res.shape[0]} points')
+        return res
 
     def nodeIsOnDomainEdge(self, node0):
         return any([ e[0]==node0 or e[1]==node0 for e in self.convexHullEdges])
@@ -1321,7 +1578,26 @@ class UniformNodeGridFixedSizeMeshModel:
         return False
 
 
-def run( model:Model, run_simulation=True, start_time=182, end_time=0, out_dir = "out-mapA/"):
+def run( model:Model, run_simulation=True, start_time=182, end_time=0, out_dir = "out-mapA/", output_every=1, output_fields=("Temperature", "LayerID"),
+    background_output=True, max_pending_outputs=2, checkpoint_dir=None, checkpoint_every=10, restart=False, 
+    collapse_thin_layers=False, collapse_thickness=1.0, node_mask=None):
+    """Runs the 3D simulation from start_time to end_time.  Every output_every time steps (and at end_time), the given 
+       output_fields are appended to a single time series out_dir/warmth3D.xdmf (with its .h5 data file)
+
+       With background_output, outputs are written on a background thread while the next time step is solved;
+       at most max_pending_outputs writes are queued before the solver waits.
+
+       If checkpoint_dir is given, a checkpoint is written there every checkpoint_every time steps.  With restart=True, 
+       the run continues after the latest checkpoint in checkpoint_dir (if any) instead of starting at start_time.
+
+       With collapse_thin_layers, sediment layers thinner than collapse_thickness (m) at all nodes are not meshed 
+       (see UniformNodeGridFixedSizeMeshModel.activeSedimentLayers), which makes the early time steps cheaper.  When the set 
+       of collapsed layers changes, the mesh is rebuilt and the temperature is interpolated onto it.
+
+       node_mask: optional (num_nodes_y, num_nodes_x) bool array selecting the nodes of a locally refined mesh 
+       (e.g. from mesh_utils.quadtree_node_mask, see UniformNodeGridFixedSizeMeshModel.nodeMask).  The final hexahedral 
+       RESQML export needs the full node grid and is skipped for a refined mesh.
+    """
 
 
     nums = 4
@@ -1338,21 +1614,58 @@ def run( model:Model, run_simulation=True, start_time=182, end_time=0, out_dir =
     if not run_simulation:
         return
     time_solve = 0.0    
+    checkpoint = None
+    if restart and (checkpoint_dir is not None):
+        cp_filename = latest_checkpoint(checkpoint_dir) if MPI.COMM_WORLD.rank == 0 else None
+        cp_filename = MPI.COMM_WORLD.bcast(cp_filename, root=0)
+        if cp_filename is not None:
+            checkpoint = load_checkpoint(cp_filename)
+            print("Restarting from checkpoint", cp_filename)
+            start_time = checkpoint.tti - 1
+            if start_time < end_time:
+                return
+    # a restarted run writes a separate series, so that the output before the checkpoint is kept
+    series_name = "warmth3D.xdmf" if checkpoint is None else "warmth3D-from-"+str(start_time)+".xdmf"
+    writer = XdmfTimeSeriesWriter(out_dir+series_name) if (writeout and MPI.COMM_WORLD.rank == 0) else None
+    background = BackgroundWriter(max_pending=max_pending_outputs) if (background_output and MPI.COMM_WORLD.rank == 0) else None
     
+    def newMeshModel(tti):
+        mm = UniformNodeGridFixedSizeMeshModel(model, modelName="test"+str(tti))
+        mm.collapseThinLayers = collapse_thin_layers
+        mm.collapseThickness = collapse_thickness
+        mm.nodeMask = node_mask
+        return mm
+
     for tti in range(start_time, end_time-1,-1): #start from oldest
         rebuild_mesh = (tti==start_time)
+        initial_state = None
         if rebuild_mesh:
             print("Rebuild/reload mesh at tti=", tti)          
-            mm2 = UniformNodeGridFixedSizeMeshModel(model, modelName="test"+str(tti))
+            mm2 = newMeshModel(tti)
             print("builing")
             mm2.buildMesh(tti)
             print("done")
+            if checkpoint is not None:
+                mm2.setSolverOptions(checkpoint.solver_options)
+                initial_state = checkpoint
+        elif mm2.needsRebuild(tti):
+            print("Rebuild mesh for changed collapsed layers at tti=", tti)
+            mm_previous = mm2
+            mm2 = newMeshModel(tti)
+            mm2.buildMesh(tti)
+            mm2.setSolverOptions(mm_previous.solverOptions())
+            initial_state = mm2.stateFromModel(mm_previous)
+            rebuild_mesh = True
         else:
             print("Re-generating mesh vertices at tti=", tti)
             mm2.updateMesh(tti)
 
         print("===",tti,"=========== ")
-        if ( len(mms2) == 0):
+        if initial_state is not None:
+            tic()
+            mm2.setupSolverAndSolve( initial_state_model=initial_state, no_steps=nums, time_step=dt, skip_setup=False)
+            time_solve = time_solve + toc(msg="setup solver and solve")
+        elif ( len(mms2) == 0):
             tic()
             mm2.setupSolverAndSolve(no_steps=40, time_step = 314712e8 * 2e2, skip_setup=False)   
             time_solve = time_solve + toc(msg="setup solver and solve")
@@ -1362,15 +1675,29 @@ def run( model:Model, run_simulation=True, start_time=182, end_time=0, out_dir =
             mm2.setupSolverAndSolve( no_steps=nums, time_step=dt, skip_setup=(not rebuild_mesh))
             time_solve = time_solve + toc(msg="setup solver and solve")
         # subvolumes.append(mm2.evaluateVolumes())
-        if (writeout):
+        if (writeout) and (((start_time-tti) % output_every == 0) or (tti==end_time)):
             tic()
-            mm2.writeLayerIDFunction(out_dir+"LayerID-"+str(tti)+".xdmf", tti=tti)
-            mm2.writeTemperatureFunction(out_dir+"Temperature-"+str(tti)+".xdmf", tti=tti)
-            # mm2.writeOutputFunctions(out_dir+"test4-"+str(tti)+".xdmf", tti=tti)
+            mm2.writeOutputStep(writer, tti, fields=output_fields, background=background)
             toc(msg="write function")
+        if (checkpoint_dir is not None) and ((start_time-tti) % checkpoint_every == checkpoint_every-1):
+            cp = mm2.createCheckpoint()
+            if cp is not None:
+                if background is not None:
+                    background.submit(save_checkpoint, cp, checkpoint_dir)
+                else:
+                    save_checkpoint(cp, checkpoint_dir)
         mms2.append(mm2)
         mms_tti.append(tti)
     print("total time solve: " , time_solve)
-    EPCfilename = mm2.write_hexa_mesh_resqml("temp/")
-    print("RESQML model written to: " , EPCfilename)
-    read_mesh_resqml_hexa(EPCfilename)  # test reading of the .epc file
\ No newline at end of file
+    EPCfilename = mm2.write_hexa_mesh_resqml("temp/", background=background) if (node_mask is None) else None
+    if background is not None:
+        if writer is not None:
+            background.submit(writer.close)
+        background.close()
+    elif writer is not None:
+        writer.close()
+    if (mm2.comm.rank == 0) and (EPCfilename is not None):
+        print("RESQML model written to: " , EPCfilename)
+        read_mesh_resqml_hexa(EPCfilename)  # test reading of the .epc file
+    elif (mm2.comm.rank == 0):
+        print("RESQML export skipped: the hexahedral export needs the full node grid")
\ No newline at end of file
@@ -0,0 +1,259 @@
+import numpy as np
+import h5py
+import json
+import os
+import glob
+import queue
+import threading
+from dataclasses import dataclass, field
+from os import path
+
+
+class XdmfTimeSeriesWriter:
+    """Writes a time series of an unstructured mesh and its node and cell fields to a single XDMF file,
+       with the heavy data in one HDF5 file next to it.
+
+       The topology is written only when the cells change, the geometry only when the vertices move;
+       every time step refers to the most recent topology and geometry.  Cell fields that only change with the topology
+       (e.g. layer IDs) are passed as topology_cell_data and written once per topology.
+       The XDMF file is appended to:  a flush writes the grids of the new time steps over the closing tags and then the 
+       closing tags again, so the cost of a step does not grow with the length of the series.
+       All arrays are global (e.g. gathered to rank 0, in original vertex order); only call this from one rank.
+    """
+    topology_types = { 4: "Tetrahedron", 8: "Hexahedron" }
+
+    def __init__(self, filename):
+        """filename: path of the .xdmf file;  the data is written to the same path with extension .h5
+        """
+        self.filename = filename
+        self.h5filename = path.splitext(filename)[0] + ".h5"
+        self.h5file = h5py.File(self.h5filename, "w")
+        self.steps = []          # per time step: time, topology index, geometry index, list of (name, center, dataset path, shape)
+        self.topologies = []     # per written topology: (dataset path, shape, list of (name, center, dataset path, shape))
+        self.geometries = []     # per written geometry: (dataset path, shape)
+        self._last_cells = None
+        self._last_topology_data = None
+        self._last_points = None
+        self.xdmffile = open(filename, "wb")
+        self.xdmffile.write(self._xml_header().encode())
+        self._xml_end = self.xdmffile.tell()  # offset of the closing tags
+        self._xml_steps = 0                   # number of steps in the XDMF file
+        self.flush()
+
+    def _topology_changed(self, cells, topology_data):
+        if (self._last_cells is None) or (self._last_cells.shape != cells.shape) or (not np.array_equal(self._last_cells, cells)):
+            return True
+        if self._last_topology_data.keys() != topology_data.keys():
+            return True
+        return any( not np.array_equal(self._last_topology_data[k], v) for k, v in topology_data.items() )
+
+    def _write_topology(self, cells, topology_data):
+        if self._topology_changed(cells, topology_data):
+            assert cells.shape[1] in self.topology_types, "unsupported cell type with " + str(cells.shape[1]) + " vertices"
+            itop = len(self.topologies)
+            name = "/mesh/topology" + str(itop)
+            self.h5file.create_dataset(name, data=cells.astype(np.int64))
+            attributes = []
+            for field_name, values in topology_data.items():
+                dset = "/mesh/topology" + str(itop) + "_" + field_name
+                self.h5file.create_dataset(dset, data=values)
+                attributes.append((field_name, "Cell", dset, values.shape))
+            self.topologies.append((name, cells.shape, attributes))
+            self._last_cells = cells.copy()
+            self._last_topology_data = { k: v.copy() for k, v in topology_data.items() }
+        return len(self.topologies)-1
+
+    def _write_geometry(self, points):
+        if (self._last_points is None) or (self._last_points.shape != points.shape) or (not np.array_equal(self._last_points, points)):
+            name = "/mesh/geometry" + str(len(self.geometries))
+            self.h5file.create_dataset(name, data=points.astype(np.float64))
+            self.geometries.append((name, points.shape))
+            self._last_points = points.copy()
+        return len(self.geometries)-1
+
+    def write(self, time, points, cells, point_data=None, cell_data=None, topology_cell_data=None):
+        """Appends one time step.
+
+           time: time value of the step (e.g. the time index or age)
+           points: vertex positions, shape (n,3)
+           cells: vertex indices per cell, shape (m,4) or (m,8)
+           point_data, cell_data: dicts of field name to array of values per vertex/per cell, written for this step
+           topology_cell_data: dict of field name to array of values per cell, written only with a new topology
+        """
+        points = np.asarray(points)
+        cells = np.asarray(cells)
+        topology_data = { k: np.asarray(v, dtype=np.float64) for k, v in (topology_cell_data or {}).items() }
+        itop = self._write_topology(cells, topology_data)
+        igeo = self._write_geometry(points)
+        attributes = []
+        for center, data in [("Node", point_data), ("Cell", cell_data)]:
+            if center == "Cell":
+                attributes.extend(self.topologies[itop][2])
+            for name, values in (data or {}).items():
+                values = np.asarray(values, dtype=np.float64)
+                dset = "/fields/" + name + "/" + str(len(self.steps))
+                self.h5file.create_dataset(dset, data=values)
+                attributes.append((name, center, dset, values.shape))
+        self.steps.append((time, itop, igeo, attributes))
+        self.flush()
+
+    def _dataitem(self, dset, shape, number_type="Float", precision=8):
+        dims = " ".join(str(d) for d in shape)
+        h5name = path.basename(self.h5filename)
+        return f'<DataItem Dimensions="{dims}" NumberType="{number_type}" Precision="{precision}" Format="HDF">{h5name}:{dset}</DataItem>'
+
+    def _xml_header(self):
+        return "\n".join(['<?xml version="1.0"?>', '<Xdmf Version="3.0">', '<Domain>',
+            '<Grid Name="TimeSeries" GridType="Collection" CollectionType="Temporal">']) + "\n"
+
+    def _xml_footer(self):
+        return "\n".join(['</Grid>', '</Domain>', '</Xdmf>']) + "\n"
+
+    def _xml_step(self, step):
+        time, itop, igeo, attributes = step
+        top, top_shape, _ = self.topologies[itop]
+        geo, geo_shape = self.geometries[igeo]
+        lines = ['<Grid Name="mesh" GridType="Uniform">']
+        lines.append(f'<Time Value="{time}"/>')
+        lines.append(f'<Topology TopologyType="{self.topology_types[top_shape[1]]}" NumberOfElements="{top_shape[0]}">')
+        lines.append(self._dataitem(top, top_shape, number_type="Int"))
+        lines.append('</Topology>')
+        lines.append('<Geometry GeometryType="XYZ">')
+        lines.append(self._dataitem(geo, geo_shape))
+        lines.append('</Geometry>')
+        for name, center, dset, shape in attributes:
+            lines.append(f'<Attribute Name="{name}" AttributeType="Scalar" Center="{center}">')
+            lines.append(self._dataitem(dset, shape))
+            lines.append('</Attribute>')
+        lines.append('</Grid>')
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Flushes the HDF5 data and appends the new time steps to the XDMF file, so that the output is readable while the run continues
+        """
+        self.h5file.flush()
+        f = self.xdmffile
+        f.seek(self._xml_end)
+        for step in self.steps[self._xml_steps:]:
+            f.write(self._xml_step(step).encode())
+        self._xml_steps = len(self.steps)
+        self._xml_end = f.tell()
+        f.write(self._xml_footer().encode())
+        f.truncate()
+        f.flush()
+
+    def close(self):
+        if self.h5file is not None:
+            self.flush()
+            self.h5file.close()
+            self.h5file = None
+            self.xdmffile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BackgroundWriter:
+    """Runs output tasks (e.g. XdmfTimeSeriesWriter.write or RESQML export) on a background thread, in submission order,
+       so that writing overlaps with the next solve.
+
+       At most max_pending tasks are queued: submit blocks while the queue is full, which bounds the memory held by
+       the copies of the arrays passed to the tasks.  If a task raises an exception, the later tasks still run (so that e.g. 
+       checkpoints and the closing of files are not lost), and the first exception is re-raised by every later submit, 
+       wait and close.
+    """
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def _work(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                func, args, kwargs = task
+                func(*args, **kwargs)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, func, *args, **kwargs):
+        """Queues func(*args, **kwargs).  The arguments must not be modified afterwards; pass copies of arrays that change
+        """
+        self._raise_error()
+        assert self.thread.is_alive(), "BackgroundWriter is closed"
+        self.queue.put((func, args, kwargs))
+
+    def wait(self):
+        """Blocks until all queued tasks are done
+        """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Finishes all queued tasks and stops the background thread
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@dataclass
+class Checkpoint:
+    """State of a 3D simulation at the end of time index tti, in original vertex order, for restarting a run
+       or as initial state of a new run (see UniformNodeGridFixedSizeMeshModel.setupSolverAndSolve)
+    """
+    tti: int
+    mesh_vertices: np.ndarray     # vertex positions, shape (n,3)
+    temperature: np.ndarray       # temperature (u_n) per vertex, shape (n,)
+    solver_options: dict = field(default_factory=dict)
+
+
+def checkpoint_filename(directory, tti):
+    return path.join(directory, f"checkpoint_{tti:04d}.npz")
+
+
+def save_checkpoint(checkpoint:Checkpoint, directory):
+    """Writes the checkpoint to directory/checkpoint_<tti>.npz and returns the filename.
+       The file is written under a temporary name first, so that an interrupted write never leaves a partial checkpoint.
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = checkpoint_filename(directory, checkpoint.tti)
+    tmp_filename = filename + ".tmp.npz"
+    np.savez_compressed(tmp_filename, tti=checkpoint.tti, mesh_vertices=checkpoint.mesh_vertices,
+        temperature=checkpoint.temperature, solver_options=json.dumps(checkpoint.solver_options))
+    os.replace(tmp_filename, filename)
+    return filename
+
+
+def load_checkpoint(filename) -> Checkpoint:
+    with np.load(filename) as data:
+        return Checkpoint(tti=int(data["tti"]), mesh_vertices=data["mesh_vertices"], temperature=data["temperature"],
+            solver_options=json.loads(str(data["solver_options"])))
+
+
+def latest_checkpoint(directory):
+    """Returns the filename of the most advanced checkpoint in the directory (the lowest time index, as runs go from old to young), 
+       or None if there is none
+    """
+    files = sorted(glob.glob(path.join(directory, "checkpoint_[0-9][0-9][0-9][0-9].npz")))
+    return files[0] if len(files)>0 else None
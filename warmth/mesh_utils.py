@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+import numpy as np
 
 from warmth.build import single_node
 
@@ -62,6 +63,204 @@ def getNodeParameters(node):
     return xx
 
 
+def grid_index_of_points(pos_x, pos_y, grid, tolerance=0.1):
+    """Maps x,y positions to the (i,j) indices of the nodes of a regular grid, arithmetically.
+
+    Parameters
+    ----------
+    pos_x, pos_y : array-like
+        Positions to map
+    grid : Grid | NodeGrid
+        Regular grid, defined by origin_x, origin_y, step_x, step_y, num_nodes_x and num_nodes_y
+    tolerance : float
+        Maximum distance (in x and y) of a position from its node
+
+    Returns
+    -------
+    i : np.ndarray[np.int64]
+        Column (x) index of the nearest node
+    j : np.ndarray[np.int64]
+        Row (y) index of the nearest node
+    found : np.ndarray[bool]
+        False where the position is not at a node of the grid
+    """
+    pos_x = np.asarray(pos_x, dtype=np.float64)
+    pos_y = np.asarray(pos_y, dtype=np.float64)
+    fi = (pos_x - grid.origin_x) / grid.step_x
+    fj = (pos_y - grid.origin_y) / grid.step_y
+    i = np.rint(fi).astype(np.int64)
+    j = np.rint(fj).astype(np.int64)
+    found = (np.abs(fi-i)*abs(grid.step_x) <= tolerance) & (np.abs(fj-j)*abs(grid.step_y) <= tolerance)
+    found = found & (i >= 0) & (i < grid.num_nodes_x) & (j >= 0) & (j < grid.num_nodes_y)
+    i[~found] = 0
+    j[~found] = 0
+    return i, j, found
+
+def bilinear_cell_of_points(pos_x, pos_y, grid):
+    """Finds the cell of a regular grid containing each x,y position, and the bilinear weights within the cell.
+       Positions outside the grid are clamped to the nearest edge.
+
+    Parameters
+    ----------
+    pos_x, pos_y : array-like
+        Positions
+    grid : Grid | NodeGrid
+        Regular grid, defined by origin_x, origin_y, step_x, step_y, num_nodes_x and num_nodes_y
+
+    Returns
+    -------
+    i0, i1, j0, j1 : np.ndarray[np.int64]
+        Column and row indices of the four corner nodes
+    wx, wy : np.ndarray[np.float64]
+        Weights of the corners i1 and j1 (in [0,1])
+    """
+    fi = (np.asarray(pos_x, dtype=np.float64) - grid.origin_x) / grid.step_x
+    fj = (np.asarray(pos_y, dtype=np.float64) - grid.origin_y) / grid.step_y
+    i0 = np.clip(np.floor(fi), 0, max(grid.num_nodes_x-2, 0)).astype(np.int64)
+    j0 = np.clip(np.floor(fj), 0, max(grid.num_nodes_y-2, 0)).astype(np.int64)
+    i1 = np.minimum(i0+1, grid.num_nodes_x-1)
+    j1 = np.minimum(j0+1, grid.num_nodes_y-1)
+    wx = np.where(i1>i0, np.clip(fi-i0, 0.0, 1.0), 0.0)
+    wy = np.where(j1>j0, np.clip(fj-j0, 0.0, 1.0), 0.0)
+    return i0, i1, j0, j1, wx, wy
+
+def temperature_from_1d_nodes(points, tti, node_at_grid, grid):
+    """Temperature at 3D points, interpolated bilinearly between the 1D results of the surrounding nodes, 
+       and linearly in depth within each node.  Used where there is no 3D solution.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Points, shape (n, 3)
+    tti : int
+        Time index (age) of the 1D results
+    node_at_grid : np.ndarray
+        Object array of shape (num_nodes_y, num_nodes_x) holding the node at every grid position (None where missing)
+    grid : Grid | NodeGrid
+        Regular grid of the nodes
+
+    Returns
+    -------
+    np.ndarray
+        Temperature per point. NaN where no surrounding node has a result
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1,3)
+    i0, i1, j0, j1, wx, wy = bilinear_cell_of_points(points[:,0], points[:,1], grid)
+    res = np.zeros(points.shape[0])
+    wsum = np.zeros(points.shape[0])
+    for jj, ii, w in [ (j0, i0, (1-wx)*(1-wy)), (j0, i1, wx*(1-wy)), (j1, i0, (1-wx)*wy), (j1, i1, wx*wy) ]:
+        flat = jj*node_at_grid.shape[1] + ii
+        for f in np.unique(flat):
+            node = node_at_grid.flat[f]
+            if (node is None) or (node.result is None):
+                continue
+            sel = (flat==f) & (w>0)
+            if not np.any(sel):
+                continue
+            temp = node.result.temperature(tti)
+            valid = ~np.isnan(temp["values"]) & ~np.isnan(temp["depth"])
+            val = np.interp(points[sel,2], temp["depth"][valid], temp["values"][valid])
+            res[sel] = res[sel] + w[sel]*val
+            wsum[sel] = wsum[sel] + w[sel]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(wsum>0, res/wsum, np.nan)
+
+class GridInterpolator:
+    """Bilinear interpolation of values given at the nodes of a regular grid.
+       Positions marginally (up to epsilon) outside the grid are clamped onto it, positions further outside are NaN.
+       Values may be NaN at missing nodes; a position is NaN if any surrounding node with non-zero weight is NaN.
+    """
+    def __init__(self, grid, values, epsilon=1e-2):
+        self.grid = grid
+        self.values = np.asarray(values, dtype=np.float64).reshape(grid.num_nodes_y, grid.num_nodes_x)
+        self.epsilon = epsilon
+
+    def __call__(self, pos_x, pos_y):
+        pos_x = np.asarray(pos_x, dtype=np.float64)
+        pos_y = np.asarray(pos_y, dtype=np.float64)
+        g = self.grid
+        x_max = g.origin_x + (g.num_nodes_x-1)*g.step_x
+        y_max = g.origin_y + (g.num_nodes_y-1)*g.step_y
+        inside = (pos_x >= g.origin_x-self.epsilon) & (pos_x <= x_max+self.epsilon) & \
+            (pos_y >= g.origin_y-self.epsilon) & (pos_y <= y_max+self.epsilon)
+        i0, i1, j0, j1, wx, wy = bilinear_cell_of_points(pos_x, pos_y, g)
+        v = self.values
+        res = np.zeros(i0.shape)
+        for jj, ii, w in [ (j0, i0, (1-wx)*(1-wy)), (j0, i1, wx*(1-wy)), (j1, i0, (1-wx)*wy), (j1, i1, wx*wy) ]:
+            res = res + np.where(w>0, w*v[jj, ii], 0.0)
+        return np.where(inside, res, np.nan)
+
+def quadtree_node_mask(refine, coarse_every=8):
+    """Selects the nodes of a regular grid for a locally refined mesh by quadtree refinement.
+
+       The grid is covered by blocks with corners on every coarse_every-th row and column (and the last row and column).
+       A block is split in four, adding the nodes at its edge midpoints and centre, while refine is True anywhere within
+       the block or within one block size around it, so that the node spacing changes gradually towards the refined areas.
+       Down to spacing one, where all nodes are selected.
+
+    Parameters
+    ----------
+    refine : np.ndarray[bool]
+        (num_nodes_y, num_nodes_x) array, True where every node is needed (e.g. around wells and structures)
+    coarse_every : int
+        Node spacing of the coarsest blocks, preferably a power of two
+
+    Returns
+    -------
+    mask : np.ndarray[bool]
+        (num_nodes_y, num_nodes_x) array, True for the selected nodes;  always includes the grid corners
+    """
+    refine = np.asarray(refine, dtype=bool)
+    ny, nx = refine.shape
+    mask = np.zeros((ny, nx), dtype=bool)
+    def spans(n):
+        breaks = sorted(set(range(0, n, coarse_every)) | {n-1})
+        return list(zip(breaks[:-1], breaks[1:])) or [(0, 0)]
+    blocks = [ (r0, r1, c0, c1) for r0, r1 in spans(ny) for c0, c1 in spans(nx) ]
+    while len(blocks) > 0:
+        refined = []
+        for r0, r1, c0, c1 in blocks:
+            mask[[r0, r0, r1, r1], [c0, c1, c0, c1]] = True
+            sr, sc = r1-r0, c1-c0
+            if (sr <= 1) and (sc <= 1):
+                continue
+            if refine[max(r0-sr, 0):r1+sr+1, max(c0-sc, 0):c1+sc+1].any():
+                rm, cm = (r0+r1)//2, (c0+c1)//2
+                row_halves = [(r0, rm), (rm, r1)] if sr > 1 else [(r0, r1)]
+                col_halves = [(c0, cm), (cm, c1)] if sc > 1 else [(c0, c1)]
+                refined.extend( (a, b, c, d) for a, b in row_halves for c, d in col_halves )
+        blocks = refined
+    return mask
+
+def interpolate_column_rows(values, rows, z):
+    """Interpolates values given at a subset of the vertex rows of every column (e.g. of a mesh with collapsed layers)
+       linearly in depth to all rows of the columns.  Rows above the first or below the last given row take its value.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (num_columns, len(rows)) values at the given rows, or the same values flattened column by column
+    rows : np.ndarray[int]
+        Increasing indices of the rows at which values are given
+    z : np.ndarray
+        (num_columns, num_rows) depth of every row of every column, non-decreasing along each column
+
+    Returns
+    -------
+    result : np.ndarray
+        (num_columns*num_rows,) values at all rows, flattened column by column
+    """
+    rows = np.asarray(rows)
+    z = np.asarray(z, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(z.shape[0], len(rows))
+    r = np.arange(z.shape[1])
+    lo = np.clip(np.searchsorted(rows, r, side="right")-1, 0, len(rows)-1)
+    hi = np.clip(np.searchsorted(rows, r, side="left"), 0, len(rows)-1)
+    z_lo, z_hi = z[:, rows[lo]], z[:, rows[hi]]
+    dz = z_hi - z_lo
+    w = np.clip(np.divide(z - z_lo, dz, out=np.zeros_like(z), where=dz>0), 0.0, 1.0)
+    return (values[:, lo]*(1-w) + values[:, hi]*w).flatten()
+
 def top_crust(nn, tti):
     if (tti > nn.subsidence.shape[0]-1):    
         return 0.0
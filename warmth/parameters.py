@@ -1,4 +1,5 @@
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import pickle
 from warmth.utils import compressed_pickle_open, compressed_pickle_save
@@ -45,6 +46,10 @@ class Parameters:
         self.maxContLith: float = 130000.0
         self.starting_beta: float = 1.1
         self.positive_down = True
+        self.track_grain_thickness: bool = True
+        self.advection_scheme: str = "pchip"
+        self.beta_trial_continuation: bool = True
+        self._eustatic_sea_level_table = None
 
         pass
 
@@ -362,6 +367,62 @@ class Parameters:
             logger.warning("Accept boolean")
         return
 
+    @property
+    def track_grain_thickness(self):
+        """Carry the grain (solid) thickness and maximum burial depth of each sediment cell through time,
+        instead of decompacting the sediment column at every time step
+
+        :return: True if grain thickness is tracked
+        :rtype: bool
+        """
+        return self._track_grain_thickness
+
+    @track_grain_thickness.setter
+    def track_grain_thickness(self, val):
+        if isinstance(val, bool):
+            self._track_grain_thickness = val
+        else:
+            logger.warning("Accept boolean")
+        return
+
+    @property
+    def advection_scheme(self):
+        """Interpolation of the temperature profile to the thinned crust and lithosphere during rifting.
+        "pchip": monotone piecewise cubic; "linear": linear interpolation, faster but more diffusive.
+        "linear" is not a near-equivalent of "pchip": with the rift at 160-145 Ma of the integration test the temperatures
+        differ by up to 0.3 C, but with a rift at 120-100 Ma by up to 11.4 C, and node depths by up to about 1 km
+
+        :return: Advection scheme
+        :rtype: str
+        """
+        return self._advection_scheme
+
+    @advection_scheme.setter
+    def advection_scheme(self, val):
+        if val in ("pchip", "linear"):
+            self._advection_scheme = val
+        else:
+            logger.warning("Accept 'pchip' or 'linear' only")
+        return
+
+    @property
+    def beta_trial_continuation(self):
+        """Compute the time steps before rifting once per rift event and start every further beta trial from the state at rift onset,
+        as these time steps do not depend on beta
+
+        :return: True if beta trials resume from rift onset
+        :rtype: bool
+        """
+        return self._beta_trial_continuation
+
+    @beta_trial_continuation.setter
+    def beta_trial_continuation(self, val):
+        if isinstance(val, bool):
+            self._beta_trial_continuation = val
+        else:
+            logger.warning("Accept boolean")
+        return
+
     @property
     def time_step_Ma(self):
         """Time step to solve
@@ -379,6 +440,35 @@ class Parameters:
             logger.warning("Accept -1 only")
         return
 
+    def eustatic_sea_level_at(self, time_Ma: int) -> float:
+        """Eustatic sea level change at the given time step
+
+        The values in eustatic_sea_level are copied once into an array indexed by age, which is shared by all nodes
+        and beta trials simulated with these parameters. It is rebuilt when eustatic_sea_level is replaced.
+        Ages are matched exactly: only integral ages are tabulated, and any other age raises an IndexError.
+
+        :param time_Ma: Age of the time step (Ma)
+        :return: Sea level change (m)
+        :rtype: float
+        """
+        sealevel = self.eustatic_sea_level
+        cached = getattr(self, "_eustatic_sea_level_table", None)
+        if (cached is None) or (cached[0] is not sealevel):
+            age = np.asarray(sealevel["age"], dtype=np.float64)
+            entries = np.nonzero(age == np.rint(age))[0]
+            age = age[entries].astype(np.int64)
+            age_min = int(age.min()) if age.size > 0 else 0
+            index_of_age = np.full(int(age.max())-age_min+1 if age.size > 0 else 0, -1, dtype=np.int64)
+            # reversed, so that the first entry wins for repeated ages
+            index_of_age[age[::-1]-age_min] = entries[::-1]
+            table = np.asarray(sealevel["sea_level_changes"], dtype=np.float64)
+            cached = self._eustatic_sea_level_table = (sealevel, age_min, index_of_age, table)
+        _, age_min, index_of_age, table = cached
+        ind = int(time_Ma) - age_min
+        if (ind != time_Ma - age_min) or (ind < 0) or (ind >= index_of_age.size) or (index_of_age[ind] < 0):
+            raise IndexError(f"No eustatic sea level at {time_Ma} Ma")
+        return table[index_of_age[ind]]
+
     def dump(self,filepath:Path):
         with open(filepath, "wb") as f:
             pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
@@ -18,12 +18,65 @@ class Results:
         self._k_crust=k_crust
         self._k_lith=k_lith
         self._k_asth=k_asth
+        self._layer_tables:dict|None=None
+        self._cache:dict={}
 
     class resultValues(TypedDict):
         depth: np.ndarray[np.float64]
         layerId: np.ndarray[np.int32]
         value:np.ndarray[np.float64]
 
+    def _cached(self,key:tuple,func)->np.ndarray:
+        """Per-age derived fields are computed once. Cached arrays are read-only, public methods return copies
+        """
+        if key not in self._cache:
+            val = func()
+            val.flags.writeable = False
+            self._cache[key] = val
+        return self._cache[key]
+
+    def _layer_property_tables(self)->dict:
+        """Per-layer property arrays (phi, decay, k_cond) indexed by layer id + 3,
+        so that ids -3, -2 and -1 map to asthenosphere, lithospheric mantle and crust
+
+        Returns
+        -------
+        dict
+            Property name to (table, value for invalid layer ids)
+        """
+        if self._layer_tables is None:
+            sed_idx = np.asarray(self._sediment_input.index.values,dtype=int)
+            size = 3 + (np.amax(sed_idx)+1 if sed_idx.size>0 else 0)
+            tables = {}
+            for name, fill, basement in [("phi",0.0,[0.0,0.0,0.0]),("decay",0.0,[0.0,0.0,0.0]),("k_cond",np.nan,[self._k_asth,self._k_lith,self._k_crust])]:
+                table = np.full(size,fill_value=fill,dtype=float)
+                table[:3] = basement
+                table[sed_idx+3] = self._sediment_input[name].values
+                tables[name] = (table,fill)
+            self._layer_tables = tables
+        return self._layer_tables
+
+    def _layer_property(self,sed_id:np.ndarray,name:str)->np.ndarray[np.float64]:
+        """Gather a layer property for an array of layer ids
+
+        Parameters
+        ----------
+        sed_id : np.ndarray
+            Layer ids, of any shape
+        name : str
+            phi, decay or k_cond
+
+        Returns
+        -------
+        np.ndarray
+            Property values with the shape of sed_id
+        """
+        table, fill = self._layer_property_tables()[name]
+        with np.errstate(invalid="ignore"):
+            valid = np.isfinite(sed_id) & (sed_id >= -3) & (sed_id < table.size-3)
+        idx = np.where(valid,sed_id,-3).astype(int)+3
+        return np.where(valid,table[idx],fill)
+
     @property
     def ages(self)->np.ndarray[np.int32]:
         """Array of all simulated ages
@@ -184,21 +237,8 @@ class Results:
             Porosity at centre of cells
         """
         sed_id = self.sediment_ids(age)
-        initial_poro = np.full(sed_id.size,fill_value=0,dtype=float)
-        initial_decay = np.full(sed_id.size,fill_value=0,dtype=float)
-        for idx, row in self._sediment_input.iterrows():
-            sed_idx = np.argwhere(sed_id == idx).flatten()
-            if sed_idx.size >0:
-                initial_poro[sed_idx] = row["phi"]
-                initial_decay[sed_idx] = row["decay"]
+        v = self._cached(("porosity",age),lambda: self._sediment_porosity_values(self.depth(age),sed_id)).copy()
         d = self.depth(age)
-        x1=d[1:]/1e3
-        x2 = d[:-1]/1e3
-        diff = x2 - x1
-        exp = -1*initial_decay
-        phi1 = np.exp(exp*x1)*np.expm1(exp*diff)/diff
-        v=-1*initial_poro/initial_decay*phi1
-        v[np.isnan(v)] = 0
         d = (d[1:]+d[:-1])/2
         if isinstance(sediment_id,int):
             top_idx,base_idx=self._filter_sed_id_index(sediment_id,sed_id)
@@ -220,14 +260,7 @@ class Results:
         np.ndarray
             Conductivity of layers at 20C reference temperature (W/K.m^2)
         """
-        sed_id = self.sediment_ids(age)
-        cond = np.full(sed_id.size,fill_value=np.nan,dtype=float)
-        cond[sed_id == -1 ] = self._k_crust
-        cond[sed_id == -2 ] = self._k_lith
-        cond[sed_id == -3 ] = self._k_asth
-        for idx, row in self._sediment_input.iterrows():
-            cond[sed_id == idx ] = row["k_cond"]
-        return cond
+        return self._cached(("reference_conductivity",age),lambda: self._layer_property(self.sediment_ids(age),"k_cond"))
 
     def effective_conductivity(self,age:int,sediment_id:int|None=None)->resultValues:
         """Effective conductivity at the centre of cells
@@ -245,7 +278,7 @@ class Results:
             Effective conductivity at centre of cells (W/K.m^2)
         """
         from .forward_modelling import Forward_model
-        v = Forward_model._sediment_conductivity_sekiguchi(self.sediment_porosity(age)["values"],self._reference_conductivity(age),self.temperature(age)["values"])
+        v = self._cached(("effective_conductivity",age),lambda: Forward_model._sediment_conductivity_sekiguchi(self.sediment_porosity(age)["values"],self._reference_conductivity(age),self.temperature(age)["values"])).copy()
         d = self.depth(age)
         d = (d[1:]+d[:-1])/2
         sed_id = self.sediment_ids(age)
@@ -274,7 +307,7 @@ class Results:
         t = self.temperature(age)["values"]
         d = self.depth(age)
         sed_id = self.sediment_ids(age)
-        v = self.effective_conductivity(age)["values"]*(t[1:]-t[:-1])/(d[1:]-d[:-1])
+        v = self._cached(("heatflow",age),lambda: self.effective_conductivity(age)["values"]*(t[1:]-t[:-1])/(d[1:]-d[:-1])).copy()
         d = (d[1:]+d[:-1])/2
         if isinstance(sediment_id,int):
             top_idx,base_idx=self._filter_sed_id_index(sediment_id,sed_id)
@@ -308,6 +341,172 @@ class Results:
     def seabed(self,age:int)->np.ndarray[np.float64]:
         idx = np.where(~np.isnan(self._temperature[:,age]))[0][0]
         return self._depth[idx,age]
+
+    def top_crust_all_ages(self)->np.ndarray[np.float64]:
+        """Depth of crust for all ages
+
+        Returns
+        -------
+        np.ndarray
+            Depth of crust from sea level (m) per age. NaN where there is no crust
+        """
+        return self._depth_of_first(self._sediments_ids == -1)
+
+    def top_lithosphere_all_ages(self)->np.ndarray[np.float64]:
+        """Depth of lithospheric mantle for all ages
+
+        Returns
+        -------
+        np.ndarray
+            Depth of lithospheric mantle / Moho from sea level (m) per age
+        """
+        return self._depth_of_first(self._sediments_ids == -2)
+
+    def top_asthenosphere_all_ages(self)->np.ndarray[np.float64]:
+        """Depth of Asthenosphere for all ages
+
+        Returns
+        -------
+        np.ndarray
+            Depth of Asthenosphere from sea level (m) per age
+        """
+        return self._depth_of_first(self._sediments_ids == -3)
+
+    def crust_thickness_all_ages(self)->np.ndarray[np.float64]:
+        """Thickness of crust for all ages
+
+        Returns
+        -------
+        np.ndarray
+            Thickness of crust (m) per age
+        """
+        return self.top_lithosphere_all_ages()-self.top_crust_all_ages()
+
+    def lithosphere_thickness_all_ages(self)->np.ndarray[np.float64]:
+        """Thickness of lithospheric mantle for all ages
+
+        Returns
+        -------
+        np.ndarray
+            Thickness of lithospheric mantle (m) per age
+        """
+        return self.top_asthenosphere_all_ages()-self.top_lithosphere_all_ages()
+
+    def seabed_all_ages(self)->np.ndarray[np.float64]:
+        """Depth of seabed for all ages
+
+        Returns
+        -------
+        np.ndarray
+            Depth of seabed from sea level (m) per age
+        """
+        return self._depth_of_first(~np.isnan(self._temperature))
+
+    def temperature_at_depths(self,depths:np.ndarray[np.float64]|float)->np.ndarray[np.float64]:
+        """Temperature at given depths for all ages, linearly interpolated between cell boundaries
+
+        Parameters
+        ----------
+        depths : np.ndarray[np.float64] | float
+            Depths from sea level (m)
+
+        Returns
+        -------
+        np.ndarray
+            Temperature with shape (number of depths, number of ages). NaN above seabed and below the model
+        """
+        depths = np.atleast_1d(np.asarray(depths,dtype=float))
+        cols = np.arange(self._depth.shape[1])
+        res = np.full((depths.size,cols.size),np.nan)
+        with np.errstate(invalid="ignore"):
+            for k,z in enumerate(depths):
+                below = self._depth >= z
+                idx = np.argmax(below,axis=0)
+                exact = self._depth[idx,cols] == z
+                i1 = np.maximum(idx,1)
+                d0,d1 = self._depth[i1-1,cols],self._depth[i1,cols]
+                t0,t1 = self._temperature[i1-1,cols],self._temperature[i1,cols]
+                v = t0+(z-d0)/(d1-d0)*(t1-t0)
+                v = np.where(exact,self._temperature[idx,cols],v)
+                res[k] = np.where(np.any(below,axis=0)&((idx>0)|exact),v,np.nan)
+        return res
+
+    def _sediment_porosity_all_ages(self)->np.ndarray[np.float64]:
+        """Porosity at the centre of cells for all ages, with shape (number of cells, number of ages)
+        """
+        return self._cached(("porosity",None),lambda: self._sediment_porosity_values(self._depth,self._sediments_ids))
+
+    def _sediment_porosity_values(self,d:np.ndarray,sed_id:np.ndarray)->np.ndarray[np.float64]:
+        """Mean porosity of cells between depths d[:-1] and d[1:], with layer ids sed_id
+        """
+        initial_poro = self._layer_property(sed_id,"phi")
+        initial_decay = self._layer_property(sed_id,"decay")
+        x1=d[1:]/1e3
+        x2 = d[:-1]/1e3
+        diff = x2 - x1
+        exp = -1*initial_decay
+        with np.errstate(divide="ignore", invalid="ignore"):
+            phi1 = np.exp(exp*x1)*np.expm1(exp*diff)/diff
+            v=-1*initial_poro/initial_decay*phi1
+        v[np.isnan(v)] = 0
+        return v
+
+    def _reference_conductivity_all_ages(self)->np.ndarray[np.float64]:
+        """Conductivity of layers at 20C reference temperature for all ages, with shape (number of cells, number of ages)
+        """
+        return self._cached(("reference_conductivity",None),lambda: self._layer_property(self._sediments_ids,"k_cond"))
+
+    def heatflow_all_ages(self)->np.ndarray[np.float64]:
+        """Heat flow at the centre of cells for all ages
+
+        Returns
+        -------
+        np.ndarray
+            Heat flow with shape (number of cells, number of ages)
+        """
+        return self._heatflow_all_ages().copy()
+
+    def _heatflow_all_ages(self)->np.ndarray[np.float64]:
+        """Heat flow at the centre of cells for all ages, cached (read-only)
+        """
+        from .forward_modelling import Forward_model
+        t = self._temperature
+        d = self._depth
+        def hf():
+            k = Forward_model._sediment_conductivity_sekiguchi(self._sediment_porosity_all_ages(),self._reference_conductivity_all_ages(),t)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return k*(t[1:]-t[:-1])/(d[1:]-d[:-1])
+        return self._cached(("heatflow",None),hf)
+
+    def basement_heatflow_all_ages(self)->np.ndarray[np.float64]:
+        """Heat flow from the crust to the base of sediments for all ages
+
+        Returns
+        -------
+        np.ndarray
+            Basement heat flow (W/m3) per age. NaN where there is no crust
+        """
+        mask = self._sediments_ids == -1
+        idx = np.argmax(mask,axis=0)
+        hf = self._heatflow_all_ages()[idx,np.arange(mask.shape[1])]
+        return np.where(np.any(mask,axis=0),hf,np.nan)
+
+    def _depth_of_first(self,mask:np.ndarray)->np.ndarray[np.float64]:
+        """Depth of the first row where mask is True, for all ages at once
+
+        Parameters
+        ----------
+        mask : np.ndarray
+            Boolean array with the shape of the depth array (or one row less, for cell values)
+
+        Returns
+        -------
+        np.ndarray
+            Depth per age. NaN for ages where mask is nowhere True
+        """
+        idx = np.argmax(mask,axis=0)
+        val = self._depth[idx,np.arange(mask.shape[1])]
+        return np.where(np.any(mask,axis=0),val,np.nan)
     
     def _filter_sed_id_index(self,sed_id:int,sed_id_arr:np.ndarray)->Tuple[int,int]:
         """Filter results by layer id
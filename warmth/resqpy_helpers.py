@@ -64,6 +64,27 @@ def read_mesh_resqml(epcfilename, meshTitle = 'tetramesh'):
         prop = rqp.Property(model, uuid = prop_uuid)
         print(title, prop.indexable_element(), prop.uom(), prop.array_ref()[0:10] )
     
+def unique_faces(cells, faces):
+    """Extracts the distinct faces of a mesh of cells of one shape.
+       cells: array of shape (num_cells, nodes_per_cell) of node indices
+       faces: list of faces, each a list of the local node indices of one face of a cell
+
+       returns nodes_per_face (shape (num_faces, nodes per face), in order of first occurrence), 
+       faces_per_cell (shape (num_cells * len(faces),), index of the face for each face of each cell) and 
+       face_is_repeated (same shape, True where the face was already encountered in a previous cell face)
+    """
+    cells = np.asarray(cells)
+    cell_faces = cells[:, np.asarray(faces)].reshape(-1, len(faces[0]))
+    assert not np.any(cell_faces==-1)
+    _, first, inverse = np.unique(np.sort(cell_faces, axis=1), axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # renumber the distinct faces in order of first occurrence
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.shape[0])
+    face_is_repeated = first[inverse] != np.arange(cell_faces.shape[0])
+    return cell_faces[first[order]], rank[inverse], face_is_repeated
+
 def write_tetra_grid_with_properties(filename, nodes, cells, modelTitle = "tetramesh",
     Temp_per_vertex=None, age_per_vertex=None, poro0_per_cell=None, decay_per_cell=None, density_per_cell=None,
     cond_per_cell=None, rhp_per_cell=None, lid_per_cell=None ):
@@ -72,47 +93,28 @@ def write_tetra_grid_with_properties(filename, nodes, cells, modelTitle = "tetra
        NOTE: writing properties that are defines per-node (have 'nodes' as indexable element) requires a patched version of resqpy!
     """
     node_count = len(nodes)
-    faces_per_cell = []
-    nodes_per_face = []
-    faces_dict = {}
-    faces_repeat = np.zeros(node_count*100, dtype = bool)
-    cell_face_is_right_handed = np.zeros(len(cells)*4, dtype = bool)
-    for it,tet in enumerate(cells):
-        midp = ( nodes[tet[0],:] + nodes[tet[1],:] + nodes[tet[2],:] + nodes[tet[3],:] ) * 0.25
-        for ir,tri in enumerate([[0,1,2],[0,1,3],[1,2,3],[2,0,3]]):
-            face0 = [tet[x] for x in tri ]
-            assert -1 not in face0
-
-            #
-            # the point order in the tetrahedra may not be consistent
-            #   best to test every face individually
-            #
-            e0 = nodes[face0[1],:] - nodes[face0[0],:]
-            e1 = nodes[face0[2],:] - nodes[face0[0],:]
-            normal = np.cross(e0,e1)
-            midp_face = ( nodes[face0[0],:] + nodes[face0[1],:] + nodes[face0[2],:]) / 3.0
-            sign = np.dot( midp-midp_face, normal )
-            face_handedness = (sign>0)
-
-            fkey0 = ( x for x in sorted(face0) )
-            #
-            # keep track of which faces are encountered once vs. more than once
-            # faces that are encountered the second time will need to use the reverse handedness
-            #
-            face_is_repeated = False
-            if (fkey0 not in faces_dict):
-                faces_dict[fkey0] = len(nodes_per_face)
-                nodes_per_face.extend(face0)
-                cell_face_is_right_handed[it*4+ir] = face_handedness
-            else:
-                face_is_repeated = True
-                cell_face_is_right_handed[it*4+ir] = not face_handedness
-            fidx0 = faces_dict.get(fkey0)            
-            faces_per_cell.append(fidx0/3)
-            faces_repeat[int(fidx0/3)] = face_is_repeated
+    nodes = np.asarray(nodes)
+    cells = np.asarray(cells)
+    tris = [[0,1,2],[0,1,3],[1,2,3],[2,0,3]]
+    nodes_per_face, faces_per_cell, face_is_repeated = unique_faces(cells, tris)
+
+    #
+    # the point order in the tetrahedra may not be consistent
+    #   best to test every face individually
+    #
+    midp = np.mean(nodes[cells,:], axis=1)
+    face_pos = nodes[cells[:, np.asarray(tris)],:]    # (cells, 4 faces, 3 points, xyz)
+    normal = np.cross(face_pos[:,:,1,:]-face_pos[:,:,0,:], face_pos[:,:,2,:]-face_pos[:,:,0,:])
+    midp_face = np.mean(face_pos, axis=2)
+    sign = np.sum( (midp[:,None,:]-midp_face) * normal, axis=2 )
+    face_handedness = (sign>0).reshape(-1)
+    #
+    # faces that are encountered the second time will need to use the reverse handedness
+    #
+    cell_face_is_right_handed = face_handedness != face_is_repeated
     
-    set_cell_count = int(len(faces_per_cell)/4)
-    face_count = int(len(nodes_per_face)/3)
+    set_cell_count = cells.shape[0]
+    face_count = nodes_per_face.shape[0]
 
     # cell_face_is_right_handed = np.zeros(face_count, dtype = bool)
     # cell_face_is_right_handed[faces_repeat[0:face_count]] = True
@@ -133,12 +135,12 @@ def write_tetra_grid_with_properties(filename, nodes, cells, modelTitle = "tetra
     # faces
     tetra.face_count = face_count
     tetra.faces_per_cell_cl = np.arange(4, 4 * set_cell_count + 1, 4, dtype = int)
-    tetra.faces_per_cell = np.array(faces_per_cell)
+    tetra.faces_per_cell = faces_per_cell
 
     # nodes
     tetra.node_count = node_count
     tetra.nodes_per_face_cl = np.arange(3, 3 * face_count + 1, 3, dtype = int)
-    tetra.nodes_per_face = np.array(nodes_per_face)
+    tetra.nodes_per_face = nodes_per_face.reshape(-1)
 
     # face handedness
     tetra.cell_face_is_right_handed = cell_face_is_right_handed  # False for all faces for external cells (1 to 4)
@@ -308,36 +310,16 @@ def write_hexa_grid_with_properties(filename, nodes, cells, modelTitle = "hexame
        NOTE: writing properties that are defines per-node (have 'nodes' as indexable element) requires a patched version of resqpy!
     """
     node_count = len(nodes)
-    faces_per_cell = []
-    nodes_per_face = []
-    faces_dict = {}
-    faces_repeat = np.zeros(node_count*100, dtype = bool)
-
-    cell_face_is_right_handed = np.zeros( len(cells)*6, dtype = bool)
-    for ih,hexa in enumerate(cells):
-        faces= [[0,3,2,1], [0,1,5,4], [1,2,6,5], [2,3,7,6], [3,0,4,7], [4,5,6,7]]
-        for iq,quad in enumerate(faces):
-            face0 = [hexa[x] for x in quad ]
-            assert -1 not in face0
-            fkey0 = ( x for x in sorted(face0) )
-            #
-            # keep track of which faces are encountered once vs. more than once
-            # faces that are encountered the second time will need to use the reverse handedness
-            #
-            face_is_repeated = False
-            if (fkey0 not in faces_dict):
-                faces_dict[fkey0] = len(nodes_per_face)
-                nodes_per_face.extend(face0)
-                cell_face_is_right_handed[(ih*6 + iq)] = False
-            else:
-                face_is_repeated = True
-                cell_face_is_right_handed[(ih*6 + iq)] = True
-            fidx0 = faces_dict.get(fkey0)            
-            faces_per_cell.append(fidx0/4)
-            faces_repeat[int(fidx0/4)] = face_is_repeated
+    cells = np.asarray(cells)
+    faces= [[0,3,2,1], [0,1,5,4], [1,2,6,5], [2,3,7,6], [3,0,4,7], [4,5,6,7]]
+    nodes_per_face, faces_per_cell, face_is_repeated = unique_faces(cells, faces)
+    #
+    # faces that are encountered the second time (from the neighbouring cell) need to use the reverse handedness
+    #
+    cell_face_is_right_handed = face_is_repeated
     
-    set_cell_count = int(len(faces_per_cell)/6)
-    face_count = int(len(nodes_per_face)/4)
+    set_cell_count = cells.shape[0]
+    face_count = nodes_per_face.shape[0]
 
 
     model = rq.new_model(filename)
@@ -356,12 +338,12 @@ def write_hexa_grid_with_properties(filename, nodes, cells, modelTitle = "hexame
     # faces
     hexa.face_count = face_count
     hexa.faces_per_cell_cl = np.arange(6, 6 * set_cell_count + 1, 6, dtype = int)
-    hexa.faces_per_cell = np.array(faces_per_cell)
+    hexa.faces_per_cell = faces_per_cell
 
     # nodes
     hexa.node_count = node_count
     hexa.nodes_per_face_cl = np.arange(4, 4 * face_count + 1, 4, dtype = int)
-    hexa.nodes_per_face = np.array(nodes_per_face)
+    hexa.nodes_per_face = nodes_per_face.reshape(-1)
 
     # face handedness
     hexa.cell_face_is_right_handed = cell_face_is_right_handed  # False for all faces for external cells
@@ -5,6 +5,7 @@ import concurrent.futures
 from pathlib import Path
 
 import time
+from typing import Callable
 import numpy as np
 from warmth.postprocessing import Results_interpolator
 from warmth.utils import load_pickle
@@ -69,6 +70,71 @@ def runWorker(args):
     result_path = worker.run()
     return result_path
 
+
+def adaptive_full_simulation_nodes(valid:np.ndarray[np.bool_], features:Callable[[tuple[int,int]],np.ndarray[np.float64]], initial_every:int=8)->set[tuple[int,int]]:
+    """Select the nodes for full simulation by refining a coarse lattice where neighbouring results disagree
+
+    The grid is split into blocks with corners on every initial_every-th row and column (and the last row and column).
+    The features of the valid corner nodes of a block are compared: if any feature differs by more than 1 between two
+    corners, the results are not smooth enough to be interpolated over the block and it is split in four, which adds
+    the nodes at the block edge midpoints and centre. Blocks are refined until all pass or they have no interior nodes.
+
+    Parameters
+    ----------
+    valid : np.ndarray[np.bool_]
+        True for nodes that can be simulated, shape (rows, cols)
+    features : Callable[[tuple[int,int]],np.ndarray[np.float64]]
+        Runs the full simulation of the node at (row, col) and returns its results scaled by the tolerated interpolation
+        error, e.g. beta/beta_tolerance. Called once per selected node. NaN (e.g. failed node) forces refinement
+    initial_every : int, optional
+        Spacing of the initial lattice, by default 8
+
+    Returns
+    -------
+    set[tuple[int,int]]
+        Indices of the nodes that were fully simulated
+    """
+    if initial_every < 1:
+        raise Exception("Invalid input")
+    values:dict[tuple[int,int],np.ndarray[np.float64]] = {}
+    def value(index:tuple[int,int])->np.ndarray[np.float64]|None:
+        if not valid[index]:
+            return None
+        if index not in values:
+            values[index] = np.atleast_1d(np.asarray(features(index), dtype=np.float64))
+        return values[index]
+
+    def disagrees(corner_values:list[np.ndarray[np.float64]])->bool:
+        if len(corner_values) < 2:
+            return True
+        if any(v.shape != corner_values[0].shape for v in corner_values):
+            return True
+        stacked = np.stack(corner_values)
+        spread = np.max(stacked, axis=0) - np.min(stacked, axis=0)
+        return bool(np.any(~(spread <= 1)))
+
+    def spans(n:int)->list[tuple[int,int]]:
+        breaks = sorted(set(range(0, n, initial_every)) | {n-1})
+        return list(zip(breaks[:-1], breaks[1:])) or [(0, 0)]
+
+    rows, cols = valid.shape
+    blocks = [(r0, r1, c0, c1) for r0, r1 in spans(rows) for c0, c1 in spans(cols)]
+    while len(blocks) > 0:
+        refined = []
+        for r0, r1, c0, c1 in blocks:
+            corners = [v for v in (value((r, c)) for r in (r0, r1) for c in (c0, c1)) if v is not None]
+            has_interior = (r1-r0 > 1) or (c1-c0 > 1)
+            if not has_interior or not valid[r0:r1+1, c0:c1+1].any():
+                continue
+            if disagrees(corners):
+                rm = (r0+r1)//2
+                cm = (c0+c1)//2
+                row_halves = [(r0, rm), (rm, r1)] if r1-r0 > 1 else [(r0, r1)]
+                col_halves = [(c0, cm), (cm, c1)] if c1-c0 > 1 else [(c0, c1)]
+                refined.extend((a, b, c, d) for a, b in row_halves for c, d in col_halves)
+        blocks = refined
+    return set(values.keys())
+
 class Simulator:
     """Solving model
     """
@@ -147,6 +213,57 @@ class Simulator:
                 self.forward_modelling.simulate_single_node()
         return
 
+    def run_adaptive(self, initial_every:int=8, beta_tolerance:float=0.05, subsidence_tolerance:float=50.0)->int:
+        """Serial simulation with full 1D simulation on an adaptively refined subset of the nodes
+
+        Starts with full simulations on a lattice of every initial_every-th node and adds nodes where the beta factors or
+        the subsidence of neighbouring simulated nodes differ by more than the tolerances (see adaptive_full_simulation_nodes).
+        The remaining nodes only get their sediments simulated and are marked for interpolation by Results_interpolator.
+
+        Parameters
+        ----------
+        initial_every : int, optional
+            Spacing of the initial lattice, by default 8
+        beta_tolerance : float, optional
+            Tolerated difference of beta factor between neighbouring simulated nodes, by default 0.05
+        subsidence_tolerance : float, optional
+            Tolerated difference of subsidence (m) at any age between neighbouring simulated nodes, by default 50.0
+
+        Returns
+        -------
+        int
+            Number of nodes set to partial simulation
+        """
+        nodes = self._builder.nodes
+        valid = np.array([[isinstance(n, bool) is False for n in row] for row in nodes], dtype=bool)
+
+        def features(index:tuple[int,int])->np.ndarray[np.float64]:
+            node = nodes[index[0]][index[1]]
+            node._full_simulation = True
+            self.forward_modelling.current_node = node
+            try:
+                self.forward_modelling.simulate_single_node()
+            except Exception as e:
+                node.error = e
+                logger.error(node.error)
+                return np.array([np.nan])
+            if node.error is not None or node.subsidence is None:
+                return np.array([np.nan])
+            return np.concatenate([np.atleast_1d(node.beta)/beta_tolerance, node.subsidence/subsidence_tolerance])
+
+        full = adaptive_full_simulation_nodes(valid, features, initial_every)
+        count = 0
+        for index in zip(*np.nonzero(valid)):
+            index = (int(index[0]), int(index[1]))
+            if index not in full:
+                node = nodes[index[0]][index[1]]
+                node._full_simulation = False
+                self.forward_modelling.current_node = node
+                self.forward_modelling._sedimentation()
+                count += 1
+        logger.info(f"Full simulation of {len(full)} nodes, setting {count} nodes to partial simulation")
+        return count
+
     def _filter_full_sim(self)->int:
         count=0
         minimum_node_per_axis=5